@@ -0,0 +1,124 @@
+"""
+Background planning so that solving overlaps with action execution (see main.pipelined_planning).
+
+The executor submits snapshots of the planning inputs and keeps executing the current plan; the planner thread solves
+the latest submitted snapshot (older pending ones are dropped) and the executor swaps in the result once it is ready.
+Plans are tagged with an epoch, and invalidate() (e.g., on a stage transition or backtracking) discards the pending
+snapshot as well as the results of solves that are still running.
+"""
+import atexit
+import threading
+
+
+class AsyncPlanner:
+    def __init__(self, plan_fn):
+        """
+        Args:
+            plan_fn (callable): plan_fn(snapshot) -> plan, called on the planner thread.
+        """
+        self.plan_fn = plan_fn
+        self._cond = threading.Condition()
+        self._epoch = 0
+        self._request = None  # (epoch, snapshot) waiting to be solved
+        self._result = None  # (epoch, snapshot, plan) waiting to be swapped in
+        self._running_epoch = None  # epoch of the snapshot being solved (None if idle)
+        self._error = None
+        self._stop = False
+        self._thread = None
+
+    def submit(self, snapshot):
+        """solve snapshot in the background, replacing the pending snapshot if the planner is still busy"""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._planner_loop, name='planner', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            self._request = (self._epoch, snapshot)
+            self._cond.notify_all()
+
+    def poll(self):
+        """
+        Returns:
+            (snapshot, plan) of the newest valid plan if one finished since the last call, otherwise None (does not block).
+        """
+        with self._cond:
+            return self._pop_result()
+
+    def wait(self):
+        """
+        Returns:
+            (snapshot, plan) of the newest valid plan, blocking until the snapshots of the current epoch are solved
+            (None if none is pending or being solved, e.g., only a solve invalidated by invalidate() is still running).
+        """
+        with self._cond:
+            while self._error is None and not self._has_valid_result() and self._is_planning():
+                self._cond.wait()
+            return self._pop_result()
+
+    def is_idle(self):
+        """whether no snapshot is pending or being solved"""
+        with self._cond:
+            return self._running_epoch is None and self._request is None
+
+    def is_planning(self):
+        """whether a snapshot of the current epoch is pending or being solved (solves invalidated since do not count)"""
+        with self._cond:
+            return self._is_planning()
+
+    def invalidate(self):
+        """discard the pending snapshot, the unclaimed plan and the plans of the solves that are still running"""
+        with self._cond:
+            self._epoch += 1
+            self._request = None
+            self._result = None
+
+    def close(self):
+        """stop the planner thread after the running solve"""
+        if self._thread is not None:
+            with self._cond:
+                self._stop = True
+                self._cond.notify_all()
+            self._thread.join()
+            self._thread = None
+            atexit.unregister(self.close)
+
+    # ======================================
+    # = internal functions
+    # ======================================
+    def _is_planning(self):
+        return self._request is not None or self._running_epoch == self._epoch
+
+    def _has_valid_result(self):
+        return self._result is not None and self._result[0] == self._epoch
+
+    def _pop_result(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('planning failed') from error
+        if self._result is None or self._result[0] != self._epoch:
+            self._result = None
+            return None
+        result, self._result = self._result[1:], None
+        return result
+
+    def _planner_loop(self):
+        while True:
+            with self._cond:
+                while self._request is None and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                epoch, snapshot = self._request
+                self._request = None
+                self._running_epoch = epoch
+            try:
+                plan, error = self.plan_fn(snapshot), None
+            except Exception as e:
+                plan, error = None, e
+            with self._cond:
+                self._running_epoch = None
+                if error is not None:
+                    self._error = error
+                elif epoch == self._epoch:
+                    self._result = (epoch, snapshot, plan)
+                self._cond.notify_all()
@@ -0,0 +1,292 @@
+"""
+Benchmark harness for the subgoal and path solvers based on recorded problem snapshots.
+
+Capture: set snapshot_dir in the subgoal_solver / path_solver section of configs/config.yaml and run a task as usual.
+Every call to solve() writes its inputs (poses, keypoints, movable mask, SDF grid, collision points, joint positions,
+warm start, constraint source text, grasping state queried by the constraints and the IK setup) to
+<snapshot_dir>/<session>/<solver type>_<index>.npz.
+
+Replay (no simulator needed, IK uses the numpy backend by default):
+    python benchmark.py --snapshots ./snapshots --configs ./configs/config.yaml ./configs/other_config.yaml
+Each snapshot is solved with the solvers built from each config, and the latency percentiles, objective evaluations,
+IK calls, success rate and final cost are reported per config and solver type.
+IK calls made in multistart worker processes are not counted.
+"""
+import os
+import glob
+import json
+import datetime
+import argparse
+import numpy as np
+from scipy.optimize import OptimizeResult
+from utils import get_config, load_functions_from_text
+from ik_solver import IKSolver, CachedIKSolver
+from sdf_utils import SparseSDF
+
+CONSTRAINT_ARGS = ['goal_constraints', 'path_constraints']
+IK_ARRAYS = ['reset_joint_pos', 'world2robot_homo']
+SPARSE_SDF_ARRAYS = ['brick_ids', 'brick_fill', 'bricks']
+
+
+def _get_grasping_cost_fn(constraints):
+    """grasping cost function (environment query) that the loaded constraint functions call, if any"""
+    for fn in constraints:
+        fn = getattr(fn, 'fn', fn)  # unwrap VectorizedConstraint
+        grasping_cost_fn = getattr(fn, '__globals__', {}).get('get_grasping_cost_by_keypoint_idx', None)
+        if grasping_cost_fn is not None:
+            return grasping_cost_fn
+    return None
+
+
+class SnapshotRecorder:
+    """
+    Writes the inputs of solver calls to disk (see module docstring).
+    """
+    def __init__(self, snapshot_dir, solver_type, ik_solver):
+        self.save_dir = os.path.join(snapshot_dir, datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S"))
+        self.solver_type = solver_type
+        self.ik_solver = ik_solver
+        self.count = 0
+        os.makedirs(self.save_dir, exist_ok=True)
+
+    def record(self, last_opt_result, **solve_args):
+        """
+        Args:
+            last_opt_result (OptimizeResult or None): warm start of the solver.
+            solve_args: keyword arguments of solve().
+        Returns:
+            str: path of the snapshot.
+        """
+        arrays = dict()
+        meta = {
+            'solver_type': self.solver_type,
+            'args': dict(),
+            'constraints': dict(),
+            'grasping_costs': None,
+            'ik': {
+                'robot_description_path': self.ik_solver.robot_description_path,
+                'robot_urdf_path': self.ik_solver.robot_urdf_path,
+                'eef_name': self.ik_solver.eef_name,
+                'robot_name': self.ik_solver.robot_name,
+            },
+        }
+        constraints = []
+        for name, value in solve_args.items():
+            if name in CONSTRAINT_ARGS:
+                meta['constraints'][name] = [{'name': fn.__name__, 'source_text': fn.source_text} for fn in value]
+                constraints += list(value)
+            elif value is None or isinstance(value, (bool, np.bool_)):
+                meta['args'][name] = None if value is None else bool(value)
+            elif isinstance(value, SparseSDF):
+                meta['sparse_sdf'] = {'name': name, 'shape': list(value.shape), 'bounds_min': value.origin.tolist(),
+                                      'spacing': value.spacing.tolist(), 'band': value.band}
+                for attr in SPARSE_SDF_ARRAYS:
+                    arrays[f'{name}_{attr}'] = getattr(value, attr)
+            else:
+                arrays[name] = np.asarray(value)
+        # the first keypoint is the end-effector, the constraints query the grasping state by scene keypoint index
+        grasping_cost_fn = _get_grasping_cost_fn(constraints)
+        if grasping_cost_fn is not None:
+            meta['grasping_costs'] = [float(grasping_cost_fn(i)) for i in range(len(solve_args['keypoints']) - 1)]
+        for name in IK_ARRAYS:
+            arrays[name] = np.asarray(getattr(self.ik_solver, name), dtype=np.float64)
+        if last_opt_result is not None:
+            arrays['warm_start'] = np.asarray(last_opt_result.x)
+        save_path = os.path.join(self.save_dir, f'{self.solver_type}_{self.count:05d}.npz')
+        np.savez_compressed(save_path, meta=json.dumps(meta), **arrays)
+        self.count += 1
+        return save_path
+
+
+def _load_constraints(constraint_infos, get_grasping_cost_fn, vectorized):
+    functions_by_text = dict()
+    constraints = []
+    for info in constraint_infos:
+        if info['source_text'] not in functions_by_text:
+            functions = load_functions_from_text(info['source_text'], get_grasping_cost_fn, vectorized=vectorized)
+            functions_by_text[info['source_text']] = {fn.__name__: fn for fn in functions}
+        constraints.append(functions_by_text[info['source_text']][info['name']])
+    return constraints
+
+def load_snapshot(path, vectorized=True):
+    """
+    Returns:
+        dict: solver_type, solve_args (keyword arguments of solve()), warm_start (np.ndarray or None),
+            ik (IKSolver arguments).
+    """
+    data = np.load(path, allow_pickle=False)
+    meta = json.loads(str(data['meta']))
+    grasping_costs = meta['grasping_costs']
+    def get_grasping_cost(keypoint_idx):
+        return grasping_costs[keypoint_idx]
+    solve_args = dict(meta['args'])
+    sparse_sdf = meta.get('sparse_sdf', None)
+    sparse_sdf_arrays = [] if sparse_sdf is None else [f"{sparse_sdf['name']}_{attr}" for attr in SPARSE_SDF_ARRAYS]
+    for name in data.files:
+        if name not in ['meta', 'warm_start'] + IK_ARRAYS + sparse_sdf_arrays:
+            solve_args[name] = data[name]
+    if sparse_sdf is not None:
+        solve_args[sparse_sdf['name']] = SparseSDF(*[data[name] for name in sparse_sdf_arrays], sparse_sdf['shape'],
+                                                   sparse_sdf['bounds_min'], sparse_sdf['spacing'], sparse_sdf['band'])
+    for name, constraint_infos in meta['constraints'].items():
+        solve_args[name] = _load_constraints(constraint_infos, get_grasping_cost, vectorized)
+    ik_args = dict(meta['ik'], **{name: data[name] for name in IK_ARRAYS})
+    return {
+        'solver_type': meta['solver_type'],
+        'solve_args': solve_args,
+        'warm_start': data['warm_start'] if 'warm_start' in data.files else None,
+        'ik': ik_args,
+    }
+
+
+class CountingIKSolver:
+    """
+    Forwards to an IK solver and counts the calls and the number of solved target poses.
+    """
+    def __init__(self, ik_solver):
+        self.ik_solver = ik_solver
+        self.reset()
+
+    def __getattr__(self, name):
+        return getattr(self.ik_solver, name)
+
+    def reset(self):
+        self.num_calls = 0
+        self.num_poses = 0
+
+    def solve(self, target_pose_homo, **kwargs):
+        self.num_calls += 1
+        self.num_poses += 1
+        return self.ik_solver.solve(target_pose_homo, **kwargs)
+
+    def solve_batch(self, target_poses_homo, **kwargs):
+        self.num_calls += 1
+        self.num_poses += len(np.asarray(target_poses_homo).reshape(-1, 4, 4))
+        return self.ik_solver.solve_batch(target_poses_homo, **kwargs)
+
+
+def build_solver(solver_type, global_config, ik_args, ik_backend='numpy', path_overrides=None):
+    """
+    Build a solver from the config and the IK setup of a snapshot. Returns the solver and its CountingIKSolver.
+    """
+    from subgoal_solver import SubgoalSolver
+    from path_solver import PathSolver
+    ik_args = dict(ik_args, **(path_overrides or dict()))
+    ik_solver = IKSolver(
+        robot_description_path=ik_args['robot_description_path'],
+        robot_urdf_path=ik_args['robot_urdf_path'],
+        eef_name=ik_args['eef_name'],
+        reset_joint_pos=ik_args['reset_joint_pos'],
+        world2robot_homo=ik_args['world2robot_homo'],
+        robot_name=ik_args['robot_name'],
+        robot=None,
+        backend=ik_backend,
+    )
+    ik_config = global_config['ik_solver']
+    if ik_config['cache']:
+        ik_solver = CachedIKSolver(ik_solver,
+                                   max_size=ik_config['cache_size'],
+                                   pos_resolution=ik_config['cache_pos_resolution'],
+                                   rot_resolution=ik_config['cache_rot_resolution'],
+                                   seed_resolution=ik_config['cache_seed_resolution'])
+    ik_solver = CountingIKSolver(ik_solver)
+    solver_config = dict(global_config[solver_type], snapshot_dir=None)  # do not record the replayed solves
+    solver_cls = SubgoalSolver if solver_type == 'subgoal_solver' else PathSolver
+    return solver_cls(solver_config, ik_solver, ik_args['reset_joint_pos']), ik_solver
+
+def replay(snapshot_paths, global_config, ik_backend='numpy', path_overrides=None, repeats=1, seed=0, warmup=1):
+    """
+    Solve every snapshot with the solvers built from global_config. Each newly built solver first solves its first
+    snapshot warmup times without recording (JIT compilation, caches of the first call).
+    Returns:
+        list of dict: per-solve records (snapshot, solver_type, solve_time, nfev, ik_calls, ik_poses, success, cost).
+    """
+    solvers = dict()
+    records = []
+    for path in snapshot_paths:
+        snapshot = load_snapshot(path, vectorized=global_config['main']['vectorize_constraints'])
+        solver_key = (snapshot['solver_type'], json.dumps({k: np.asarray(v).tolist() for k, v in snapshot['ik'].items()}))
+        if solver_key not in solvers:
+            solvers[solver_key] = build_solver(snapshot['solver_type'], global_config, snapshot['ik'], ik_backend, path_overrides)
+            num_solves = warmup + repeats
+        else:
+            num_solves = repeats
+        solver, ik_counter = solvers[solver_key]
+        for i in range(num_solves):
+            np.random.seed(seed)
+            solver.last_opt_result = OptimizeResult(x=snapshot['warm_start']) if snapshot['warm_start'] is not None else None
+            ik_counter.reset()
+            _, debug_dict = solver.solve(**snapshot['solve_args'])
+            if i < num_solves - repeats:
+                continue
+            records.append({
+                'snapshot': path,
+                'solver_type': snapshot['solver_type'],
+                'solve_time': debug_dict['solve_time'],
+                'nfev': int(debug_dict['nfev']),
+                'ik_calls': ik_counter.num_calls,
+                'ik_poses': ik_counter.num_poses,
+                'success': bool(debug_dict['success']),
+                'cost': float(debug_dict['total_cost']),
+            })
+    return records
+
+def summarize(records):
+    """
+    Aggregate replay records per solver type.
+    """
+    summary = dict()
+    for solver_type in sorted(set(r['solver_type'] for r in records)):
+        rs = [r for r in records if r['solver_type'] == solver_type]
+        solve_times = np.array([r['solve_time'] for r in rs]) * 1000
+        summary[solver_type] = {
+            'num_solves': len(rs),
+            'latency_p50_ms': float(np.percentile(solve_times, 50)),
+            'latency_p90_ms': float(np.percentile(solve_times, 90)),
+            'latency_p99_ms': float(np.percentile(solve_times, 99)),
+            'mean_nfev': float(np.mean([r['nfev'] for r in rs])),
+            'mean_ik_calls': float(np.mean([r['ik_calls'] for r in rs])),
+            'mean_ik_poses': float(np.mean([r['ik_poses'] for r in rs])),
+            'success_rate': float(np.mean([r['success'] for r in rs])),
+            'mean_cost': float(np.mean([r['cost'] for r in rs])),
+            'median_cost': float(np.median([r['cost'] for r in rs])),
+        }
+    return summary
+
+def find_snapshots(paths):
+    snapshot_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            snapshot_paths += sorted(glob.glob(os.path.join(path, '**', '*.npz'), recursive=True))
+        else:
+            snapshot_paths.append(path)
+    return snapshot_paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--snapshots', type=str, nargs='+', required=True, help='snapshot files or directories (searched recursively)')
+    parser.add_argument('--configs', type=str, nargs='+', default=['./configs/config.yaml'], help='solver configurations to compare')
+    parser.add_argument('--ik_backend', type=str, default='numpy', help='IK backend used for replay (lula requires OmniGibson)')
+    parser.add_argument('--robot_urdf_path', type=str, default=None, help='override the recorded URDF path (e.g., when recorded with OmniGibson assets)')
+    parser.add_argument('--robot_description_path', type=str, default=None, help='override the recorded robot description path')
+    parser.add_argument('--repeats', type=int, default=1, help='number of solves per snapshot')
+    parser.add_argument('--warmup', type=int, default=1, help='number of unrecorded solves when a solver is first used')
+    parser.add_argument('--seed', type=int, default=0, help='random seed set before each solve')
+    parser.add_argument('--output', type=str, default=None, help='save the per-solve records and summaries as json')
+    args = parser.parse_args()
+
+    snapshot_paths = find_snapshots(args.snapshots)
+    path_overrides = {k: v for k, v in [('robot_urdf_path', args.robot_urdf_path), ('robot_description_path', args.robot_description_path)] if v is not None}
+    print(f'Replaying {len(snapshot_paths)} snapshots with {len(args.configs)} configs')
+    results = dict()
+    for config_path in args.configs:
+        records = replay(snapshot_paths, get_config(config_path), args.ik_backend, path_overrides, args.repeats, args.seed, args.warmup)
+        results[config_path] = {'summary': summarize(records), 'records': records}
+        for solver_type, stats in results[config_path]['summary'].items():
+            print(f'\n[{config_path} | {solver_type}]')
+            for k, v in stats.items():
+                print(f'  {k:<16}: {v:.4f}' if isinstance(v, float) else f'  {k:<16}: {v}')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
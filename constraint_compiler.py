@@ -0,0 +1,371 @@
+"""
+Batched evaluation of the VLM-generated ReKep constraint functions.
+
+The constraint functions are written for a single sample, i.e., end_effector of shape [3] and keypoints of shape [K, 3].
+Instead of rewriting their source, we call them once with BatchedArray inputs that carry a leading batch dimension
+and translate numpy calls to their batched counterparts (shifting axes, aligning broadcast dimensions).
+Anything that cannot be expressed this way (python control flow on values, unsupported numpy functions, etc.) raises
+NotVectorizable, and the constraint transparently falls back to a per-sample loop.
+"""
+import numpy as np
+
+
+class NotVectorizable(Exception):
+    pass
+
+
+_HANDLED_FUNCTIONS = {}
+
+def _implements(*np_functions):
+    def decorator(func):
+        for np_function in np_functions:
+            _HANDLED_FUNCTIONS[np_function] = func
+        return func
+    return decorator
+
+
+class BatchedArray:
+    """
+    Thin wrapper around an array of shape [B, *sample_shape] that behaves like a single sample of shape sample_shape.
+    """
+    def __init__(self, data):
+        self.data = np.asarray(data)
+
+    @property
+    def batch_size(self):
+        return self.data.shape[0]
+
+    @property
+    def shape(self):
+        return self.data.shape[1:]
+
+    @property
+    def ndim(self):
+        return self.data.ndim - 1
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def T(self):
+        axes = (0,) + tuple(range(self.data.ndim - 1, 0, -1))
+        return BatchedArray(self.data.transpose(axes))
+
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError('len() of unsized object')
+        return self.shape[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        if any(isinstance(i, BatchedArray) for i in index):
+            raise NotVectorizable('indexing with batched values')
+        if any(i is Ellipsis for i in index) or any(isinstance(i, np.ndarray) and i.dtype == bool and i.ndim > 1 for i in index):
+            raise NotVectorizable('unsupported index')
+        return BatchedArray(self.data[(slice(None),) + index])
+
+    # values cannot be collapsed into python scalars (e.g., in if-statements or builtin min/max)
+    def __bool__(self):
+        raise NotVectorizable('truth value of batched values')
+
+    def __float__(self):
+        raise NotVectorizable('conversion of batched values to float')
+
+    def __int__(self):
+        raise NotVectorizable('conversion of batched values to int')
+
+    def __index__(self):
+        raise NotVectorizable('batched values used as index')
+
+    def __array__(self, dtype=None, copy=None):
+        raise NotVectorizable('conversion of batched values to a plain array')
+
+    def item(self, *args):
+        raise NotVectorizable('conversion of batched values to python scalar')
+
+    def copy(self):
+        return BatchedArray(self.data.copy())
+
+    def sum(self, axis=None, keepdims=False):
+        return np.sum(self, axis=axis, keepdims=keepdims)
+
+    def mean(self, axis=None, keepdims=False):
+        return np.mean(self, axis=axis, keepdims=keepdims)
+
+    def max(self, axis=None, keepdims=False):
+        return np.max(self, axis=axis, keepdims=keepdims)
+
+    def min(self, axis=None, keepdims=False):
+        return np.min(self, axis=axis, keepdims=keepdims)
+
+    def dot(self, other):
+        return np.dot(self, other)
+
+    # arithmetic goes through __array_ufunc__
+    def __add__(self, other): return np.add(self, other)
+    def __radd__(self, other): return np.add(other, self)
+    def __sub__(self, other): return np.subtract(self, other)
+    def __rsub__(self, other): return np.subtract(other, self)
+    def __mul__(self, other): return np.multiply(self, other)
+    def __rmul__(self, other): return np.multiply(other, self)
+    def __truediv__(self, other): return np.true_divide(self, other)
+    def __rtruediv__(self, other): return np.true_divide(other, self)
+    def __pow__(self, other): return np.power(self, other)
+    def __rpow__(self, other): return np.power(other, self)
+    def __matmul__(self, other): return np.matmul(self, other)
+    def __rmatmul__(self, other): return np.matmul(other, self)
+    def __neg__(self): return np.negative(self)
+    def __pos__(self): return self
+    def __abs__(self): return np.abs(self)
+    def __lt__(self, other): return np.less(self, other)
+    def __le__(self, other): return np.less_equal(self, other)
+    def __gt__(self, other): return np.greater(self, other)
+    def __ge__(self, other): return np.greater_equal(self, other)
+    def __eq__(self, other): return np.equal(self, other)
+    def __ne__(self, other): return np.not_equal(self, other)
+    __hash__ = None
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or 'out' in kwargs:
+            raise NotVectorizable(f'unsupported ufunc call {ufunc.__name__}.{method}')
+        if ufunc is np.matmul:
+            return _batched_dot(*inputs)
+        aligned = _align(inputs)
+        result = ufunc(*aligned, **kwargs)
+        if isinstance(result, tuple):
+            return tuple(BatchedArray(r) for r in result)
+        return BatchedArray(result)
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func not in _HANDLED_FUNCTIONS:
+            raise NotVectorizable(f'unsupported numpy function {func.__name__}')
+        return _HANDLED_FUNCTIONS[func](*args, **kwargs)
+
+
+def _sample_ndim(x):
+    return x.ndim if isinstance(x, BatchedArray) else np.ndim(x)
+
+def _align(inputs):
+    """
+    Convert inputs to plain arrays such that numpy broadcasting matches per-sample broadcasting:
+    batched inputs get singleton dimensions inserted right after the batch dimension.
+    """
+    target_ndim = max(_sample_ndim(x) for x in inputs)
+    aligned = []
+    for x in inputs:
+        if isinstance(x, BatchedArray):
+            data = x.data
+            missing = target_ndim - x.ndim
+            if missing > 0:
+                data = data.reshape((data.shape[0],) + (1,) * missing + data.shape[1:])
+            aligned.append(data)
+        else:
+            aligned.append(np.asarray(x))
+    return aligned
+
+def _wrap(data):
+    return BatchedArray(data)
+
+def _sample_axes(x, axis):
+    """Map per-sample axis argument to axes of the batched data."""
+    if axis is None:
+        return tuple(range(1, x.ndim + 1))
+    if isinstance(axis, (tuple, list)):
+        return tuple(_sample_axes(x, a)[0] for a in axis)
+    axis = int(axis)
+    if axis < 0:
+        axis += x.ndim
+    if axis < 0 or axis >= x.ndim:
+        raise NotVectorizable('axis out of range')
+    return (axis + 1,)
+
+def _reduction(np_function):
+    def reduce(a, axis=None, keepdims=False, **kwargs):
+        if kwargs:
+            raise NotVectorizable(f'unsupported arguments for {np_function.__name__}')
+        if not isinstance(a, BatchedArray):
+            raise NotVectorizable('reduction over non-batched sequence')
+        return _wrap(np_function(a.data, axis=_sample_axes(a, axis), keepdims=keepdims))
+    return reduce
+
+for _np_function in (np.sum, np.mean, np.max, np.min, np.amax, np.amin, np.prod, np.any, np.all, np.std, np.var, np.median):
+    _implements(_np_function)(_reduction(_np_function))
+
+@_implements(np.linalg.norm)
+def _norm(x, ord=None, axis=None, keepdims=False):
+    if not isinstance(x, BatchedArray):
+        raise NotVectorizable('norm of non-batched sequence')
+    if axis is None:
+        if ord is None:
+            return _wrap(np.sqrt(np.sum(x.data * x.data, axis=_sample_axes(x, None), keepdims=keepdims)))
+        if x.ndim not in (1, 2):
+            raise NotVectorizable('norm order for >2 dimensional inputs')
+        axis = 0 if x.ndim == 1 else (0, 1)
+    axes = _sample_axes(x, axis)
+    return _wrap(np.linalg.norm(x.data, ord=ord, axis=axes[0] if len(axes) == 1 else axes, keepdims=keepdims))
+
+@_implements(np.cross)
+def _cross(a, b, axisa=-1, axisb=-1, axisc=-1, axis=None):
+    if (axisa, axisb, axisc, axis) != (-1, -1, -1, None):
+        raise NotVectorizable('cross product along non-default axis')
+    return _wrap(np.cross(*_align([a, b])))
+
+@_implements(np.dot, np.inner)
+def _batched_dot(a, b, out=None):
+    if out is not None:
+        raise NotVectorizable('dot with out argument')
+    ndim_a, ndim_b = _sample_ndim(a), _sample_ndim(b)
+    if ndim_a == 0 or ndim_b == 0:
+        return np.multiply(a, b)
+    a = a.data if isinstance(a, BatchedArray) else np.asarray(a)
+    b = b.data if isinstance(b, BatchedArray) else np.asarray(b)
+    subscripts = {
+        (1, 1): '...i,...i->...',
+        (2, 1): '...ij,...j->...i',
+        (1, 2): '...i,...ij->...j',
+        (2, 2): '...ij,...jk->...ik',
+    }
+    if (ndim_a, ndim_b) not in subscripts:
+        raise NotVectorizable('dot of >2 dimensional inputs')
+    return _wrap(np.einsum(subscripts[(ndim_a, ndim_b)], a, b))
+
+@_implements(np.clip)
+def _clip(a, a_min, a_max, **kwargs):
+    if kwargs:
+        raise NotVectorizable('unsupported arguments for clip')
+    return _wrap(np.clip(*_align([a, a_min, a_max])))
+
+@_implements(np.where)
+def _where(condition, *args):
+    if len(args) != 2:
+        raise NotVectorizable('single-argument where')
+    return _wrap(np.where(*_align([condition, *args])))
+
+def _broadcast_sequence(arrays):
+    """Broadcast a sequence of (batched or constant) arrays to a common [B, *sample_shape]."""
+    batch_size = next(x.batch_size for x in arrays if isinstance(x, BatchedArray))
+    sample_shape = np.broadcast_shapes(*[x.shape if isinstance(x, BatchedArray) else np.shape(x) for x in arrays])
+    broadcasted = [np.broadcast_to(data, (batch_size,) + sample_shape) for data in _align(arrays)]
+    return broadcasted, len(sample_shape)
+
+@_implements(np.stack)
+def _stack(arrays, axis=0, **kwargs):
+    arrays = list(arrays)
+    if kwargs or not any(isinstance(x, BatchedArray) for x in arrays):
+        raise NotVectorizable('unsupported stack')
+    broadcasted, sample_ndim = _broadcast_sequence(arrays)
+    if axis < 0:
+        axis += sample_ndim + 1
+    return _wrap(np.stack(broadcasted, axis=axis + 1))
+
+@_implements(np.concatenate)
+def _concatenate(arrays, axis=0, **kwargs):
+    arrays = list(arrays)
+    if kwargs or axis is None or not any(isinstance(x, BatchedArray) for x in arrays):
+        raise NotVectorizable('unsupported concatenate')
+    batch_size = next(x.batch_size for x in arrays if isinstance(x, BatchedArray))
+    datas = []
+    for x in arrays:
+        if isinstance(x, BatchedArray):
+            datas.append(x.data)
+        else:
+            x = np.asarray(x)
+            datas.append(np.broadcast_to(x, (batch_size,) + x.shape))
+    sample_ndim = datas[0].ndim - 1
+    if axis < 0:
+        axis += sample_ndim
+    return _wrap(np.concatenate(datas, axis=axis + 1))
+
+
+class VectorizedConstraint:
+    """
+    Wraps a single-sample constraint function so that it can also be evaluated on stacked inputs.
+    Calling the object behaves exactly like the original function; use batch() for stacked inputs.
+    Whether the function can be vectorized is determined on the first batched call by comparing against
+    the per-sample loop on a few samples; afterwards the chosen path is reused.
+    """
+    def __init__(self, fn, num_probe_samples=4, rtol=1e-6, atol=1e-8):
+        self.fn = fn
+        self.__name__ = getattr(fn, '__name__', 'constraint')
+        self.__doc__ = getattr(fn, '__doc__', None)
+        self.source_text = getattr(fn, 'source_text', None)
+        self.num_probe_samples = num_probe_samples
+        self.rtol = rtol
+        self.atol = atol
+        self.vectorized = None  # None: not yet determined
+
+    def __call__(self, end_effector, keypoints):
+        return self.fn(end_effector, keypoints)
+
+    def __repr__(self):
+        return f'VectorizedConstraint({self.__name__}, vectorized={self.vectorized})'
+
+    def batch(self, end_effectors, keypoints):
+        """
+        Args:
+            end_effectors (np.ndarray): [B, 3]
+            keypoints (np.ndarray): [B, K, 3]
+        Returns:
+            np.ndarray: [B] constraint violations.
+        """
+        batch_size = len(end_effectors)
+        if batch_size == 0:
+            return np.empty(0)
+        if self.vectorized is not False:
+            try:
+                violations = self._batch_vectorized(end_effectors, keypoints)
+            except Exception:
+                self.vectorized = False
+            else:
+                if self.vectorized is None:
+                    num_probe = min(self.num_probe_samples, batch_size)
+                    expected = self._batch_loop(end_effectors[:num_probe], keypoints[:num_probe])
+                    self.vectorized = bool(np.allclose(violations[:num_probe], expected, rtol=self.rtol, atol=self.atol, equal_nan=True))
+                if self.vectorized:
+                    return violations
+        return self._batch_loop(end_effectors, keypoints)
+
+    def _batch_vectorized(self, end_effectors, keypoints):
+        batch_size = len(end_effectors)
+        result = self.fn(BatchedArray(end_effectors), BatchedArray(keypoints))
+        if isinstance(result, BatchedArray):
+            if result.ndim != 0:
+                raise NotVectorizable('constraint returned a non-scalar value')
+            result = result.data
+        else:
+            # value does not depend on the inputs (e.g., grasping cost)
+            result = np.asarray(result, dtype=np.float64)
+            if result.ndim != 0:
+                raise NotVectorizable('constraint returned a non-scalar value')
+            result = np.full(batch_size, result)
+        return np.asarray(result, dtype=np.float64).reshape(batch_size)
+
+    def _batch_loop(self, end_effectors, keypoints):
+        return np.array([self.fn(end_effectors[i], keypoints[i]) for i in range(len(end_effectors))], dtype=np.float64)
+
+
+def batch_evaluate_constraints(constraints, transformed_keypoints):
+    """
+    Evaluate each constraint on [N, K, 3] transformed keypoints (the first keypoint is the end effector).
+    Constraints loaded with vectorized=True are evaluated on the whole batch at once.
+    Returns:
+        np.array: [N, num_constraints] violations.
+    """
+    violations = np.empty((len(transformed_keypoints), len(constraints)))
+    for j, constraint in enumerate(constraints):
+        if isinstance(constraint, VectorizedConstraint):
+            violations[:, j] = constraint.batch(transformed_keypoints[:, 0], transformed_keypoints[:, 1:])
+        else:
+            for i, keypoints in enumerate(transformed_keypoints):
+                violations[i, j] = constraint(keypoints[0], keypoints[1:])
+    return violations
@@ -5,9 +5,6 @@ import torch
 import os
 import datetime
 import transform_utils as T
-import trimesh
-import open3d as o3d
-import imageio
 import omnigibson as og
 from omnigibson.macros import gm
 from omnigibson.utils.usd_utils import PoseAPI, mesh_prim_mesh_to_trimesh_mesh, mesh_prim_shape_to_trimesh_mesh
@@ -16,6 +13,8 @@ from omnigibson.robots.piper import Piper
 from omnigibson.robots.franka import FrankaPanda
 from omnigibson.controllers import IsGraspingState
 from og_utils import OGCamera
+from video_recorder import VideoRecorder
+from sdf_utils import SDFManager, compute_closest_points
 from utils import (
     bcolors,
     get_clock_time,
@@ -23,6 +22,8 @@ from utils import (
     angle_between_quats,
     get_linear_interpolation_steps,
     linear_interpolate_poses,
+    select_cam_obs,
+    farthest_point_sampling,
 )
 from omnigibson.robots.manipulation_robot import ManipulationRobot
 from omnigibson.controllers.controller_base import ControlType, BaseController
@@ -62,9 +63,13 @@ BaseController.clip_control = custom_clip_control
 
 class ReKepOGEnv:
     def __init__(self, config, scene_file, verbose=False):
-        self.video_cache = []
         self.config = config
         self.verbose = verbose
+        self.video_recorder = VideoRecorder(mode=self.config['video_mode'],
+                                            max_frames=self.config['video_cache_size'],
+                                            decimation=self.config['video_decimation'],
+                                            fps=self.config['video_fps'],
+                                            stream_dir=os.path.join(os.path.dirname(__file__), 'output_logs'))
         self.config['scene']['scene_file'] = scene_file
         self.bounds_min = np.array(self.config['bounds_min'])
         self.bounds_max = np.array(self.config['bounds_max'])
@@ -97,8 +102,14 @@ class ReKepOGEnv:
         
         self.world2robot_homo = T.pose_inv(T.pose2mat(self.robot.get_position_orientation()))
         # initialize cameras
+        self.last_cam_obs = None
+        self._cam_obs_step = None
         self._initialize_cameras(self.config['camera'])
         self.last_og_gripper_action = 1.0
+        self.sdf_manager = None
+        self._gripper_collision_meshes = None
+        self._local_collision_points = dict()
+        self._collision_points_obj_in_hand = None
         breakpoint()
 
     # ======================================
@@ -107,8 +118,8 @@ class ReKepOGEnv:
     def get_sdf_voxels(self, resolution, exclude_robot=True, exclude_obj_in_hand=True):
         """
         open3d-based SDF computation
-        1. recursively get all usd prim and get their vertices and faces
-        2. compute SDF using open3d
+        1. recursively get all usd prim and get their world poses (vertices and faces are only extracted once)
+        2. incrementally update the SDF of the moved objects using open3d (see SDFManager)
         """
         start = time.time()
         exclude_names = ['wall', 'floor', 'ceiling']
@@ -121,54 +132,40 @@ class ReKepOGEnv:
             in_hand_obj = self.robot._ag_obj_in_hand[self.robot.default_arm]
             if in_hand_obj is not None:
                 exclude_names.append(in_hand_obj.name.lower())
-        trimesh_objects = []
+        mesh_entries = dict()
         for obj in self.og_env.scene.objects:
             if any([name in obj.name.lower() for name in exclude_names]):
                 continue
             for link in obj.links.values():
                 for mesh in link.collision_meshes.values():
-                    mesh_type = mesh.prim.GetPrimTypeInfo().GetTypeName()
-                    if mesh_type == 'Mesh':
-                        trimesh_object = mesh_prim_mesh_to_trimesh_mesh(mesh.prim)
-                    else:
-                        trimesh_object = mesh_prim_shape_to_trimesh_mesh(mesh.prim)
-                    world_pose_w_scale = PoseAPI.get_world_pose_with_scale(mesh.prim_path)
-                    trimesh_object.apply_transform(world_pose_w_scale)
-                    trimesh_objects.append(trimesh_object)
-        # chain trimesh objects
-        scene_mesh = trimesh.util.concatenate(trimesh_objects)
-        # Create a scene and add the triangle mesh
-        scene = o3d.t.geometry.RaycastingScene()
-        vertex_positions = scene_mesh.vertices
-        triangle_indices = scene_mesh.faces
-        vertex_positions = o3d.core.Tensor(vertex_positions, dtype=o3d.core.Dtype.Float32)
-        triangle_indices = o3d.core.Tensor(triangle_indices, dtype=o3d.core.Dtype.UInt32)
-        _ = scene.add_triangles(vertex_positions, triangle_indices)  # we do not need the geometry ID for mesh
-        # create a grid
-        shape = np.ceil((self.bounds_max - self.bounds_min) / resolution).astype(int)
-        steps = (self.bounds_max - self.bounds_min) / shape
-        grid = np.mgrid[self.bounds_min[0]:self.bounds_max[0]:steps[0],
-                        self.bounds_min[1]:self.bounds_max[1]:steps[1],
-                        self.bounds_min[2]:self.bounds_max[2]:steps[2]]
-        grid = grid.reshape(3, -1).T
-        # compute SDF
-        sdf_voxels = scene.compute_signed_distance(grid.astype(np.float32))
-        # convert back to np array
-        sdf_voxels = sdf_voxels.cpu().numpy()
-        # open3d has flipped sign from our convention
-        sdf_voxels = -sdf_voxels
-        sdf_voxels = sdf_voxels.reshape(shape)
+                    world_pose_w_scale = np.asarray(PoseAPI.get_world_pose_with_scale(mesh.prim_path))
+                    mesh_entries[mesh.prim_path] = (world_pose_w_scale, lambda prim=mesh.prim: self._get_local_trimesh(prim))
+        if self.sdf_manager is None or self.sdf_manager.resolution != resolution:
+            self.sdf_manager = SDFManager(self.bounds_min, self.bounds_max, resolution, margin=self.config['sdf_update_margin'],
+                                          sparse_band=self.config['sdf_sparse_band'])
+        sdf_voxels = self.sdf_manager.update(mesh_entries)
         self.verbose and print(f'{bcolors.WARNING}[environment.py | {get_clock_time()}] SDF voxels computed in {time.time() - start:.4f} seconds{bcolors.ENDC}')
         breakpoint()
         return sdf_voxels
 
-    def get_cam_obs(self):
-        self.last_cam_obs = dict()
-        for cam_id in self.cams:
-            self.last_cam_obs[cam_id] = self.cams[cam_id].get_obs()  # each containing rgb, depth, points, seg
+    def get_cam_obs(self, cam_ids=None, modalities=None):
+        """
+        Args:
+            cam_ids (list or None): cameras to return (all if None).
+            modalities (list or None): subset of rgb, depth, points, seg, intrinsic, extrinsic to return. If None, the
+                observations are returned as LazyObservation that compute each modality on first access.
+        Returns:
+            dict: {cam_id: observation}.
+        The observations are memoized per step_counter, so repeated calls within a step (and the point clouds
+        deprojected from depth) are computed only once.
+        """
+        if self._cam_obs_step != self.step_counter:
+            self.last_cam_obs = {cam_id: self.cams[cam_id].get_obs() for cam_id in self.cams}  # each containing rgb, depth, points, seg
+            self._cam_obs_step = self.step_counter
+        cam_obs = select_cam_obs(self.last_cam_obs, cam_ids, modalities)
         breakpoint()
-        return self.last_cam_obs
-    
+        return cam_obs
+
     def register_keypoints(self, keypoints):
         """
         Args:
@@ -185,36 +182,33 @@ class ReKepOGEnv:
         # exclude_names = ['wall', 'floor', 'ceiling', 'table', 'fetch', 'robot']
         robot_name = self.robot.name.lower()
         exclude_names = ['wall', 'floor', 'ceiling', 'table', robot_name, 'robot']
-        for idx, keypoint in enumerate(keypoints):
-            closest_distance = np.inf
-            for obj in self.og_env.scene.objects:
-                if any([name in obj.name.lower() for name in exclude_names]):
-                    continue
-                for link in obj.links.values():
-                    for mesh in link.visual_meshes.values():
-                        mesh_prim_path = mesh.prim_path
-                        mesh_type = mesh.prim.GetPrimTypeInfo().GetTypeName()
-                        if mesh_type == 'Mesh':
-                            trimesh_object = mesh_prim_mesh_to_trimesh_mesh(mesh.prim)
-                        else:
-                            trimesh_object = mesh_prim_shape_to_trimesh_mesh(mesh.prim)
-                        world_pose_w_scale = PoseAPI.get_world_pose_with_scale(mesh.prim_path)
-                        trimesh_object.apply_transform(world_pose_w_scale)
-                        points_transformed = trimesh_object.sample(1000)
-                        
-                        # find closest point
-                        dists = np.linalg.norm(points_transformed - keypoint, axis=1)
-                        point = points_transformed[np.argmin(dists)]
-                        distance = np.linalg.norm(point - keypoint)
-                        if distance < closest_distance:
-                            closest_distance = distance
-                            closest_prim_path = mesh_prim_path
-                            closest_point = point
-                            closest_obj = obj
-            self._keypoint_registry[idx] = (closest_prim_path, PoseAPI.get_world_pose(closest_prim_path))
+        # convert the visual meshes of the candidate objects once and register all keypoints in one closest-point query
+        meshes, mesh_entries = [], []
+        for obj in self.og_env.scene.objects:
+            if any([name in obj.name.lower() for name in exclude_names]):
+                continue
+            for link in obj.links.values():
+                for mesh in link.visual_meshes.values():
+                    trimesh_object = self._get_local_trimesh(mesh.prim)
+                    trimesh_object.apply_transform(PoseAPI.get_world_pose_with_scale(mesh.prim_path))
+                    meshes.append(trimesh_object)
+                    mesh_entries.append((mesh.prim_path, obj))
+        closest_points, mesh_indices, _ = compute_closest_points(meshes, keypoints)
+        # keypoints are tracked in the local frame of their prim, grouped by prim so that each prim pose is queried once
+        self._keypoint_prim_paths = []
+        self._keypoint_prim_indices = np.zeros(len(keypoints), dtype=np.int64)
+        for idx in range(len(keypoints)):
+            closest_prim_path, closest_obj = mesh_entries[mesh_indices[idx]]
+            if closest_prim_path not in self._keypoint_prim_paths:
+                self._keypoint_prim_paths.append(closest_prim_path)
+            self._keypoint_prim_indices[idx] = self._keypoint_prim_paths.index(closest_prim_path)
+            self._keypoint_registry[idx] = closest_prim_path
             self._keypoint2object[idx] = closest_obj
             # overwrite the keypoint with the closest point
-            self.keypoints[idx] = closest_point
+            self.keypoints[idx] = closest_points[idx]
+        self._keypoint_pose_cache = None
+        prim_poses = self._get_keypoint_prim_poses()[self._keypoint_prim_indices]
+        self._local_keypoints = np.einsum('nji,nj->ni', prim_poses[:, :3, :3], self.keypoints - prim_poses[:, :3, 3])
         breakpoint()
             
     def get_keypoint_positions(self):
@@ -226,16 +220,10 @@ class ReKepOGEnv:
         Given the registered keypoints, this function returns their current positions in the world frame.
         """
         assert hasattr(self, '_keypoint_registry') and self._keypoint_registry is not None, "Keypoints have not been registered yet."
-        keypoint_positions = []
-        for idx, (prim_path, init_pose) in self._keypoint_registry.items():
-            init_pose = T.pose2mat(init_pose)
-            centering_transform = T.pose_inv(init_pose)
-            keypoint_centered = np.dot(centering_transform, np.append(self.keypoints[idx], 1))[:3]
-            curr_pose = T.pose2mat(PoseAPI.get_world_pose(prim_path))
-            keypoint = np.dot(curr_pose, np.append(keypoint_centered, 1))[:3]
-            keypoint_positions.append(keypoint)
+        prim_poses = self._get_keypoint_prim_poses()[self._keypoint_prim_indices]
+        keypoint_positions = np.einsum('nij,nj->ni', prim_poses[:, :3, :3], self._local_keypoints) + prim_poses[:, :3, 3]
         breakpoint()
-        return np.array(keypoint_positions)
+        return keypoint_positions
 
     def get_object_by_keypoint(self, keypoint_idx):
         """
@@ -292,29 +280,20 @@ class ReKepOGEnv:
     def get_collision_points(self, noise=True):
         """
         Get the points of the gripper and any object in hand.
+        Each collision mesh is sampled and farthest-point downsampled once in its local frame (see
+        _get_local_collision_points), so the points are deterministic and only transformed with the current mesh poses.
         """
-        collision_points = []
-
         robot_name = self.robot.name.lower()
         default_arm = self.robot.default_arm
-
-        # Add gripper collision points
-        for obj in self.og_env.scene.objects:
-            if robot_name in obj.name.lower():
-                for link_name, link in obj.links.items():
-                    # Include likely gripper links
-                    if any(k in link_name.lower() for k in ['gripper', 'wrist', 'link7', 'link8']):
-                        for collision_mesh in link.collision_meshes.values():
-                            mesh_prim_path = collision_mesh.prim_path
-                            mesh_type = collision_mesh.prim.GetPrimTypeInfo().GetTypeName()
-                            if mesh_type == 'Mesh':
-                                trimesh_object = mesh_prim_mesh_to_trimesh_mesh(collision_mesh.prim)
-                            else:
-                                trimesh_object = mesh_prim_shape_to_trimesh_mesh(collision_mesh.prim)
-                            world_pose_w_scale = PoseAPI.get_world_pose_with_scale(mesh_prim_path)
-                            trimesh_object.apply_transform(world_pose_w_scale)
-                            points_transformed = trimesh_object.sample(1000)
-                            collision_points.append(points_transformed)
+        if self._gripper_collision_meshes is None:
+            self._gripper_collision_meshes = []
+            for obj in self.og_env.scene.objects:
+                if robot_name in obj.name.lower():
+                    for link_name, link in obj.links.items():
+                        # Include likely gripper links
+                        if any(k in link_name.lower() for k in ['gripper', 'wrist', 'link7', 'link8']):
+                            self._gripper_collision_meshes += list(link.collision_meshes.values())
+        collision_meshes = list(self._gripper_collision_meshes)
 
         # Add object in hand (if any)
         in_hand_obj = None
@@ -322,19 +301,20 @@ class ReKepOGEnv:
             in_hand_dict = self.robot._ag_obj_in_hand
             if isinstance(in_hand_dict, dict) and default_arm in in_hand_dict:
                 in_hand_obj = in_hand_dict[default_arm]
-
+        if in_hand_obj is not self._collision_points_obj_in_hand:
+            # only keep the local points of the gripper and the current object in hand
+            gripper_prim_paths = [mesh.prim_path for mesh in self._gripper_collision_meshes]
+            self._local_collision_points = {k: v for k, v in self._local_collision_points.items() if k in gripper_prim_paths}
+            self._collision_points_obj_in_hand = in_hand_obj
         if in_hand_obj is not None:
             for link in in_hand_obj.links.values():
-                for collision_mesh in link.collision_meshes.values():
-                    mesh_type = collision_mesh.prim.GetPrimTypeInfo().GetTypeName()
-                    if mesh_type == 'Mesh':
-                        trimesh_object = mesh_prim_mesh_to_trimesh_mesh(collision_mesh.prim)
-                    else:
-                        trimesh_object = mesh_prim_shape_to_trimesh_mesh(collision_mesh.prim)
-                    world_pose_w_scale = PoseAPI.get_world_pose_with_scale(collision_mesh.prim_path)
-                    trimesh_object.apply_transform(world_pose_w_scale)
-                    points_transformed = trimesh_object.sample(1000)
-                    collision_points.append(points_transformed)
+                collision_meshes += list(link.collision_meshes.values())
+
+        collision_points = []
+        for collision_mesh in collision_meshes:
+            local_points = self._get_local_collision_points(collision_mesh)
+            world_pose_w_scale = np.asarray(PoseAPI.get_world_pose_with_scale(collision_mesh.prim_path), dtype=np.float64)
+            collision_points.append(local_points @ world_pose_w_scale[:3, :3].T + world_pose_w_scale[:3, 3])
 
         # Concatenate result
         collision_points = np.concatenate(collision_points, axis=0)
@@ -391,7 +371,7 @@ class ReKepOGEnv:
             action = np.concatenate([ee_pose, [self.get_gripper_null_action()]]) #TODO
 
         self.execute_action(action, precise=True)
-        self.video_cache = []
+        self.video_recorder.reset()
         print(f'{bcolors.HEADER}Reset done.{bcolors.ENDC}')
         breakpoint()
 
@@ -668,19 +648,14 @@ class ReKepOGEnv:
         breakpoint()
     
     def save_video(self, save_path=None):
+        """
+        Saves the recorded frames in the background (see video_recorder.py) and returns the path of the video.
+        """
         save_dir = os.path.join(os.path.dirname(__file__), 'output_logs')
         os.makedirs(save_dir, exist_ok=True)
         if save_path is None:
             save_path = os.path.join(save_dir, f'{datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}.mp4')
-        video_writer = imageio.get_writer(save_path, fps=30)
-        for rgb in self.video_cache:
-            if isinstance(rgb, torch.Tensor):
-                rgb = rgb.cpu().numpy()  # Move to CPU and convert to numpy
-            # Ensure correct dtype and range (0-255)
-            if rgb.dtype != np.uint8:
-                rgb = rgb.astype(np.uint8)
-            video_writer.append_data(rgb)
-        video_writer.close()
+        self.video_recorder.save(save_path)
         breakpoint()
         return save_path
 
@@ -833,14 +808,13 @@ class ReKepOGEnv:
             self.og_env.step(action)
         else:
             og.sim.step()
-        cam_obs = self.get_cam_obs()
-        rgb = cam_obs[1]['rgb']
-        if len(self.video_cache) < self.config['video_cache_size']:
-            self.video_cache.append(rgb)
-        else:
-            self.video_cache.pop(0)
-            self.video_cache.append(rgb)
         self.step_counter += 1
+        # only render the frames that are kept by the video decimation
+        if self.video_recorder.should_record():
+            rgb = self.get_cam_obs(cam_ids=[1], modalities=['rgb'])[1]['rgb']
+            self.video_recorder.add_frame(rgb)
+        else:
+            self.video_recorder.skip_frame()
         breakpoint()
 
     def _initialize_cameras(self, cam_config):
@@ -852,4 +826,39 @@ class ReKepOGEnv:
             cam_id = int(cam_id)
             self.cams[cam_id] = OGCamera(self.og_env, cam_config[cam_id])
         for _ in range(10): og.sim.render()
-        breakpoint()
\ No newline at end of file
+        breakpoint()
+
+    def _get_keypoint_prim_poses(self):
+        """
+        [P, 4, 4] world poses of the prims that the keypoints are attached to, queried once per step
+        """
+        if self._keypoint_pose_cache is None or self._keypoint_pose_cache[0] != self.step_counter:
+            prim_poses = np.stack([T.pose2mat(PoseAPI.get_world_pose(prim_path)) for prim_path in self._keypoint_prim_paths]).astype(np.float64)
+            self._keypoint_pose_cache = (self.step_counter, prim_poses)
+        breakpoint()
+        return self._keypoint_pose_cache[1]
+
+    def _get_local_collision_points(self, collision_mesh):
+        """
+        Farthest-point downsampled surface points of a collision mesh in its local (unscaled) frame, cached per prim path
+        """
+        if collision_mesh.prim_path not in self._local_collision_points:
+            points = self._get_local_trimesh(collision_mesh.prim).sample(1000)
+            num_points = self.config['collision_points_per_mesh']
+            if len(points) > num_points:
+                points = farthest_point_sampling(points, num_points)
+            self._local_collision_points[collision_mesh.prim_path] = points
+        breakpoint()
+        return self._local_collision_points[collision_mesh.prim_path]
+
+    def _get_local_trimesh(self, prim):
+        """
+        Extract the mesh of a mesh prim (collision or visual; a Mesh or a primitive shape) as a trimesh mesh in the prim's local frame
+        """
+        mesh_type = prim.GetPrimTypeInfo().GetTypeName()
+        if mesh_type == 'Mesh':
+            trimesh_object = mesh_prim_mesh_to_trimesh_mesh(prim)
+        else:
+            trimesh_object = mesh_prim_shape_to_trimesh_mesh(prim)
+        breakpoint()
+        return trimesh_object
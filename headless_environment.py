@@ -0,0 +1,614 @@
+"""
+Headless stand-in for ReKepOGEnv that runs without OmniGibson / Isaac Sim (CPU only).
+
+The scene consists of primitive shapes (box, cylinder, sphere) with analytic SDFs and ray intersections, the robot is a
+kinematic arm (see kinematics.py) that tracks end-effector targets with IK, and grasped objects are rigidly attached to
+the end-effector. There is no dynamics: objects only move when attached to the gripper (or through disturbances), and
+released objects stay where they are.
+"""
+import pdb
+import os
+import json
+import time
+import datetime
+import yaml
+import numpy as np
+import trimesh
+import transform_utils as T
+from kinematics import BatchedKinematics
+from video_recorder import VideoRecorder
+from sdf_utils import get_sdf_grid_axes, compute_closest_points, SparseSDF
+from utils import (
+    bcolors,
+    get_clock_time,
+    angle_between_rotmat,
+    angle_between_quats,
+    get_linear_interpolation_steps,
+    linear_interpolate_poses,
+    select_cam_obs,
+    farthest_point_sampling,
+    LazyObservation,
+    get_camera_rays,
+    deproject_depth,
+)
+
+def _resolve_path(path):
+    if path is None or os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+def _first_hit(candidates):
+    """
+    Smallest positive ray parameter among candidate intersections ([N] each, np.inf or nan for no intersection).
+    """
+    t = np.stack(candidates, axis=0)
+    t = np.where(t > 1e-9, t, np.inf)
+    return np.min(t, axis=0)
+
+
+class PrimitiveObject:
+    """
+    Rigid primitive shape. Geometry is defined in the object frame and centered at its origin:
+    box (size = extents [3]), cylinder (size = [radius, height], axis along z) or sphere (size = [radius]).
+    """
+    def __init__(self, name, shape, size, position, orientation=(0, 0, 0, 1), color=(128, 128, 128), fixed_base=False):
+        self.name = name
+        self.shape = shape
+        self.size = np.asarray(size, dtype=np.float64)
+        self.color = np.asarray(color, dtype=np.uint8)
+        self.fixed_base = fixed_base
+        if shape == 'box':
+            self.mesh = trimesh.creation.box(extents=self.size)
+        elif shape == 'cylinder':
+            self.mesh = trimesh.creation.cylinder(radius=self.size[0], height=self.size[1])
+        elif shape == 'sphere':
+            self.mesh = trimesh.creation.icosphere(radius=self.size[0])
+        else:
+            raise ValueError(f"unknown primitive shape: {shape}")
+        self.set_position_orientation(position, orientation)
+
+    def get_position_orientation(self):
+        return self.pose[:3, 3].copy(), T.mat2quat(self.pose[:3, :3])
+
+    def set_position_orientation(self, position, orientation):
+        self.pose = T.pose2mat((np.asarray(position, dtype=np.float64), np.asarray(orientation, dtype=np.float64)))
+
+    def _to_local(self, points):
+        return (points - self.pose[:3, 3]) @ self.pose[:3, :3]
+
+    def sdf(self, points):
+        """
+        Signed distance of world points [N, 3] to the surface (negative inside).
+        """
+        p = self._to_local(points)
+        if self.shape == 'box':
+            q = np.abs(p) - self.size / 2
+            return np.linalg.norm(np.maximum(q, 0), axis=-1) + np.minimum(np.max(q, axis=-1), 0)
+        elif self.shape == 'cylinder':
+            d = np.stack([np.linalg.norm(p[:, :2], axis=-1) - self.size[0], np.abs(p[:, 2]) - self.size[1] / 2], axis=-1)
+            return np.linalg.norm(np.maximum(d, 0), axis=-1) + np.minimum(np.max(d, axis=-1), 0)
+        return np.linalg.norm(p, axis=-1) - self.size[0]
+
+    def intersect(self, origins, directions):
+        """
+        Ray parameter of the first intersection of world rays (origins [N, 3] + t * directions [N, 3]) with the
+        surface, np.inf if the ray misses.
+        """
+        o = self._to_local(origins)
+        d = directions @ self.pose[:3, :3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.shape == 'box':
+                t1 = (-self.size / 2 - o) / d
+                t2 = (self.size / 2 - o) / d
+                t_near = np.nanmax(np.minimum(t1, t2), axis=-1)
+                t_far = np.nanmin(np.maximum(t1, t2), axis=-1)
+                hit = t_near <= t_far
+                return _first_hit([np.where(hit, t_near, np.inf), np.where(hit, t_far, np.inf)])
+            if self.shape == 'cylinder':
+                radius, half_height = self.size[0], self.size[1] / 2
+                a = d[:, 0] ** 2 + d[:, 1] ** 2
+                b = 2 * (o[:, 0] * d[:, 0] + o[:, 1] * d[:, 1])
+                c = o[:, 0] ** 2 + o[:, 1] ** 2 - radius ** 2
+                candidates = []
+                for sign in [-1, 1]:
+                    t = (-b + sign * np.sqrt(b ** 2 - 4 * a * c)) / (2 * a)
+                    z = o[:, 2] + t * d[:, 2]
+                    candidates.append(np.where(np.abs(z) <= half_height, t, np.inf))
+                for cap in [-half_height, half_height]:
+                    t = (cap - o[:, 2]) / d[:, 2]
+                    xy = o[:, :2] + t[:, None] * d[:, :2]
+                    candidates.append(np.where(np.sum(xy ** 2, axis=-1) <= radius ** 2, t, np.inf))
+                return _first_hit(candidates)
+            a = np.sum(d ** 2, axis=-1)
+            b = 2 * np.sum(o * d, axis=-1)
+            c = np.sum(o ** 2, axis=-1) - self.size[0] ** 2
+            candidates = [(-b + sign * np.sqrt(b ** 2 - 4 * a * c)) / (2 * a) for sign in [-1, 1]]
+            return _first_hit(candidates)
+
+
+class HeadlessRobot:
+    """
+    Kinematic arm loaded from URDF. Exposes the attributes of the OmniGibson robot that the rest of the pipeline uses
+    (name, urdf_path, robot_arm_descriptor_yamls, eef_link_names, default_arm, get/set_joint_positions).
+    """
+    def __init__(self, config):
+        self.name = config['name']
+        self.default_arm = "0"
+        self.urdf_path = _resolve_path(config['urdf_path'])
+        self.robot_arm_descriptor_yamls = {self.default_arm: _resolve_path(config['robot_description_path'])}
+        self.eef_link_names = {self.default_arm: config['eef_name']}
+        with open(self.robot_arm_descriptor_yamls[self.default_arm], 'r') as f:
+            cspace = yaml.safe_load(f).get('cspace', None)
+        self.kinematics = BatchedKinematics(self.urdf_path, config['eef_name'], cspace_joint_names=cspace)
+        self.base_pose = T.pose2mat((np.asarray(config['position'], dtype=np.float64), np.asarray(config['orientation'], dtype=np.float64)))
+        self.reset_joint_pos = np.asarray(config['reset_joint_pos'], dtype=np.float64)
+        assert len(self.reset_joint_pos) == self.kinematics.dof, f"expected {self.kinematics.dof} reset joint positions"
+        self.reset()
+
+    def reset(self):
+        self.set_joint_positions(self.reset_joint_pos)
+
+    def get_position_orientation(self):
+        return self.base_pose[:3, 3].copy(), T.mat2quat(self.base_pose[:3, :3])
+
+    def get_joint_positions(self):
+        return self.joint_positions.copy()
+
+    def set_joint_positions(self, joint_positions):
+        self.joint_positions = np.clip(np.asarray(joint_positions, dtype=np.float64), self.kinematics.lower, self.kinematics.upper)
+        self.eef_pose = self.base_pose @ self.kinematics.fk(self.joint_positions)[0]
+
+    def get_eef_pose(self):
+        """world-frame [4, 4] pose of the end-effector link"""
+        return self.eef_pose.copy()
+
+
+class HeadlessCamera:
+    """
+    Pinhole camera that ray casts the primitive scene. Uses the conventions of OGCamera (camera looks along -z with
+    y up, depth is linear depth) and the default intrinsics of the OmniGibson VisionSensor.
+    """
+    def __init__(self, config, focal_length=17.0, horizontal_aperture=20.955):
+        self.name = config['name']
+        self.resolution = config['resolution']
+        focal_len_in_pixel = focal_length * self.resolution / horizontal_aperture
+        self.intrinsics = np.eye(3)
+        self.intrinsics[0, 0] = focal_len_in_pixel
+        self.intrinsics[1, 1] = focal_len_in_pixel
+        self.intrinsics[0, 2] = self.resolution / 2
+        self.intrinsics[1, 2] = self.resolution / 2
+        cam_pose = T.pose2mat((np.asarray(config['position'], dtype=np.float64), np.asarray(config['orientation'], dtype=np.float64)))
+        self.extrinsics = T.pose_inv(cam_pose)
+        # ray directions (world frame) with unit length along the optical axis, so the ray parameter is the linear depth
+        ray_origin, ray_directions = get_camera_rays(self.intrinsics, self.extrinsics, self.resolution, self.resolution)
+        self.ray_directions = ray_directions.reshape(-1, 3)
+        self.ray_origins = np.broadcast_to(ray_origin, self.ray_directions.shape)
+        # ray table in the output dtype for deprojection
+        self.points_dtype = np.dtype(config['points_dtype'])
+        self.points_rays = (ray_origin.astype(self.points_dtype), ray_directions.astype(self.points_dtype))
+
+    def get_params(self):
+        """
+        Get the intrinsic and extrinsic parameters of the camera
+        """
+        return {"intrinsics": self.intrinsics, "extrinsics": self.extrinsics}
+
+    def get_obs(self, objects):
+        """
+        Renders the objects. Segmentation ids are the object index + 1 (0 for background), depth is 0 for background.
+        Like OGCamera, the modalities are computed on first access (the scene is ray cast once for rgb, depth and seg),
+        so the observation should be used before the scene changes.
+        """
+        shape = (self.resolution, self.resolution)
+        rendered = dict()
+        def ray_cast(modality):
+            if len(rendered) > 0:
+                return rendered[modality]
+            depth = np.full(len(self.ray_directions), np.inf)
+            seg = np.zeros(len(self.ray_directions), dtype=np.int32)
+            for idx, obj in enumerate(objects):
+                t = obj.intersect(self.ray_origins, self.ray_directions)
+                closer = t < depth
+                depth[closer] = t[closer]
+                seg[closer] = idx + 1
+            rendered["depth"] = np.where(seg > 0, depth, 0.0).reshape(shape)
+            rendered["seg"] = seg.reshape(shape)
+            return rendered[modality]
+        def get_rgb(obs):
+            palette = np.concatenate([[[0, 0, 0]], [obj.color for obj in objects]], axis=0).astype(np.uint8)
+            return palette[obs["seg"]]
+        def get_points(obs):
+            return deproject_depth(obs["depth"], *self.points_rays)
+        return LazyObservation({
+            "rgb": get_rgb,  # H, W, 3
+            "depth": lambda obs: ray_cast("depth"),  # H, W
+            "points": get_points,  # H, W, 3
+            "seg": lambda obs: ray_cast("seg"),  # H, W
+            "intrinsic": lambda obs: self.intrinsics,
+            "extrinsic": lambda obs: self.extrinsics,
+        })
+
+
+class HeadlessEnv:
+    """
+    Same public interface as ReKepOGEnv (environment.py) on a primitive scene, see the module docstring.
+    """
+    def __init__(self, config, scene_file=None, verbose=False):
+        self.config = config
+        self.verbose = verbose
+        self.video_recorder = VideoRecorder(mode=self.config['video_mode'],
+                                            max_frames=self.config['video_cache_size'],
+                                            decimation=self.config['video_decimation'],
+                                            fps=self.config['video_fps'],
+                                            stream_dir=os.path.join(os.path.dirname(__file__), 'output_logs'))
+        self.scene_file = _resolve_path(scene_file if scene_file is not None else self.config['scene_file'])
+        self.bounds_min = np.array(self.config['bounds_min'])
+        self.bounds_max = np.array(self.config['bounds_max'])
+        self.interpolate_pos_step_size = self.config['interpolate_pos_step_size']
+        self.interpolate_rot_step_size = self.config['interpolate_rot_step_size']
+        self.step_counter = 0
+        # load primitive scene
+        with open(self.scene_file, 'r') as f:
+            scene = json.load(f)
+        self.objects = [PrimitiveObject(**obj_config) for obj_config in scene['objects']]
+        self.init_object_poses = [obj.pose.copy() for obj in self.objects]
+        # robot vars
+        self.robot = HeadlessRobot(self.config['robot'])
+        self.reset_joint_pos = self.robot.reset_joint_pos
+        self.world2robot_homo = T.pose_inv(self.robot.base_pose)
+        self.gripper_mesh = trimesh.creation.icosphere(radius=self.config['robot']['gripper_radius'])
+        self._local_collision_points = dict()
+        self.obj_in_hand = None
+        self.obj_in_hand_offset = None
+        # initialize cameras
+        self.last_cam_obs = None
+        self._cam_obs_step = None
+        self.cams = {int(cam_id): HeadlessCamera(cam_config) for cam_id, cam_config in self.config['camera'].items()}
+        self.last_og_gripper_action = 1.0
+        self._sdf_cache = None
+        breakpoint()
+
+    # ======================================
+    # = exposed functions
+    # ======================================
+    def get_sdf_voxels(self, resolution, exclude_robot=True, exclude_obj_in_hand=True):
+        """
+        analytic SDF of the primitives (positive inside), recomputed only when an object has moved
+        the robot is not part of the scene, so exclude_robot has no effect
+        """
+        start = time.time()
+        exclude_names = ['wall', 'floor', 'ceiling']
+        objects = [obj for obj in self.objects if not any([name in obj.name.lower() for name in exclude_names])]
+        if exclude_obj_in_hand and self.obj_in_hand is not None:
+            objects = [obj for obj in objects if obj is not self.obj_in_hand]
+        cache_key = (resolution, tuple(obj.name for obj in objects), tuple(obj.pose.tobytes() for obj in objects))
+        if self._sdf_cache is not None and self._sdf_cache[0] == cache_key:
+            breakpoint()
+            return self._sdf_cache[1]
+        def scene_sdf(points):
+            sdf = np.full(len(points), -np.linalg.norm(self.bounds_max - self.bounds_min))
+            for obj in objects:
+                sdf = np.maximum(sdf, -obj.sdf(points))
+            return sdf
+        if self.config['sdf_sparse_band'] is not None:
+            sdf_voxels = SparseSDF.from_function(scene_sdf, self.bounds_min, self.bounds_max, resolution, self.config['sdf_sparse_band'])
+        else:
+            grid = np.stack(np.meshgrid(*get_sdf_grid_axes(self.bounds_min, self.bounds_max, resolution), indexing='ij'), axis=-1)
+            sdf_voxels = scene_sdf(grid.reshape(-1, 3)).reshape(grid.shape[:3])
+        self._sdf_cache = (cache_key, sdf_voxels)
+        self.verbose and print(f'{bcolors.WARNING}[headless_environment.py | {get_clock_time()}] SDF voxels computed in {time.time() - start:.4f} seconds{bcolors.ENDC}')
+        breakpoint()
+        return sdf_voxels
+
+    def get_cam_obs(self, cam_ids=None, modalities=None):
+        """
+        Args:
+            cam_ids (list or None): cameras to return (all if None).
+            modalities (list or None): subset of rgb, depth, points, seg, intrinsic, extrinsic to return. If None, the
+                observations are returned as LazyObservation that compute each modality on first access.
+        Returns:
+            dict: {cam_id: observation}.
+        The observations are memoized per step_counter, so repeated calls within a step (and the point clouds
+        deprojected from depth) are computed only once.
+        """
+        if self._cam_obs_step != self.step_counter:
+            self.last_cam_obs = {cam_id: self.cams[cam_id].get_obs(self.objects) for cam_id in self.cams}  # each containing rgb, depth, points, seg
+            self._cam_obs_step = self.step_counter
+        cam_obs = select_cam_obs(self.last_cam_obs, cam_ids, modalities)
+        breakpoint()
+        return cam_obs
+
+    def register_keypoints(self, keypoints):
+        """
+        Args:
+            keypoints (np.ndarray): keypoints in the world frame of shape (N, 3)
+        Returns:
+            None
+        Given a set of keypoints in the world frame, this function registers them so that their newest positions can be accessed later.
+        """
+        if not isinstance(keypoints, np.ndarray):
+            keypoints = np.array(keypoints)
+        self.keypoints = keypoints
+        self._keypoint_registry = dict()
+        self._keypoint2object = dict()
+        exclude_names = ['wall', 'floor', 'ceiling', 'table', self.robot.name.lower(), 'robot']
+        candidates = [obj for obj in self.objects if not any([name in obj.name.lower() for name in exclude_names])]
+        closest_points, obj_indices, _ = compute_closest_points([obj.mesh.copy().apply_transform(obj.pose) for obj in candidates], keypoints)
+        # keypoints are tracked in the frame of their object, grouped by object
+        self._keypoint_objects = []
+        self._keypoint_object_indices = np.zeros(len(keypoints), dtype=np.int64)
+        for idx in range(len(keypoints)):
+            closest_obj = candidates[obj_indices[idx]]
+            if closest_obj not in self._keypoint_objects:
+                self._keypoint_objects.append(closest_obj)
+            self._keypoint_object_indices[idx] = self._keypoint_objects.index(closest_obj)
+            self._keypoint_registry[idx] = closest_obj
+            self._keypoint2object[idx] = closest_obj
+            # overwrite the keypoint with the closest point
+            self.keypoints[idx] = closest_points[idx]
+        obj_poses = np.stack([obj.pose for obj in self._keypoint_objects])[self._keypoint_object_indices]
+        self._local_keypoints = np.einsum('nji,nj->ni', obj_poses[:, :3, :3], self.keypoints - obj_poses[:, :3, 3])
+        breakpoint()
+
+    def get_keypoint_positions(self):
+        """
+        Args:
+            None
+        Returns:
+            np.ndarray: keypoints in the world frame of shape (N, 3)
+        Given the registered keypoints, this function returns their current positions in the world frame.
+        """
+        assert hasattr(self, '_keypoint_registry') and self._keypoint_registry is not None, "Keypoints have not been registered yet."
+        obj_poses = np.stack([obj.pose for obj in self._keypoint_objects])[self._keypoint_object_indices]
+        keypoint_positions = np.einsum('nij,nj->ni', obj_poses[:, :3, :3], self._local_keypoints) + obj_poses[:, :3, 3]
+        breakpoint()
+        return keypoint_positions
+
+    def get_object_by_keypoint(self, keypoint_idx):
+        """
+        Args:
+            keypoint_idx (int): the index of the keypoint
+        Returns:
+            pointer: the object that the keypoint is associated with
+        Given the keypoint index, this function returns the name of the object that the keypoint is associated with.
+        """
+        assert hasattr(self, '_keypoint2object') and self._keypoint2object is not None, "Keypoints have not been registered yet."
+        breakpoint()
+        return self._keypoint2object[keypoint_idx]
+
+    def get_collision_points(self, noise=True):
+        """
+        Get the points of the gripper (sphere around the end-effector) and any object in hand.
+        The points are sampled and farthest-point downsampled once in the local frame of each mesh.
+        """
+        collision_points = [trimesh.transform_points(self._get_local_collision_points('gripper', self.gripper_mesh), self.robot.get_eef_pose())]
+        if self.obj_in_hand is not None:
+            collision_points.append(trimesh.transform_points(self._get_local_collision_points(self.obj_in_hand.name, self.obj_in_hand.mesh), self.obj_in_hand.pose))
+        collision_points = np.concatenate(collision_points, axis=0)
+        breakpoint()
+        return collision_points
+
+    def reset(self):
+        for obj, pose in zip(self.objects, self.init_object_poses):
+            obj.pose = pose.copy()
+        self.robot.reset()
+        self.obj_in_hand = None
+        self.obj_in_hand_offset = None
+        self.last_og_gripper_action = 0.0
+        self.open_gripper()
+        self.video_recorder.reset()
+        self._cam_obs_step = None  # the scene changed without stepping
+        print(f'{bcolors.HEADER}Reset done.{bcolors.ENDC}')
+        breakpoint()
+
+    def is_grasping(self, candidate_obj=None):
+        breakpoint()
+        if candidate_obj is None:
+            return self.obj_in_hand is not None
+        return self.obj_in_hand is candidate_obj
+
+    def get_ee_pose(self):
+        ee_pos, ee_xyzw = T.mat2pose(self.robot.get_eef_pose())
+        ee_pose = np.concatenate([ee_pos, ee_xyzw])  # [7]
+        breakpoint()
+        return ee_pose
+
+    def get_ee_pos(self):
+        breakpoint()
+        return self.get_ee_pose()[:3]
+
+    def get_ee_quat(self):
+        breakpoint()
+        return self.get_ee_pose()[3:]
+
+    def get_arm_joint_postions(self):
+        breakpoint()
+        return self.robot.get_joint_positions()
+
+    def close_gripper(self):
+        """
+        Attaches the closest movable object whose surface is within grasp_distance of the end-effector.
+        """
+        if self.last_og_gripper_action == 0.0:
+            return
+        ee_pose = self.robot.get_eef_pose()
+        candidates = [obj for obj in self.objects if not obj.fixed_base]
+        if len(candidates) > 0:
+            dists = np.array([obj.sdf(ee_pose[None, :3, 3])[0] for obj in candidates])
+            closest = int(np.argmin(dists))
+            if dists[closest] < self.config['grasp_distance']:
+                self.obj_in_hand = candidates[closest]
+                self.obj_in_hand_offset = T.pose_inv(ee_pose) @ self.obj_in_hand.pose
+        self._step()
+        self.last_og_gripper_action = 0.0
+        breakpoint()
+
+    def open_gripper(self):
+        if self.last_og_gripper_action == 1.0:
+            return
+        self.obj_in_hand = None
+        self.obj_in_hand_offset = None
+        self._step()
+        self.last_og_gripper_action = 1.0
+        breakpoint()
+
+    def get_last_og_gripper_action(self):
+        breakpoint()
+        return self.last_og_gripper_action
+
+    def get_gripper_open_action(self):
+        breakpoint()
+        return -1.0
+
+    def get_gripper_close_action(self):
+        breakpoint()
+        return 1.0
+
+    def get_gripper_null_action(self):
+        breakpoint()
+        return 0.0
+
+    def compute_target_delta_ee(self, target_pose):
+        target_pos, target_xyzw = target_pose[:3], target_pose[3:]
+        ee_pose = self.get_ee_pose()
+        ee_pos, ee_xyzw = ee_pose[:3], ee_pose[3:]
+        pos_diff = np.linalg.norm(ee_pos - target_pos)
+        rot_diff = angle_between_quats(ee_xyzw, target_xyzw)
+        breakpoint()
+        return pos_diff, rot_diff
+
+    def execute_action(self, action, precise=True):
+        """
+        Moves the robot gripper to a target pose by specifying the absolute pose in the world frame and executes gripper action.
+
+        Args:
+            action (x, y, z, qx, qy, qz, qw, gripper_action): absolute target pose in the world frame + gripper action.
+            precise (bool): whether to use small position and rotation thresholds for precise movement.
+        Returns:
+            tuple: A tuple containing the position and rotation errors after reaching the target pose.
+        """
+        if precise:
+            pos_threshold = 0.03
+            rot_threshold = 3.0
+        else:
+            pos_threshold = 0.10
+            rot_threshold = 5.0
+        action = np.array(action).copy()
+        assert action.shape == (8,)
+        target_pose = action[:7]
+        gripper_action = action[7]
+
+        # ======================================
+        # = status and safety check
+        # ======================================
+        if np.any(target_pose[:3] < self.bounds_min) \
+             or np.any(target_pose[:3] > self.bounds_max):
+            print(f'{bcolors.WARNING}[headless_environment.py | {get_clock_time()}] Target position is out of bounds, clipping to workspace bounds{bcolors.ENDC}')
+            target_pose[:3] = np.clip(target_pose[:3], self.bounds_min, self.bounds_max)
+
+        # ======================================
+        # = interpolation
+        # ======================================
+        current_pose = self.get_ee_pose()
+        pos_diff = np.linalg.norm(current_pose[:3] - target_pose[:3])
+        rot_diff = angle_between_quats(current_pose[3:7], target_pose[3:7])
+        if pos_diff < self.interpolate_pos_step_size and rot_diff < self.interpolate_rot_step_size:
+            pose_seq = np.array([target_pose])
+        else:
+            num_steps = get_linear_interpolation_steps(current_pose, target_pose, self.interpolate_pos_step_size, self.interpolate_rot_step_size)
+            pose_seq = linear_interpolate_poses(current_pose, target_pose, num_steps)
+
+        # ======================================
+        # = move to target pose
+        # ======================================
+        for pose in pose_seq[:-1]:
+            self._move_to_waypoint(pose, 0.10, 5.0)
+        self._move_to_waypoint(pose_seq[-1], pos_threshold, rot_threshold, max_steps=20 if not precise else 40)
+        pos_error, rot_error = self.compute_target_delta_ee(target_pose)
+        self.verbose and print(f'\n{bcolors.BOLD}[headless_environment.py | {get_clock_time()}] Move to pose completed (pos_error: {pos_error}, rot_error: {np.rad2deg(rot_error)}){bcolors.ENDC}\n')
+
+        # ======================================
+        # = apply gripper action
+        # ======================================
+        if gripper_action == self.get_gripper_open_action():
+            self.open_gripper()
+        elif gripper_action == self.get_gripper_close_action():
+            self.close_gripper()
+        elif gripper_action == self.get_gripper_null_action():
+            pass
+        else:
+            raise ValueError(f"Invalid gripper action: {gripper_action}")
+        breakpoint()
+        return pos_error, rot_error
+
+    def sleep(self, seconds):
+        """steps the scene for the simulated duration (does not wait in real time)"""
+        for _ in range(int(seconds * self.config['step_frequency'])):
+            self._step()
+        breakpoint()
+
+    def save_video(self, save_path=None):
+        """
+        Saves the recorded frames in the background (see video_recorder.py) and returns the path of the video.
+        """
+        save_dir = os.path.join(os.path.dirname(__file__), 'output_logs')
+        os.makedirs(save_dir, exist_ok=True)
+        if save_path is None:
+            save_path = os.path.join(save_dir, f'{datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}.mp4')
+        self.video_recorder.save(save_path)
+        breakpoint()
+        return save_path
+
+    # ======================================
+    # = internal functions
+    # ======================================
+    def _get_local_collision_points(self, name, mesh):
+        if name not in self._local_collision_points:
+            points = mesh.sample(1000)
+            if len(points) > self.config['collision_points_per_mesh']:
+                points = farthest_point_sampling(points, self.config['collision_points_per_mesh'])
+            self._local_collision_points[name] = points
+        breakpoint()
+        return self._local_collision_points[name]
+
+    def _move_to_waypoint(self, target_pose_world, pos_threshold=0.035, rot_threshold=3.0, max_steps=10):
+        """
+        Each step runs a bounded number of IK iterations from the current joint positions (acting as the controller).
+        """
+        target_pose_robot = np.dot(self.world2robot_homo, T.convert_pose_quat2mat(target_pose_world))
+        count = 0
+        while count < max_steps:
+            ee_pose = self.robot.get_eef_pose()
+            pos_error = np.linalg.norm(target_pose_world[:3] - ee_pose[:3, 3])
+            rot_error = angle_between_rotmat(ee_pose[:3, :3], T.quat2mat(target_pose_world[3:7]))
+            if pos_error < pos_threshold and rot_error < np.deg2rad(rot_threshold):
+                break
+            ik_result = self.robot.kinematics.solve_ik(
+                target_pose_robot[None],
+                self.robot.get_joint_positions(),
+                max_iterations=self.config['ik_iterations_per_step'],
+            )
+            self.robot.set_joint_positions(ik_result.cspace_position[0])
+            self._step()
+            count += 1
+        if count == max_steps:
+            self.verbose and print(f'{bcolors.WARNING}[headless_environment.py | {get_clock_time()}] Pose not reached after {max_steps} steps (pos_error: {pos_error:.4f}, rot_error: {np.rad2deg(rot_error):.4f}){bcolors.ENDC}')
+        breakpoint()
+
+    def _step(self, action=None):
+        """
+        Advances the scene by one step. The kinematic arm is moved directly by the callers, so action is ignored.
+        """
+        if hasattr(self, 'disturbance_seq') and self.disturbance_seq is not None:
+            next(self.disturbance_seq)
+        if self.obj_in_hand is not None:
+            self.obj_in_hand.pose = self.robot.get_eef_pose() @ self.obj_in_hand_offset
+        self.step_counter += 1
+        if self.config['record_video']:
+            # only render the frames that are kept by the video decimation
+            if self.video_recorder.should_record():
+                rgb = self.get_cam_obs(cam_ids=[1], modalities=['rgb'])[1]['rgb']
+                self.video_recorder.add_frame(rgb)
+            else:
+                self.video_recorder.skip_frame()
+        breakpoint()
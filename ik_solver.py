@@ -2,13 +2,25 @@
 Adapted from OmniGibson and the Lula IK solver
 """
 import pdb
-import omnigibson.lazy as lazy
+import os
+import atexit
+import pickle
+from collections import OrderedDict
+import yaml
 import numpy as np
 from scipy.spatial.transform import Rotation as R
+from kinematics import BatchedKinematics, BatchIKResult, IKResult
+try:
+    import omnigibson.lazy as lazy
+except ImportError:
+    lazy = None  # only the numpy backend is available
 
 class IKSolver:
     """
     Class for thinly wrapping Lula IK solver
+
+    backend='lula' uses Lula cyclic coordinate descent (requires OmniGibson);
+    backend='numpy' uses the batched damped-least-squares solver in kinematics.py on the same URDF.
     """
 
     def __init__(
@@ -19,18 +31,91 @@ class IKSolver:
         reset_joint_pos,
         world2robot_homo,
         robot_name,
-        robot
+        robot,
+        backend='lula',
     ):
-        # Create robot description, kinematics, and config
-        self.robot_description = lazy.lula.load_robot(robot_description_path, robot_urdf_path)
-        self.kinematics = self.robot_description.kinematics()
-        self.config = lazy.lula.CyclicCoordDescentIkConfig()
+        self.robot_description_path = robot_description_path
+        self.robot_urdf_path = robot_urdf_path
         self.eef_name = eef_name
         self.reset_joint_pos = reset_joint_pos
         self.world2robot_homo = world2robot_homo
         self.robot_name=robot_name.lower()
         self.robot=robot
+        self.backend = backend
+        self.tip_name = "link8" if self.robot_name == "piper" else eef_name
+        if backend == 'lula':
+            assert lazy is not None, "the lula backend requires OmniGibson"
+            # Create robot description, kinematics, and config
+            self.robot_description = lazy.lula.load_robot(robot_description_path, robot_urdf_path)
+            self.kinematics = self.robot_description.kinematics()
+            self.config = lazy.lula.CyclicCoordDescentIkConfig()
+        elif backend == 'numpy':
+            # use the cspace of the robot description (if available) so that joint positions match the lula backend
+            cspace = None
+            if robot_description_path is not None and os.path.exists(robot_description_path):
+                with open(robot_description_path, 'r') as f:
+                    cspace = yaml.safe_load(f).get('cspace', None)
+            self.kinematics = BatchedKinematics(robot_urdf_path, self.tip_name, cspace_joint_names=cspace)
+        else:
+            raise ValueError(f"unknown IK backend: {backend}")
+        breakpoint()
+
+    def _get_seed(self, initial_joint_pos):
+        """
+        Seed of the numpy backend, truncated or padded (with the reset joint positions) to the cspace dimension.
+        """
+        dof = self.kinematics.dof
+        reset_joint_pos = np.asarray(self.reset_joint_pos, dtype=np.float64)
+        seed = reset_joint_pos if initial_joint_pos is None else np.asarray(initial_joint_pos, dtype=np.float64)
+        if len(seed) < dof:
+            padding = reset_joint_pos[len(seed):dof] if len(reset_joint_pos) >= dof else np.zeros(dof - len(seed))
+            seed = np.concatenate([seed, padding])
+        return seed[:dof]
+
+    def solve_batch(
+        self,
+        target_poses_homo,
+        position_tolerance=0.01,
+        orientation_tolerance=0.05,
+        position_weight=1.0,
+        orientation_weight=0.05,
+        max_iterations=150,
+        initial_joint_pos=None,
+    ):
+        """
+        Solves IK for many target poses at once. See solve() for the arguments.
+        The CCD weights only apply to the lula backend.
+
+        Args:
+            target_poses_homo (np.ndarray): [N, 4, 4] homogeneous transformation matrices of the target poses in world frame
+
+        Returns:
+            ik_results (BatchIKResult): batched IK results, indexing returns the result of a single target pose.
+        """
+        target_poses_homo = np.asarray(target_poses_homo).reshape(-1, 4, 4)
+        if self.backend == 'numpy':
+            target_poses_robot = np.asarray(self.world2robot_homo) @ target_poses_homo
+            ik_results = self.kinematics.solve_ik(
+                target_poses_robot,
+                self._get_seed(initial_joint_pos),
+                position_tolerance=position_tolerance,
+                orientation_tolerance=orientation_tolerance,
+                max_iterations=max_iterations,
+            )
+        else:
+            ik_results = BatchIKResult.from_results([
+                self.solve(
+                    target_pose_homo,
+                    position_tolerance=position_tolerance,
+                    orientation_tolerance=orientation_tolerance,
+                    position_weight=position_weight,
+                    orientation_weight=orientation_weight,
+                    max_iterations=max_iterations,
+                    initial_joint_pos=initial_joint_pos,
+                ) for target_pose_homo in target_poses_homo
+            ])
         breakpoint()
+        return ik_results
 
     def solve(
         self,
@@ -58,6 +143,14 @@ class IKSolver:
         Returns:
             ik_results (lazy.lula.CyclicCoordDescentIkResult): IK result object containing the joint positions and other information.
         """
+        if self.backend == 'numpy':
+            return self.solve_batch(
+                target_pose_homo[None],
+                position_tolerance=position_tolerance,
+                orientation_tolerance=orientation_tolerance,
+                max_iterations=max_iterations,
+                initial_joint_pos=initial_joint_pos,
+            )[0]
         # convert target pose to robot base frame
         target_pose_robot = np.dot(self.world2robot_homo, target_pose_homo)
         # if self.robot_name == "piper":
@@ -110,4 +203,123 @@ class IKSolver:
             ik_target_pose = lazy.lula.Pose3(lazy.lula.Rotation3(rotation), position)
             ik_results = lazy.lula.compute_ik_ccd(self.kinematics, ik_target_pose, self.eef_name, self.config)  
         breakpoint()
-        return ik_results
\ No newline at end of file
+        return ik_results
+
+
+class CachedIKSolver:
+    """
+    LRU cache around an IKSolver. Target poses are quantized in the robot frame and keyed together with the quantized
+    seed and the solver settings, so that nearly identical queries (e.g., finite differencing or the fixed start/end
+    control points of a path) are only solved once. The cache can optionally be persisted to disk.
+    Robots whose IK depends on live simulator state (see STATEFUL_ROBOTS) bypass the cache.
+    Other attributes are forwarded to the wrapped solver.
+    """
+    # the lula IK of these robots reads the current finger positions (and sets eef_offset) on every solve
+    STATEFUL_ROBOTS = ('frankapanda',)
+
+    def __init__(
+        self,
+        ik_solver,
+        max_size=100000,
+        pos_resolution=0.001,
+        rot_resolution=0.005,
+        seed_resolution=0.001,
+        cache_path=None,
+    ):
+        self.ik_solver = ik_solver
+        self.max_size = max_size
+        self.pos_resolution = pos_resolution
+        self.rot_resolution = rot_resolution
+        self.seed_resolution = seed_resolution
+        self.cache_path = cache_path
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypass = ik_solver.backend == 'lula' and ik_solver.robot_name in self.STATEFUL_ROBOTS
+        # results are only valid for the same robot description and backend
+        self.cache_tag = (ik_solver.robot_name, ik_solver.backend, ik_solver.robot_urdf_path, ik_solver.eef_name)
+        if cache_path is not None:
+            if os.path.exists(cache_path):
+                with open(cache_path, 'rb') as f:
+                    saved = pickle.load(f)
+                if saved['tag'] == self.cache_tag:
+                    self.cache.update(saved['cache'])
+            atexit.register(self.save)
+        breakpoint()
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the cache itself
+        if 'ik_solver' not in self.__dict__:
+            # e.g., during unpickling or copying, before __init__ state is restored
+            raise AttributeError(name)
+        return getattr(self.__dict__['ik_solver'], name)
+
+    def _get_keys(self, target_poses_homo, initial_joint_pos, settings):
+        target_poses_robot = np.asarray(self.ik_solver.world2robot_homo) @ target_poses_homo
+        pos = np.round(target_poses_robot[:, :3, 3] / self.pos_resolution).astype(np.int64)
+        rot = np.round(target_poses_robot[:, :3, :3].reshape(-1, 9) / self.rot_resolution).astype(np.int64)
+        quantized = np.concatenate([pos, rot], axis=1)
+        seed = None
+        if initial_joint_pos is not None:
+            seed = np.round(np.asarray(initial_joint_pos, dtype=np.float64) / self.seed_resolution).astype(np.int64).tobytes()
+        return [(row.tobytes(), seed, settings) for row in quantized]
+
+    def solve_batch(self, target_poses_homo, initial_joint_pos=None, **kwargs):
+        """
+        Same as IKSolver.solve_batch, but only solves the target poses that are not cached.
+        """
+        target_poses_homo = np.asarray(target_poses_homo, dtype=np.float64).reshape(-1, 4, 4)
+        if self.bypass:
+            self.misses += len(target_poses_homo)
+            return self.ik_solver.solve_batch(target_poses_homo, initial_joint_pos=initial_joint_pos, **kwargs)
+        keys = self._get_keys(target_poses_homo, initial_joint_pos, tuple(sorted(kwargs.items())))
+        results = [None] * len(keys)
+        miss_idx = []
+        for i, key in enumerate(keys):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                results[i] = self.cache[key]
+                self.hits += 1
+            else:
+                miss_idx.append(i)
+        if len(miss_idx) > 0:
+            self.misses += len(miss_idx)
+            new_results = self.ik_solver.solve_batch(target_poses_homo[miss_idx], initial_joint_pos=initial_joint_pos, **kwargs)
+            for j, i in enumerate(miss_idx):
+                # store a lightweight, picklable copy of the fields consumed by the objectives
+                result = new_results[j]
+                results[i] = IKResult(
+                    success=bool(result.success),
+                    num_descents=int(result.num_descents),
+                    position_error=float(result.position_error),
+                    orientation_error=float(result.orientation_error),
+                    cspace_position=np.array(result.cspace_position, dtype=np.float64),
+                )
+                self.cache[keys[i]] = results[i]
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        ik_results = BatchIKResult.from_results(results)
+        breakpoint()
+        return ik_results
+
+    def solve(self, target_pose_homo, **kwargs):
+        """
+        Same as IKSolver.solve, returns a cached result if available.
+        """
+        return self.solve_batch(np.asarray(target_pose_homo)[None], **kwargs)[0]
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total > 0 else 0.0,
+            'size': len(self.cache),
+        }
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        with open(self.cache_path, 'wb') as f:
+            pickle.dump({'tag': self.cache_tag, 'cache': self.cache}, f)
@@ -1,21 +1,127 @@
 import pdb
+import os
+import hashlib
+from collections import OrderedDict
 import numpy as np
 import torch
 import cv2
-from torch.nn.functional import interpolate
+from torch.nn.functional import interpolate, grid_sample
+from torch.nn.utils.rnn import pad_sequence
 from kmeans_pytorch import kmeans
 from utils import filter_points_by_bounds
 from sklearn.cluster import MeanShift
+from scipy.spatial import cKDTree
+
+class FeatureCache:
+    """
+    Content-addressed cache of DINOv2 patch tokens, keyed on a hash of the resized input image and the model variant.
+    Tokens are stored in fp16, in an in-memory LRU tier and, if cache_dir is given, in an on-disk tier of .npy files
+    that are memory-mapped on load (shared across runs and processes).
+    """
+
+    def __init__(self, max_size=32, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        breakpoint()
+
+    def get_key(self, transformed_rgb, model_tag):
+        h = hashlib.sha1()
+        h.update(repr((model_tag, transformed_rgb.shape, transformed_rgb.dtype.str)).encode())
+        h.update(np.ascontiguousarray(transformed_rgb).tobytes())
+        return h.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npy')
+
+    def get(self, key):
+        """
+        Returns:
+            torch.Tensor: [num_patches, feature_dim] patch tokens, or None if not cached.
+        """
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        if self.cache_dir is not None and os.path.exists(self._get_path(key)):
+            tokens = torch.from_numpy(np.load(self._get_path(key), mmap_mode='c'))  # float16, copy-on-write memmap [num_patches, feature_dim]
+            self._insert(key, tokens)
+            self.disk_hits += 1
+            return tokens
+        self.misses += 1
+        return None
+
+    def put(self, key, tokens):
+        """
+        Returns:
+            torch.Tensor: the stored tokens, rounded to fp16 in both tiers so that every lookup of key returns the same values.
+        """
+        tokens = tokens.detach().half()
+        self._insert(key, tokens)
+        if self.cache_dir is not None and not os.path.exists(self._get_path(key)):
+            # write to a temporary file first, so that concurrent readers never see a partial file
+            tmp_path = self._get_path(key) + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, tokens.cpu().numpy())
+            os.replace(tmp_path, self._get_path(key))
+        return tokens
+
+    def _insert(self, key, tokens):
+        self.cache[key] = tokens
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def get_stats(self):
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / total if total > 0 else 0.0,
+            'size': len(self.cache),
+        }
+
+
+class _PatchTokens(torch.nn.Module):
+    """
+    Traceable wrapper around the DINOv2 backbone that only returns the normalized patch tokens (in float32).
+    """
+
+    def __init__(self, dinov2, dtype):
+        super().__init__()
+        self.dinov2 = dinov2
+        self.dtype = dtype
+
+    def forward(self, img_tensors):
+        return self.dinov2.forward_features(img_tensors.to(self.dtype))['x_norm_patchtokens'].float()
+
 
 class KeypointProposer:
     def __init__(self, config):
         self.config = config
         self.device = torch.device(self.config['device'])
-        self.dinov2 = torch.hub.load('facebookresearch/dinov2', 'dinov2_vits14').eval().to(self.device)
+        self.model_name = 'dinov2_vits14'
+        self.patch_size = 14  # dinov2
+        if self.config['backend'] == 'cpu':
+            self._load_cpu_backbone()
+            model_tag = (self.model_name, 'cpu', self.config['cpu_precision'])
+        else:
+            self.dinov2 = torch.hub.load('facebookresearch/dinov2', self.model_name).eval().to(self.device)
+            model_tag = (self.model_name, 'hub')
+        self.model_tag = '-'.join(model_tag)  # quantized / reduced precision backbones produce different features
+        self.feature_cache = None
+        if self.config['feature_cache']:
+            self.feature_cache = FeatureCache(max_size=self.config['feature_cache_size'], cache_dir=self.config['feature_cache_dir'])
         self.bounds_min = np.array(self.config['bounds_min'])
         self.bounds_max = np.array(self.config['bounds_max'])
-        self.mean_shift = MeanShift(bandwidth=self.config['min_dist_bt_keypoints'], bin_seeding=True, n_jobs=32)
-        self.patch_size = 14  # dinov2
+        if self.config['merge_method'] == 'meanshift':
+            self.mean_shift = MeanShift(bandwidth=self.config['min_dist_bt_keypoints'], bin_seeding=True, n_jobs=32)
         np.random.seed(self.config['seed'])
         torch.manual_seed(self.config['seed'])
         torch.cuda.manual_seed(self.config['seed'])
@@ -25,9 +131,12 @@ class KeypointProposer:
         # preprocessing
         transformed_rgb, rgb, points, masks, shape_info = self._preprocess(rgb, points, masks)
         # get features
-        features_flat = self._get_features(transformed_rgb, shape_info)
+        features = self._get_features(transformed_rgb, shape_info)
         # for each mask, cluster in feature space to get meaningful regions, and uske their centers as keypoint candidates
-        candidate_keypoints, candidate_pixels, candidate_rigid_group_ids = self._cluster_features(points, features_flat, masks)
+        if self.config['batched_clustering']:
+            candidate_keypoints, candidate_pixels, candidate_rigid_group_ids = self._cluster_features_batched(points, features, masks, shape_info)
+        else:
+            candidate_keypoints, candidate_pixels, candidate_rigid_group_ids = self._cluster_features(points, features, masks, shape_info)
         # exclude keypoints that are outside of the workspace
         within_space = filter_points_by_bounds(candidate_keypoints, self.bounds_min, self.bounds_max, strict=True)
         candidate_keypoints = candidate_keypoints[within_space]
@@ -44,7 +153,7 @@ class KeypointProposer:
         candidate_pixels = candidate_pixels[sort_idx]
         candidate_rigid_group_ids = candidate_rigid_group_ids[sort_idx]
         # project keypoints to image space
-        projected = self._project_keypoints_to_img(rgb, candidate_pixels, candidate_rigid_group_ids, masks, features_flat)
+        projected = self._project_keypoints_to_img(rgb, candidate_pixels, candidate_rigid_group_ids, masks, features)
         breakpoint()
         return candidate_keypoints, projected
 
@@ -74,7 +183,7 @@ class KeypointProposer:
         breakpoint()
         return transformed_rgb, rgb, points, masks, shape_info
     
-    def _project_keypoints_to_img(self, rgb, candidate_pixels, candidate_rigid_group_ids, masks, features_flat):
+    def _project_keypoints_to_img(self, rgb, candidate_pixels, candidate_rigid_group_ids, masks, features):
         projected = rgb.copy()
         # overlay keypoints on the image
         for keypoint_count, pixel in enumerate(candidate_pixels):
@@ -100,12 +209,31 @@ class KeypointProposer:
         img_w = shape_info['img_w']
         patch_h = shape_info['patch_h']
         patch_w = shape_info['patch_w']
-        # get features
-        img_tensors = torch.from_numpy(transformed_rgb).permute(2, 0, 1).unsqueeze(0).to(self.device)  # float32 [1, 3, H, W]
-        assert img_tensors.shape[1] == 3, "unexpected image shape"
-        features_dict = self.dinov2.forward_features(img_tensors)
-        raw_feature_grid = features_dict['x_norm_patchtokens']  # float32 [num_cams, patch_h*patch_w, feature_dim]
+        # get features (skip the backbone if the same image was seen before)
+        cache_key = None
+        raw_feature_grid = None
+        if self.feature_cache is not None:
+            cache_key = self.feature_cache.get_key(transformed_rgb, self.model_tag)
+            cached = self.feature_cache.get(cache_key)
+            if cached is not None:
+                raw_feature_grid = cached.to(self.device).float().unsqueeze(0)
+        if raw_feature_grid is None:
+            if self.config['backend'] == 'cpu':
+                img_tensors = torch.from_numpy(transformed_rgb).permute(2, 0, 1).unsqueeze(0)  # float32 [1, 3, H, W]
+                raw_feature_grid = self._run_cpu_backbone(img_tensors).to(self.device)  # float32 [num_cams, patch_h*patch_w, feature_dim]
+            else:
+                img_tensors = torch.from_numpy(transformed_rgb).permute(2, 0, 1).unsqueeze(0).to(self.device)  # float32 [1, 3, H, W]
+                assert img_tensors.shape[1] == 3, "unexpected image shape"
+                features_dict = self.dinov2.forward_features(img_tensors)
+                raw_feature_grid = features_dict['x_norm_patchtokens']  # float32 [num_cams, patch_h*patch_w, feature_dim]
+            if self.feature_cache is not None:
+                # continue with the cached (fp16-rounded) tokens, so the result does not depend on whether they were cached
+                raw_feature_grid = self.feature_cache.put(cache_key, raw_feature_grid[0]).float().unsqueeze(0)
         raw_feature_grid = raw_feature_grid.reshape(1, patch_h, patch_w, -1)  # float32 [num_cams, patch_h, patch_w, feature_dim]
+        if self.config['feature_resolution'] == 'patch':
+            # keep the patch grid, features are sampled at the masked pixels only (see _sample_features)
+            breakpoint()
+            return raw_feature_grid.squeeze(0)  # float32 [patch_h, patch_w, feature_dim]
         # compute per-point feature using bilinear interpolation
         interpolated_feature_grid = interpolate(raw_feature_grid.permute(0, 3, 1, 2),  # float32 [num_cams, feature_dim, patch_h, patch_w]
                                                 size=(img_h, img_w),
@@ -114,7 +242,71 @@ class KeypointProposer:
         breakpoint()
         return features_flat
 
-    def _cluster_features(self, points, features_flat, masks):
+    def _load_cpu_backbone(self):
+        """
+        Load the backbone for CPU inference without network access: the model code comes from a local clone of the
+        dinov2 repo (dinov2_repo_dir) and the weights from a local checkpoint (dinov2_weights_path). The backbone is
+        optionally converted to bf16 or dynamically quantized to int8 (linear layers), traced per input shape, and
+        warmed up at the camera resolution.
+        """
+        if self.config['cpu_num_threads'] > 0:
+            torch.set_num_threads(self.config['cpu_num_threads'])
+        dinov2 = torch.hub.load(self.config['dinov2_repo_dir'], self.model_name, source='local', pretrained=False)
+        dinov2.load_state_dict(torch.load(self.config['dinov2_weights_path'], map_location='cpu'))
+        dinov2 = dinov2.eval()
+        precision = self.config['cpu_precision']
+        if precision == 'bf16':
+            dinov2 = dinov2.to(torch.bfloat16)
+        elif precision == 'int8':
+            dinov2 = torch.ao.quantization.quantize_dynamic(dinov2, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            assert precision == 'fp32', f'unknown cpu_precision {precision}'
+        self.dinov2 = _PatchTokens(dinov2, torch.bfloat16 if precision == 'bf16' else torch.float32)
+        self.traced_dinov2 = {}  # (H, W) -> traced graph, the positional embedding interpolation is shape specific
+        if self.config['cpu_warmup']:
+            img_h, img_w = self.config['cpu_warmup_resolution']
+            warmup_input = torch.zeros(1, 3, img_h // self.patch_size * self.patch_size, img_w // self.patch_size * self.patch_size)
+            for _ in range(2):
+                self._run_cpu_backbone(warmup_input)
+        breakpoint()
+
+    @torch.no_grad()
+    def _run_cpu_backbone(self, img_tensors):
+        if not self.config['cpu_trace']:
+            return self.dinov2(img_tensors)
+        shape = tuple(img_tensors.shape[2:])
+        if shape not in self.traced_dinov2:
+            # tracing and freezing do not work on inference tensors
+            with torch.inference_mode(False):
+                traced = torch.jit.trace(self.dinov2, torch.zeros(img_tensors.shape), check_trace=False)
+                self.traced_dinov2[shape] = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+        patch_tokens = self.traced_dinov2[shape](img_tensors)
+        breakpoint()
+        return patch_tokens
+
+    def _sample_features(self, feature_grid, pixels, shape_info):
+        """
+        Bilinearly sample the patch feature grid at pixels of the full-resolution image. Same as upsampling the grid to
+        [img_h, img_w] with interpolate(..., mode='bilinear') and indexing the pixels, without the [H*W, feature_dim]
+        intermediate.
+        Args:
+            feature_grid (torch.Tensor): [patch_h, patch_w, feature_dim] patch features.
+            pixels (np.ndarray): [N, 2] (row, col) pixel coordinates.
+        Returns:
+            torch.Tensor: [N, feature_dim] features.
+        """
+        pixels = torch.as_tensor(pixels, device=feature_grid.device)
+        # normalized coordinates of the pixel centers; with align_corners=False and border padding, grid_sample computes
+        # the same source coordinates and border clamping as interpolate
+        sample_grid = torch.stack([(2 * pixels[:, 1] + 1) / shape_info['img_w'] - 1,
+                                   (2 * pixels[:, 0] + 1) / shape_info['img_h'] - 1], dim=-1).to(feature_grid.dtype)
+        features = grid_sample(feature_grid.permute(2, 0, 1)[None],  # [1, feature_dim, patch_h, patch_w]
+                               sample_grid[None, None],  # [1, 1, N, 2]
+                               mode='bilinear', padding_mode='border', align_corners=False)[0, :, 0].T  # [N, feature_dim]
+        breakpoint()
+        return features
+
+    def _cluster_features(self, points, features, masks, shape_info):
         candidate_keypoints = []
         candidate_pixels = []
         candidate_rigid_group_ids = []
@@ -125,8 +317,11 @@ class KeypointProposer:
             if np.mean(binary_mask) > self.config['max_mask_ratio']:
                 continue
             # consider only foreground features
-            obj_features_flat = features_flat[binary_mask.reshape(-1)]
             feature_pixels = np.argwhere(binary_mask)
+            if self.config['feature_resolution'] == 'patch':
+                obj_features_flat = self._sample_features(features, feature_pixels, shape_info)
+            else:
+                obj_features_flat = features[binary_mask.reshape(-1)]
             feature_points = points[binary_mask]
             # reduce dimensionality to be less sensitive to noise and texture
             obj_features_flat = obj_features_flat.double()
@@ -164,7 +359,120 @@ class KeypointProposer:
         breakpoint()
         return candidate_keypoints, candidate_pixels, candidate_rigid_group_ids
 
+    def _cluster_features_batched(self, points, features, masks, shape_info):
+        """
+        Same as _cluster_features, but all masks are clustered at once: their features are zero padded into one
+        [num_masks, max_num_pixels, feature_dim] tensor, on which the PCA and k-means (at most kmeans_iters iterations)
+        run for all masks simultaneously. Masks with fewer pixels than num_candidates_per_mask are skipped.
+        """
+        num_clusters = self.config['num_candidates_per_mask']
+        rigid_group_ids = []
+        obj_pixels = []
+        obj_points = []
+        obj_features = []
+        for rigid_group_id, binary_mask in enumerate(masks):
+            if isinstance(binary_mask, torch.Tensor):
+                binary_mask = binary_mask.detach().cpu().numpy()
+            # ignore mask that is too large (or too small to be clustered)
+            if np.mean(binary_mask) > self.config['max_mask_ratio'] or binary_mask.sum() < num_clusters:
+                continue
+            # consider only foreground features
+            feature_pixels = np.argwhere(binary_mask)
+            if self.config['feature_resolution'] != 'patch':
+                obj_features.append(features[binary_mask.reshape(-1)].float())
+            obj_pixels.append(feature_pixels)
+            obj_points.append(torch.as_tensor(np.asarray(points[binary_mask]), dtype=torch.float64))
+            rigid_group_ids.append(rigid_group_id)
+        if len(rigid_group_ids) == 0:
+            breakpoint()
+            return np.zeros((0, 3)), np.zeros((0, 2), dtype=np.int64), np.zeros((0,), dtype=np.int64)
+        num_pixels = torch.tensor([len(pixels) for pixels in obj_pixels], device=self.device)
+        valid = torch.arange(int(num_pixels.max()), device=self.device)[None] < num_pixels[:, None]  # [B, N]
+        if self.config['feature_resolution'] == 'patch':
+            # sample the features of all masks at once, directly into the padded layout
+            padded_pixels = pad_sequence([torch.as_tensor(pixels) for pixels in obj_pixels], batch_first=True)  # [B, N, 2]
+            obj_features = self._sample_features(features, padded_pixels.reshape(-1, 2), shape_info).float()
+            obj_features = obj_features.reshape(*valid.shape, -1).masked_fill_(~valid[..., None], 0)  # float32 [B, N, feature_dim]
+        else:
+            obj_features = pad_sequence(obj_features, batch_first=True)  # float32 [B, N, feature_dim]
+        # reduce dimensionality to be less sensitive to noise and texture (uncentered, so the zero padding does not
+        # change the principal directions; in double precision like _cluster_features)
+        obj_features = obj_features.double()
+        (u, s, v) = torch.pca_lowrank(obj_features, center=False)
+        features_pca = torch.bmm(obj_features, v[:, :, :3])  # [B, N, 3]
+        features_pca = self._normalize_masked(features_pca, valid)
+        # add feature_points as extra dimensions
+        feature_points = pad_sequence(obj_points, batch_first=True).to(self.device)  # [B, N, 3]
+        X = torch.cat([features_pca, self._normalize_masked(feature_points, valid)], dim=-1)
+        # cluster features to get meaningful regions
+        cluster_ids, cluster_centers = self._batched_kmeans(X, valid, num_clusters)
+        # the member closest to each cluster center in pca feature space
+        is_member = (cluster_ids[..., None] == torch.arange(num_clusters, device=self.device)) & valid[..., None]  # [B, N, K]
+        dist = torch.norm(features_pca[:, :, None] - cluster_centers[:, None, :, :3], dim=-1).masked_fill(~is_member, float('inf'))
+        closest_idx = dist.argmin(dim=1).cpu().numpy()  # [B, K]
+        has_member = is_member.any(dim=1).cpu().numpy()  # [B, K]
+        candidate_keypoints = []
+        candidate_pixels = []
+        candidate_rigid_group_ids = []
+        for i, rigid_group_id in enumerate(rigid_group_ids):
+            idx = closest_idx[i][has_member[i]]
+            candidate_keypoints.append(obj_points[i].numpy()[idx])
+            candidate_pixels.append(obj_pixels[i][idx])
+            candidate_rigid_group_ids.append(np.full(len(idx), rigid_group_id))
+        candidate_keypoints = np.concatenate(candidate_keypoints, axis=0)
+        candidate_pixels = np.concatenate(candidate_pixels, axis=0)
+        candidate_rigid_group_ids = np.concatenate(candidate_rigid_group_ids, axis=0)
+        breakpoint()
+        return candidate_keypoints, candidate_pixels, candidate_rigid_group_ids
+
+    def _normalize_masked(self, x, valid):
+        # min-max normalize each batch entry over its valid rows (constant columns, e.g., of a single row of patches,
+        # become 0 instead of nan)
+        x_min = x.masked_fill(~valid[..., None], float('inf')).min(dim=1, keepdim=True)[0]
+        x_max = x.masked_fill(~valid[..., None], -float('inf')).max(dim=1, keepdim=True)[0]
+        x = ((x - x_min) / (x_max - x_min).clamp(min=1e-12)).masked_fill(~valid[..., None], 0)
+        breakpoint()
+        return x
+
+    def _batched_kmeans(self, X, valid, num_clusters):
+        """
+        Lloyd's k-means on each batch entry (euclidean, initialized with random members like kmeans_pytorch).
+        Args:
+            X (torch.Tensor): [B, N, D] samples, of which valid [B, N] are used.
+        Returns:
+            cluster_ids (torch.Tensor): [B, N] cluster of each sample.
+            cluster_centers (torch.Tensor): [B, K, D] cluster centers.
+        """
+        B, N, D = X.shape
+        init_idx = torch.rand(valid.shape, device=X.device).masked_fill(~valid, -1).topk(num_clusters, dim=1)[1]  # [B, K]
+        cluster_centers = torch.gather(X, 1, init_idx[..., None].expand(-1, -1, D))
+        cluster_ids = None
+        weights = valid[..., None].to(X.dtype)
+        for _ in range(self.config['kmeans_iters']):
+            prev_cluster_ids = cluster_ids
+            cluster_ids = self._closest_centers(X, cluster_centers)  # [B, N]
+            if prev_cluster_ids is not None and torch.equal(cluster_ids, prev_cluster_ids):
+                break
+            sums = torch.zeros_like(cluster_centers).scatter_add_(1, cluster_ids[..., None].expand(-1, -1, D), X * weights)
+            counts = torch.zeros((B, num_clusters, 1), dtype=X.dtype, device=X.device).scatter_add_(1, cluster_ids[..., None], weights)
+            # empty clusters keep their center
+            cluster_centers = torch.where(counts > 0, sums / counts.clamp(min=1), cluster_centers)
+        else:
+            cluster_ids = self._closest_centers(X, cluster_centers)
+        breakpoint()
+        return cluster_ids, cluster_centers
+
+    def _closest_centers(self, X, cluster_centers):
+        # argmin_k |x - c_k|^2 = argmin_k (|c_k|^2 - 2 x.c_k)
+        dist = torch.baddbmm((cluster_centers ** 2).sum(dim=-1)[:, None], X, cluster_centers.transpose(1, 2), alpha=-2)
+        breakpoint()
+        return dist.argmin(dim=-1)
+
     def _merge_clusters(self, candidate_keypoints):
+        if self.config['merge_method'] == 'radius':
+            merged_indices = self._radius_merge(candidate_keypoints)
+            breakpoint()
+            return merged_indices
         self.mean_shift.fit(candidate_keypoints)
         cluster_centers = self.mean_shift.cluster_centers_
         merged_indices = []
@@ -172,4 +480,45 @@ class KeypointProposer:
             dist = np.linalg.norm(candidate_keypoints - center, axis=-1)
             merged_indices.append(np.argmin(dist))
         breakpoint()
-        return merged_indices
\ No newline at end of file
+        return merged_indices
+
+    def _radius_merge(self, candidate_keypoints):
+        """
+        Same merge as MeanShift(bandwidth=min_dist_bt_keypoints, bin_seeding=True), computed in-process with a kd-tree
+        instead of a joblib worker pool: seeds are the occupied bins of size bandwidth, each seed is shifted to the mean
+        of the candidates within bandwidth until it moves less than 1e-3 * bandwidth, and converged centers are
+        deduplicated by intensity (number of candidates within bandwidth; ties by center coordinates) like sklearn.
+        The candidate closest to each center is kept, as in _merge_clusters.
+        """
+        if len(candidate_keypoints) == 0:
+            breakpoint()
+            return []
+        bandwidth = self.config['min_dist_bt_keypoints']
+        tree = cKDTree(candidate_keypoints)
+        # bin seeding (sklearn.cluster.get_bin_seeds with min_bin_freq=1)
+        seeds = np.unique(np.round(candidate_keypoints / bandwidth), axis=0) * bandwidth
+        if len(seeds) == len(candidate_keypoints):
+            seeds = candidate_keypoints
+        center_intensity = dict()
+        for seed in seeds:
+            mean = seed
+            for _ in range(300):  # sklearn max_iter
+                within = tree.query_ball_point(mean, r=bandwidth)
+                if len(within) == 0:
+                    break
+                old_mean, mean = mean, candidate_keypoints[within].mean(axis=0)
+                if np.linalg.norm(mean - old_mean) <= 1e-3 * bandwidth:
+                    break
+            if len(within) > 0:
+                center_intensity[tuple(mean)] = len(within)
+        # keep the most intense center among the ones within bandwidth of each other
+        sorted_centers = np.array([center for center, _ in sorted(center_intensity.items(), key=lambda c: (c[1], c[0]), reverse=True)])
+        unique = np.ones(len(sorted_centers), dtype=bool)
+        center_tree = cKDTree(sorted_centers)
+        for i, center in enumerate(sorted_centers):
+            if unique[i]:
+                unique[center_tree.query_ball_point(center, r=bandwidth)] = False
+                unique[i] = True
+        merged_indices = tree.query(sorted_centers[unique])[1].tolist()
+        breakpoint()
+        return merged_indices
@@ -0,0 +1,263 @@
+"""
+Pure-NumPy batched kinematics for serial chains loaded from URDF.
+Used as a reachability backend for the solvers (see IKSolver(backend='numpy')) without requiring Lula / OmniGibson.
+"""
+import xml.etree.ElementTree as ET
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+
+class IKResult:
+    """
+    Single IK result with the same fields as lazy.lula.CyclicCoordDescentIkResult that the solvers consume.
+    """
+    def __init__(self, success, num_descents, position_error, orientation_error, cspace_position):
+        self.success = success
+        self.num_descents = num_descents
+        self.position_error = position_error
+        self.orientation_error = orientation_error
+        self.cspace_position = cspace_position
+
+    def __repr__(self):
+        return f'IKResult(success={self.success}, num_descents={self.num_descents}, position_error={self.position_error:.4f})'
+
+
+class BatchIKResult:
+    """
+    IK results for a batch of target poses. Each field is an array with a leading batch dimension.
+    Indexing returns the IKResult of a single target.
+    """
+    def __init__(self, success, num_descents, position_error, orientation_error, cspace_position):
+        self.success = np.asarray(success, dtype=bool)
+        self.num_descents = np.asarray(num_descents, dtype=np.int64)
+        self.position_error = np.asarray(position_error, dtype=np.float64)
+        self.orientation_error = np.asarray(orientation_error, dtype=np.float64)
+        self.cspace_position = np.asarray(cspace_position, dtype=np.float64)
+
+    @classmethod
+    def from_results(cls, results):
+        """Stack individual results (e.g., from Lula) into a batch."""
+        return cls(
+            success=[r.success for r in results],
+            num_descents=[r.num_descents for r in results],
+            position_error=[r.position_error for r in results],
+            orientation_error=[getattr(r, 'orientation_error', np.nan) for r in results],
+            cspace_position=np.stack([np.asarray(r.cspace_position, dtype=np.float64) for r in results]) if len(results) > 0 else np.empty((0, 0)),
+        )
+
+    def __len__(self):
+        return len(self.success)
+
+    def __getitem__(self, idx):
+        return IKResult(
+            success=bool(self.success[idx]),
+            num_descents=int(self.num_descents[idx]),
+            position_error=float(self.position_error[idx]),
+            orientation_error=float(self.orientation_error[idx]),
+            cspace_position=self.cspace_position[idx],
+        )
+
+
+def _parse_origin(element):
+    transform = np.eye(4)
+    if element is None:
+        return transform
+    xyz = [float(v) for v in element.get('xyz', '0 0 0').split()]
+    rpy = [float(v) for v in element.get('rpy', '0 0 0').split()]
+    transform[:3, :3] = R.from_euler('xyz', rpy).as_matrix()  # URDF rpy is fixed-axis XYZ
+    transform[:3, 3] = xyz
+    return transform
+
+def load_urdf_joints(urdf_path):
+    """
+    Parse the joints of a URDF file.
+    Returns:
+        dict: joint name -> dict(type, parent, child, origin [4, 4], axis [3], lower, upper)
+    """
+    root = ET.parse(urdf_path).getroot()
+    joints = dict()
+    for joint in root.findall('joint'):
+        axis_element = joint.find('axis')
+        axis = np.array([float(v) for v in axis_element.get('xyz').split()]) if axis_element is not None else np.array([1.0, 0.0, 0.0])
+        limit_element = joint.find('limit')
+        joint_type = joint.get('type')
+        if limit_element is not None and joint_type in ['revolute', 'prismatic']:
+            lower = float(limit_element.get('lower', -np.inf))
+            upper = float(limit_element.get('upper', np.inf))
+        else:
+            lower, upper = -np.inf, np.inf
+        joints[joint.get('name')] = {
+            'type': joint_type,
+            'parent': joint.find('parent').get('link'),
+            'child': joint.find('child').get('link'),
+            'origin': _parse_origin(joint.find('origin')),
+            'axis': axis / np.linalg.norm(axis),
+            'lower': lower,
+            'upper': upper,
+        }
+    return joints
+
+def batch_axis_angle_to_mat(axis, angles):
+    """
+    Rodrigues' formula for a fixed unit axis [3] and [N] angles.
+    Returns:
+        np.array: [N, 3, 3] rotation matrices.
+    """
+    K = np.array([[0, -axis[2], axis[1]],
+                  [axis[2], 0, -axis[0]],
+                  [-axis[1], axis[0], 0]])
+    sin = np.sin(angles)[:, None, None]
+    cos = np.cos(angles)[:, None, None]
+    return np.eye(3) + sin * K + (1 - cos) * (K @ K)
+
+
+class BatchedKinematics:
+    """
+    Batched forward kinematics, Jacobians and damped-least-squares IK for the chain between the URDF root link
+    (robot base) and tip_link. All poses are expressed in the robot base frame.
+
+    If cspace_joint_names is given (e.g., the cspace of the Lula robot description), joint positions are
+    expressed in that order; cspace joints that are not on the chain (e.g., the other gripper finger) are passed through.
+    """
+    def __init__(self, urdf_path, tip_link, cspace_joint_names=None):
+        joints = load_urdf_joints(urdf_path)
+        child2joint = {joint['child']: name for name, joint in joints.items()}
+        # walk up from the tip link to the root link
+        chain = []
+        link = tip_link
+        while link in child2joint:
+            chain.append(child2joint[link])
+            link = joints[child2joint[link]]['parent']
+        if len(chain) == 0:
+            raise ValueError(f'link {tip_link} not found in {urdf_path}')
+        self.root_link = link
+        self.tip_link = tip_link
+        self.chain = [dict(joints[name], name=name) for name in reversed(chain)]
+        chain_dof_names = [joint['name'] for joint in self.chain if joint['type'] != 'fixed']
+        self.joint_names = list(cspace_joint_names) if cspace_joint_names is not None else chain_dof_names
+        for name in chain_dof_names:
+            if name not in self.joint_names:
+                raise ValueError(f'chain joint {name} is not part of the cspace {self.joint_names}')
+        for joint in self.chain:
+            joint['idx'] = self.joint_names.index(joint['name']) if joint['type'] != 'fixed' else None
+        self.dof = len(self.joint_names)
+        self.lower = np.full(self.dof, -np.inf)
+        self.upper = np.full(self.dof, np.inf)
+        for joint in self.chain:
+            if joint['idx'] is not None:
+                self.lower[joint['idx']] = joint['lower']
+                self.upper[joint['idx']] = joint['upper']
+        self.chain_idx = np.array([joint['idx'] for joint in self.chain if joint['idx'] is not None], dtype=np.int64)
+
+    def _forward(self, q, compute_jacobian=False):
+        q = np.atleast_2d(np.asarray(q, dtype=np.float64))
+        num = q.shape[0]
+        pose = np.tile(np.eye(4), (num, 1, 1))
+        joint_positions = []
+        joint_axes = []
+        joint_types = []
+        joint_indices = []
+        for joint in self.chain:
+            pose = pose @ joint['origin']
+            if joint['type'] == 'fixed':
+                continue
+            angle = q[:, joint['idx']]
+            if compute_jacobian:
+                joint_positions.append(pose[:, :3, 3].copy())
+                joint_axes.append(pose[:, :3, :3] @ joint['axis'])
+                joint_types.append(joint['type'])
+                joint_indices.append(joint['idx'])
+            motion = np.tile(np.eye(4), (num, 1, 1))
+            if joint['type'] in ['revolute', 'continuous']:
+                motion[:, :3, :3] = batch_axis_angle_to_mat(joint['axis'], angle)
+            elif joint['type'] == 'prismatic':
+                motion[:, :3, 3] = angle[:, None] * joint['axis']
+            else:
+                raise NotImplementedError(f'joint type {joint["type"]} is not supported')
+            pose = pose @ motion
+        if not compute_jacobian:
+            return pose, None
+        jacobian = np.zeros((num, 6, self.dof))
+        tip_pos = pose[:, :3, 3]
+        for pos, axis, joint_type, idx in zip(joint_positions, joint_axes, joint_types, joint_indices):
+            if joint_type == 'prismatic':
+                jacobian[:, :3, idx] = axis
+            else:
+                jacobian[:, :3, idx] = np.cross(axis, tip_pos - pos)
+                jacobian[:, 3:, idx] = axis
+        return pose, jacobian
+
+    def fk(self, q):
+        """
+        Args:
+            q (np.ndarray): [N, dof] joint positions.
+        Returns:
+            np.ndarray: [N, 4, 4] tip poses in the base frame.
+        """
+        return self._forward(q)[0]
+
+    def jacobian(self, q):
+        """
+        Args:
+            q (np.ndarray): [N, dof] joint positions.
+        Returns:
+            np.ndarray: [N, 6, dof] geometric Jacobian (linear; angular) of the tip in the base frame.
+        """
+        return self._forward(q, compute_jacobian=True)[1]
+
+    def solve_ik(self,
+                 target_poses,
+                 initial_joint_pos,
+                 position_tolerance=0.01,
+                 orientation_tolerance=0.05,
+                 max_iterations=150,
+                 damping=0.05,
+                 max_step=0.2):
+        """
+        Damped-least-squares IK for many target poses at once.
+
+        Args:
+            target_poses (np.ndarray): [N, 4, 4] target tip poses in the base frame.
+            initial_joint_pos (np.ndarray): [dof] or [N, dof] seeds.
+            position_tolerance (float): maximum position error (L2-norm) for a successful solution.
+            orientation_tolerance (float): maximum orientation error (angle in radian) for a successful solution.
+            max_iterations (int): maximum number of DLS iterations.
+            damping (float): damping factor of the least-squares step.
+            max_step (float): maximum joint displacement per iteration.
+        Returns:
+            BatchIKResult: num_descents is the number of iterations used until convergence (max_iterations if not converged).
+        """
+        target_poses = np.asarray(target_poses, dtype=np.float64).reshape(-1, 4, 4)
+        num = target_poses.shape[0]
+        q = np.array(np.broadcast_to(np.asarray(initial_joint_pos, dtype=np.float64), (num, self.dof)))
+        q = np.clip(q, self.lower, self.upper)
+        num_descents = np.full(num, max_iterations, dtype=np.int64)
+        converged = np.zeros(num, dtype=bool)
+        eye = np.eye(6)
+        for it in range(max_iterations + 1):
+            pose, jacobian = self._forward(q, compute_jacobian=True)
+            pos_err = target_poses[:, :3, 3] - pose[:, :3, 3]
+            rot_err = R.from_matrix(target_poses[:, :3, :3] @ np.transpose(pose[:, :3, :3], (0, 2, 1))).as_rotvec()
+            pos_err_norm = np.linalg.norm(pos_err, axis=-1)
+            rot_err_norm = np.linalg.norm(rot_err, axis=-1)
+            newly_converged = ~converged & (pos_err_norm < position_tolerance) & (rot_err_norm < orientation_tolerance)
+            num_descents[newly_converged] = it
+            converged |= newly_converged
+            active = ~converged
+            if it == max_iterations or not active.any():
+                break
+            # dq = J^T (J J^T + lambda^2 I)^-1 e
+            J = jacobian[active]
+            err = np.concatenate([pos_err[active], rot_err[active]], axis=-1)
+            JJt = J @ np.transpose(J, (0, 2, 1)) + (damping ** 2) * eye
+            dq = np.einsum('nji,nj->ni', J, np.linalg.solve(JJt, err[..., None])[..., 0])
+            step_norm = np.max(np.abs(dq), axis=-1, keepdims=True)
+            dq = dq * np.minimum(1.0, max_step / np.maximum(step_norm, 1e-12))
+            q[active] = np.clip(q[active] + dq, self.lower, self.upper)
+        return BatchIKResult(
+            success=converged,
+            num_descents=num_descents,
+            position_error=pos_err_norm,
+            orientation_error=rot_err_norm,
+            cspace_position=q,
+        )
@@ -5,15 +5,16 @@ import numpy as np
 import json
 import os
 import argparse
-from environment import ReKepOGEnv
 from keypoint_proposal import KeypointProposer
 from constraint_generation import ConstraintGenerator
-from ik_solver import IKSolver
+from ik_solver import IKSolver, CachedIKSolver
 from subgoal_solver import SubgoalSolver
 from path_solver import PathSolver
 from visualizer import Visualizer
+from planning_context import PlanningContextCache
+from async_planner import AsyncPlanner
+from replan_policy import ReplanPolicy, REUSE, WARM_START, FROM_SCRATCH
 import transform_utils as T
-from omnigibson.robots.fetch import Fetch
 from utils import (
     bcolors,
     get_config,
@@ -21,6 +22,8 @@ from utils import (
     get_linear_interpolation_steps,
     spline_interpolate_poses,
     get_callable_grasping_cost_fn,
+    get_grasping_costs,
+    grasping_cost_snapshot,
     print_opt_debug_dict,
 )
 
@@ -39,7 +42,12 @@ class Main:
         self.keypoint_proposer = KeypointProposer(global_config['keypoint_proposer'])
         self.constraint_generator = ConstraintGenerator(global_config['constraint_generator'])
         # initialize environment
-        self.env = ReKepOGEnv(global_config['env'], scene_file, verbose=False)
+        if self.config['env_type'] == 'headless':
+            from headless_environment import HeadlessEnv
+            self.env = HeadlessEnv(global_config['headless_env'], verbose=False)
+        else:
+            from environment import ReKepOGEnv  # requires OmniGibson
+            self.env = ReKepOGEnv(global_config['env'], scene_file, verbose=False)
         # setup ik solver (for reachability cost)
         # assert isinstance(self.env.robot, Fetch), "The IK solver assumes the robot is a Fetch robot"
         ik_solver = IKSolver(
@@ -49,11 +57,31 @@ class Main:
             reset_joint_pos=self.env.reset_joint_pos,
             world2robot_homo=self.env.world2robot_homo,
             robot_name=self.env.robot.name,
-            robot=self.env.robot
+            robot=self.env.robot,
+            backend=global_config['ik_solver']['backend'],
         )
+        if global_config['ik_solver']['cache']:
+            ik_solver = CachedIKSolver(
+                ik_solver,
+                max_size=global_config['ik_solver']['cache_size'],
+                pos_resolution=global_config['ik_solver']['cache_pos_resolution'],
+                rot_resolution=global_config['ik_solver']['cache_rot_resolution'],
+                seed_resolution=global_config['ik_solver']['cache_seed_resolution'],
+                cache_path=global_config['ik_solver']['cache_path'],
+            )
+        self.ik_solver = ik_solver
         # initialize solvers
         self.subgoal_solver = SubgoalSolver(global_config['subgoal_solver'], ik_solver, self.env.reset_joint_pos)
         self.path_solver = PathSolver(global_config['path_solver'], ik_solver, self.env.reset_joint_pos)
+        # sdf sampler, downsampled collision points and centered keypoints shared by the solvers of each iteration
+        self.planning_context_cache = PlanningContextCache()
+        # solve the next plan in the background while the current one is executed
+        if self.config['pipelined_planning']:
+            assert global_config['subgoal_solver']['multistart_workers'] == 0 and global_config['path_solver']['multistart_workers'] == 0, \
+                "multistart forks its workers and cannot run on the planner thread (see multistart.py)"
+        self.planner = AsyncPlanner(self._plan) if self.config['pipelined_planning'] else None
+        # only re-solve when the world deviates from what the current plan assumed
+        self.replan_policy = ReplanPolicy(global_config['replan_policy']) if global_config['replan_policy']['enabled'] else None
         # initialize visualizer
         if self.visualize:
             self.visualizer = Visualizer(global_config['visualizer'], self.env)
@@ -61,7 +89,7 @@ class Main:
 
     def perform_task(self, instruction, rekep_program_dir=None, disturbance_seq=None):
         self.env.reset()
-        cam_obs = self.env.get_cam_obs()
+        cam_obs = self.env.get_cam_obs(cam_ids=[self.config['vlm_camera']], modalities=['rgb', 'points', 'seg'])
         rgb = cam_obs[self.config['vlm_camera']]['rgb']
         points = cam_obs[self.config['vlm_camera']]['points']
         mask = cam_obs[self.config['vlm_camera']]['seg']
@@ -104,7 +132,7 @@ class Main:
             for constraint_type in ['subgoal', 'path']:
                 load_path = os.path.join(rekep_program_dir, f'stage{stage}_{constraint_type}_constraints.txt')
                 get_grasping_cost_fn = get_callable_grasping_cost_fn(self.env)  # special grasping function for VLM to call
-                stage_dict[constraint_type] = load_functions_from_txt(load_path, get_grasping_cost_fn) if os.path.exists(load_path) else []
+                stage_dict[constraint_type] = load_functions_from_txt(load_path, get_grasping_cost_fn, vectorized=self.config['vectorize_constraints']) if os.path.exists(load_path) else []
             self.constraint_fns[stage] = stage_dict
         
         # bookkeeping of which keypoints can be moved in the optimization
@@ -120,6 +148,7 @@ class Main:
             self.curr_joint_pos = self.env.get_arm_joint_postions()
             self.sdf_voxels = self.env.get_sdf_voxels(self.config['sdf_voxel_size'])
             self.collision_points = self.env.get_collision_points()
+            self.grasping_costs = get_grasping_costs(self.env, self.program_info['num_keypoints'])
             # ====================================
             # = decide whether to backtrack
             # ====================================
@@ -155,13 +184,18 @@ class Main:
                 # ====================================
                 # = get optimized plan
                 # ====================================
-                if self.last_sim_step_counter == self.env.step_counter:
-                    print(f"{bcolors.WARNING}sim did not step forward within last iteration (HINT: adjust action_steps_per_iter to be larger or the pos_threshold to be smaller){bcolors.ENDC}")
-                next_subgoal = self._get_next_subgoal(from_scratch=self.first_iter)
-                next_path = self._get_next_path(next_subgoal, from_scratch=self.first_iter)
-                self.first_iter = False
-                self.action_queue = next_path.tolist()
-                self.last_sim_step_counter = self.env.step_counter
+                self.planning_context = self.planning_context_cache.get(self.keypoints, self.keypoint_movable_mask, self.sdf_voxels, self.collision_points)
+                replan_decision = self._get_replan_decision()
+                if self.planner is not None:
+                    self._update_plan_async(replan_decision)
+                elif replan_decision != REUSE:
+                    if self.last_sim_step_counter == self.env.step_counter:
+                        print(f"{bcolors.WARNING}sim did not step forward within last iteration (HINT: adjust action_steps_per_iter to be larger or the pos_threshold to be smaller){bcolors.ENDC}")
+                    snapshot = self._get_planning_snapshot(from_scratch=replan_decision == FROM_SCRATCH)
+                    next_subgoal, next_path = self._plan(snapshot)
+                    self.first_iter = False
+                    self._set_plan(next_subgoal, next_path, snapshot)
+                    self.last_sim_step_counter = self.env.step_counter
                 # ====================================
                 # = execute
                 # ====================================
@@ -187,52 +221,131 @@ class Main:
                     self._update_stage(self.stage + 1)
             breakpoint()
 
-    def _get_next_subgoal(self, from_scratch):
-        subgoal_constraints = self.constraint_fns[self.stage]['subgoal']
-        path_constraints = self.constraint_fns[self.stage]['path']
-        subgoal_pose, debug_dict = self.subgoal_solver.solve(self.curr_ee_pose,
-                                                            self.keypoints,
-                                                            self.keypoint_movable_mask,
+    def _get_planning_snapshot(self, from_scratch):
+        """inputs of _plan, captured on the main thread so that they can be solved on the planner thread while the robot moves"""
+        snapshot = {
+            'stage': self.stage,
+            'is_grasp_stage': self.is_grasp_stage,
+            'ee_pose': self.curr_ee_pose,
+            'joint_pos': self.curr_joint_pos,
+            'planning_context': self.planning_context,
+            'grasping_costs': self.grasping_costs,
+            'gripper_null_action': self.env.get_gripper_null_action(),
+            'from_scratch': from_scratch,
+        }
+        breakpoint()
+        return snapshot
+
+    def _plan(self, snapshot):
+        # evaluate the grasping costs in the constraints against the snapshot instead of the live environment
+        with grasping_cost_snapshot(snapshot['grasping_costs']):
+            next_subgoal = self._get_next_subgoal(snapshot)
+            next_path = self._get_next_path(next_subgoal, snapshot)
+        breakpoint()
+        return next_subgoal, next_path
+
+    def _get_replan_decision(self):
+        """whether to reuse the current plan, or re-solve with warm start or from scratch (see replan_policy.py)"""
+        if self.replan_policy is not None:
+            decision = self.replan_policy.decide(self.keypoints, self.curr_ee_pose, self.grasping_costs)
+        else:
+            decision = WARM_START
+        if self.first_iter:
+            decision = FROM_SCRATCH
+        elif decision == REUSE and len(self.action_queue) == 0:
+            decision = WARM_START  # nothing left to reuse
+        breakpoint()
+        return decision
+
+    def _set_plan(self, next_subgoal, next_path, snapshot, start_idx=0):
+        if self.replan_policy is not None:
+            self.replan_policy.record(snapshot['planning_context'].keypoints,
+                                      snapshot['planning_context'].keypoint_movable_mask,
+                                      snapshot['ee_pose'],
+                                      snapshot['grasping_costs'],
+                                      next_path)
+        self.action_queue = next_path[start_idx:].tolist()
+        if self.visualize:
+            self.visualizer.visualize_subgoal(next_subgoal)
+            self.visualizer.visualize_path(next_path)
+        breakpoint()
+
+    def _update_plan_async(self, replan_decision):
+        """
+        Pipelined planning: swap in the newest plan if one is ready and keep the planner busy with the latest state
+        (unless the current plan can be reused), so that the next plan is solved while the current one is executed.
+        Blocks only if there is nothing to execute, until a plan for the current stage is available.
+        """
+        result = self.planner.poll()
+        if result is None and len(self.action_queue) == 0:
+            while result is None:
+                # after a stage change, the planner may still be busy with an invalidated solve; queue the current
+                # state behind it instead of waiting for a plan that will be discarded
+                if not self.planner.is_planning():
+                    self.planner.submit(self._get_planning_snapshot(from_scratch=replan_decision == FROM_SCRATCH))
+                    self.first_iter = False
+                result = self.planner.wait()
+        elif self.planner.is_idle() and replan_decision != REUSE:
+            self.planner.submit(self._get_planning_snapshot(from_scratch=replan_decision == FROM_SCRATCH))
+            self.first_iter = False
+        if result is not None:
+            snapshot, (next_subgoal, next_path) = result
+            # the plan starts at the pose of its snapshot, skip the part the robot has already moved past
+            start_idx = np.argmin(np.linalg.norm(next_path[:, :3] - self.curr_ee_pose[:3], axis=1))
+            self._set_plan(next_subgoal, next_path, snapshot, start_idx=start_idx)
+        breakpoint()
+
+    def _get_next_subgoal(self, snapshot):
+        subgoal_constraints = self.constraint_fns[snapshot['stage']]['subgoal']
+        path_constraints = self.constraint_fns[snapshot['stage']]['path']
+        subgoal_pose, debug_dict = self.subgoal_solver.solve(snapshot['ee_pose'],
+                                                            None,
+                                                            None,
                                                             subgoal_constraints,
                                                             path_constraints,
-                                                            self.sdf_voxels,
-                                                            self.collision_points,
-                                                            self.is_grasp_stage,
-                                                            self.curr_joint_pos,
-                                                            from_scratch=from_scratch)
+                                                            None,
+                                                            None,
+                                                            snapshot['is_grasp_stage'],
+                                                            snapshot['joint_pos'],
+                                                            from_scratch=snapshot['from_scratch'],
+                                                            planning_context=snapshot['planning_context'])
         subgoal_pose_homo = T.convert_pose_quat2mat(subgoal_pose)
         # if grasp stage, back up a bit to leave room for grasping
-        if self.is_grasp_stage:
+        if snapshot['is_grasp_stage']:
             subgoal_pose[:3] += subgoal_pose_homo[:3, :3] @ np.array([-self.config['grasp_depth'] / 2.0, 0, 0])
-        debug_dict['stage'] = self.stage
+        debug_dict['stage'] = snapshot['stage']
+        debug_dict['planning_context'] = self.planning_context_cache.get_stats()
+        if self.replan_policy is not None:
+            debug_dict['replan_policy'] = self.replan_policy.get_stats()
+        if isinstance(self.ik_solver, CachedIKSolver):
+            debug_dict['ik_cache'] = self.ik_solver.get_stats()
         print_opt_debug_dict(debug_dict)
-        if self.visualize:
-            self.visualizer.visualize_subgoal(subgoal_pose)
         breakpoint()
         return subgoal_pose
 
-    def _get_next_path(self, next_subgoal, from_scratch):
-        path_constraints = self.constraint_fns[self.stage]['path']
-        path, debug_dict = self.path_solver.solve(self.curr_ee_pose,
+    def _get_next_path(self, next_subgoal, snapshot):
+        path_constraints = self.constraint_fns[snapshot['stage']]['path']
+        path, debug_dict = self.path_solver.solve(snapshot['ee_pose'],
                                                     next_subgoal,
-                                                    self.keypoints,
-                                                    self.keypoint_movable_mask,
+                                                    None,
+                                                    None,
                                                     path_constraints,
-                                                    self.sdf_voxels,
-                                                    self.collision_points,
-                                                    self.curr_joint_pos,
-                                                    from_scratch=from_scratch)
+                                                    None,
+                                                    None,
+                                                    snapshot['joint_pos'],
+                                                    from_scratch=snapshot['from_scratch'],
+                                                    planning_context=snapshot['planning_context'])
+        if isinstance(self.ik_solver, CachedIKSolver):
+            debug_dict['ik_cache'] = self.ik_solver.get_stats()
         print_opt_debug_dict(debug_dict)
-        processed_path = self._process_path(path)
-        if self.visualize:
-            self.visualizer.visualize_path(processed_path)
+        processed_path = self._process_path(path, snapshot['ee_pose'], snapshot['gripper_null_action'])
         breakpoint()
         return processed_path
 
-    def _process_path(self, path):
-        # spline interpolate the path from the current ee pose
+    def _process_path(self, path, ee_pose, gripper_null_action):
+        # spline interpolate the path from the ee pose
         full_control_points = np.concatenate([
-            self.curr_ee_pose.reshape(1, -1),
+            ee_pose.reshape(1, -1),
             path,
         ], axis=0)
         num_steps = get_linear_interpolation_steps(full_control_points[0], full_control_points[-1],
@@ -242,7 +355,7 @@ class Main:
         # add gripper action
         ee_action_seq = np.zeros((dense_path.shape[0], 8))
         ee_action_seq[:, :7] = dense_path
-        ee_action_seq[:, 7] = self.env.get_gripper_null_action()
+        ee_action_seq[:, 7] = gripper_null_action
         breakpoint()
         return ee_action_seq
 
@@ -255,8 +368,12 @@ class Main:
         assert self.is_grasp_stage + self.is_release_stage <= 1, "Cannot be both grasp and release stage"
         if self.is_grasp_stage:  # ensure gripper is open for grasping stage
             self.env.open_gripper()
-        # clear action queue
+        # clear action queue (and drop the plans of the previous stage that are still being solved)
         self.action_queue = []
+        if self.planner is not None:
+            self.planner.invalidate()
+        if self.replan_policy is not None:
+            self.replan_policy.reset()
         # update keypoint movable mask
         self._update_keypoint_movable_mask()
         self.first_iter = True
@@ -0,0 +1,105 @@
+"""
+Multi-start optimization over a fork-based process pool.
+
+The objective arguments of the solvers contain objects that cannot be pickled (e.g., constraint functions loaded
+with exec, Lula kinematics), so the start functions are handed to the workers through a module-level context that
+the forked processes inherit. Only the start index is sent to the workers and only the optimization results are sent back.
+
+Once a result satisfies all constraints, the remaining starts are stopped: their objectives are wrapped with
+stoppable, which raises StartStopped as soon as the stop event is set.
+
+Forking a multithreaded process can deadlock the children on locks held by other threads at fork time (e.g., BLAS,
+numba or imageio locks), so the workers are only forked from the main thread while no other thread is alive (e.g., no
+pipelined_planning planner thread or video encoder thread); otherwise the starts run serially in-process with a warning.
+"""
+import threading
+import warnings
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+_context = None
+
+
+class StartStopped(Exception):
+    """raised by a stoppable objective once another start satisfied all constraints"""
+
+
+def stoppable(fn, stop_event):
+    """wrap fn (e.g., an objective) so that it raises StartStopped once stop_event is set"""
+    if stop_event is None:
+        return fn
+    def wrapped(*args, **kwargs):
+        if stop_event.is_set():
+            raise StartStopped()
+        return fn(*args, **kwargs)
+    return wrapped
+
+def _run_start(idx):
+    try:
+        return _context['start_fns'][idx](_context['stop_event'])
+    except StartStopped:
+        return None
+
+def multistart(start_fns, is_satisfied, num_workers):
+    """
+    Run independent optimizations in parallel and stop the remaining ones once a result satisfies all constraints.
+
+    Args:
+        start_fns (List[Callable]): each is called with a stop event (multiprocessing.Event) in a worker and returns a
+            scipy.optimize.OptimizeResult. Their objectives should be wrapped with stoppable, so that they stop (and are
+            discarded) once the event is set. The event is None when the starts run serially.
+        is_satisfied (Callable): called in the main process on each result, returns whether it satisfies all constraints.
+        num_workers (int): number of worker processes.
+    Returns:
+        results (List[OptimizeResult]): results of the finished starts.
+        satisfied (List[bool]): whether each result satisfies all constraints.
+    """
+    global _context
+    if threading.current_thread() is not threading.main_thread() or threading.active_count() > 1:
+        warnings.warn('multistart only forks its workers from the main thread with no other threads alive '
+                      f'(running threads: {[t.name for t in threading.enumerate()]}); running the starts serially')
+        return _multistart_serial(start_fns, is_satisfied)
+    ctx = mp.get_context('fork')
+    stop_event = ctx.Event()
+    _context = {'start_fns': start_fns, 'stop_event': stop_event}
+    results, satisfied = [], []
+    try:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(start_fns)), mp_context=ctx) as executor:
+            futures = [executor.submit(_run_start, i) for i in range(len(start_fns))]
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                result = future.result()
+                if result is None:
+                    continue  # stopped
+                results.append(result)
+                satisfied.append(is_satisfied(result))
+                if satisfied[-1] and not stop_event.is_set():
+                    stop_event.set()
+                    for f in futures:
+                        f.cancel()
+    finally:
+        _context = None
+    return results, satisfied
+
+def _multistart_serial(start_fns, is_satisfied):
+    results, satisfied = [], []
+    for start_fn in start_fns:
+        results.append(start_fn(None))
+        satisfied.append(is_satisfied(results[-1]))
+        if satisfied[-1]:
+            break
+    return results, satisfied
+
+def select_best(results, satisfied):
+    """
+    Lowest-cost result among the ones satisfying all constraints, or the lowest-cost result if none does.
+    Function evaluations of all starts are accumulated in nfev.
+    """
+    candidates = [r for r, s in zip(results, satisfied) if s]
+    if len(candidates) == 0:
+        candidates = results
+    best = candidates[int(np.argmin([r.fun for r in candidates]))]
+    best.nfev = sum(r.nfev for r in results)
+    return best
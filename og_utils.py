@@ -1,5 +1,6 @@
 from omnigibson.sensors.vision_sensor import VisionSensor
 import transform_utils as T
+from utils import LazyObservation, get_camera_rays, deproject_depth
 import numpy as np
 import torch
 
@@ -12,28 +13,51 @@ class OGCamera:
         self.cam.set_position_orientation(config['position'], config['orientation'])
         self.intrinsics = get_cam_intrinsics(self.cam)
         self.extrinsics = get_cam_extrinsics(self.cam)
+        # the camera is fixed, so deprojection reduces to origin + depth * direction with a precomputed ray table
+        self.ray_origin, self.ray_directions = get_camera_rays(self.intrinsics, self.extrinsics, config['resolution'], config['resolution'],
+                                                               dtype=np.dtype(config['points_dtype']))
+        self._torch_rays = dict()
 
     def get_params(self):
         """
         Get the intrinsic and extrinsic parameters of the camera
         """
         return {"intrinsics": self.intrinsics, "extrinsics": self.extrinsics}
+
+    def deproject(self, depth, out=None):
+        """
+        [H, W] linear depth to [H, W, 3] world-frame points. Numpy depth is written to out if given, otherwise to a new
+        array. Torch depth stays on its device and returns a tensor.
+        """
+        if isinstance(depth, torch.Tensor):
+            key = (depth.device, depth.dtype)
+            if key not in self._torch_rays:
+                self._torch_rays[key] = tuple(torch.as_tensor(x, device=depth.device, dtype=depth.dtype) for x in (self.ray_origin, self.ray_directions))
+            ray_origin, ray_directions = self._torch_rays[key]
+            return torch.addcmul(ray_origin, depth.unsqueeze(-1), ray_directions, out=out)
+        return deproject_depth(depth, self.ray_origin, self.ray_directions, out=out)
     
     def get_obs(self):
         """
         Gets the image observation from the camera.
         Assumes have rendered befor calling this function.
         No semantic handling here for now.
+        The modalities (rgb, depth, points, seg, intrinsic, extrinsic) are fetched on first access, so the observation
+        should be used before the next simulation step. The points are freshly allocated, so they stay valid after it.
         """
-        obs = self.cam.get_obs()
-        ret = {}
-        ret["rgb"] = obs[0]["rgb"][:,:,:3]  # H, W, 3
-        ret["depth"] = obs[0]["depth_linear"]  # H, W
-        ret["points"] = pixel_to_3d_points(ret["depth"], self.intrinsics, self.extrinsics)  # H, W, 3
-        ret["seg"] = obs[0]["seg_semantic"]  # H, W
-        ret["intrinsic"] = self.intrinsics
-        ret["extrinsic"] = self.extrinsics
-        return ret
+        sensor_obs = dict()
+        def get_sensor_obs(modality):
+            if len(sensor_obs) == 0:
+                sensor_obs.update(self.cam.get_obs()[0])
+            return sensor_obs[modality]
+        return LazyObservation({
+            "rgb": lambda obs: get_sensor_obs("rgb")[:,:,:3],  # H, W, 3
+            "depth": lambda obs: get_sensor_obs("depth_linear"),  # H, W
+            "points": lambda obs: self.deproject(obs["depth"]),  # H, W, 3
+            "seg": lambda obs: get_sensor_obs("seg_semantic"),  # H, W
+            "intrinsic": lambda obs: self.intrinsics,
+            "extrinsic": lambda obs: self.extrinsics,
+        })
 
 def insert_camera(name, og_env, width=480, height=480):
     try:
@@ -87,57 +111,15 @@ def get_cam_extrinsics(cam):
     return T.pose_inv(T.pose2mat(cam.get_position_orientation()))
 
 def pixel_to_3d_points(depth_image, intrinsics, extrinsics):
-    # Get the shape of the depth image
+    """
+    [H, W] linear depth to [H, W, 3] world-frame points. Builds the ray table on every call, use
+    OGCamera.deproject for repeated deprojection with a fixed camera.
+    """
+    if isinstance(depth_image, torch.Tensor):
+        depth_image = depth_image.numpy()
     H, W = depth_image.shape
-
-    # Create a grid of (x, y) coordinates corresponding to each pixel in the image
-    i, j = np.meshgrid(np.arange(W), np.arange(H), indexing='xy')
-
-    # Unpack the intrinsic parameters
-    fx, fy = intrinsics[0, 0], intrinsics[1, 1]
-    cx, cy = intrinsics[0, 2], intrinsics[1, 2]
-
-    # Convert pixel coordinates to normalized camera coordinates
-    z = depth_image
-
-    if isinstance(z, torch.Tensor):
-        z = z.numpy()
-    if isinstance(cx, torch.Tensor):
-        cx = cx.item()
-    if isinstance(fx, torch.Tensor):
-        fx = fx.item()
-
-    x = (i - cx) * z / fx
-    y = (j - cy) * z / fy
-
-    # Stack the coordinates to form (H, W, 3)
-    camera_coordinates = np.stack((x, y, z), axis=-1)
-
-    # Reshape to (H*W, 3) for matrix multiplication
-    camera_coordinates = camera_coordinates.reshape(-1, 3)
-
-    # Convert to homogeneous coordinates (H*W, 4)
-    camera_coordinates_homogeneous = np.hstack((camera_coordinates, np.ones((camera_coordinates.shape[0], 1))))
-
-    # additional conversion to og convention
-    T_mod = np.array([[1., 0., 0., 0., ],
-              [0., -1., 0., 0.,],
-              [0., 0., -1., 0.,],
-              [0., 0., 0., 1.,]])
-    camera_coordinates_homogeneous = camera_coordinates_homogeneous @ T_mod
-
-    # Apply extrinsics to get world coordinates
-    # world_coordinates_homogeneous = camera_coordinates_homogeneous @ extrinsics.T
-    world_coordinates_homogeneous = T.pose_inv(extrinsics) @ (camera_coordinates_homogeneous.T)
-    world_coordinates_homogeneous = world_coordinates_homogeneous.T
-
-    # Convert back to non-homogeneous coordinates
-    world_coordinates = world_coordinates_homogeneous[:, :3] / world_coordinates_homogeneous[:, 3, np.newaxis]
-
-    # Reshape back to (H, W, 3)
-    world_coordinates = world_coordinates.reshape(H, W, 3)
-
-    return world_coordinates
+    ray_origin, ray_directions = get_camera_rays(intrinsics, extrinsics, H, W)
+    return deproject_depth(depth_image, ray_origin, ray_directions)
 
 def point_to_pixel(pt, intrinsics, extrinsics):
     """
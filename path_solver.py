@@ -1,12 +1,11 @@
 import pdb
 import numpy as np
 from scipy.optimize import dual_annealing, minimize
-from scipy.interpolate import RegularGridInterpolator
 import copy
+import functools
 import time
 import transform_utils as T
 from utils import (
-    farthest_point_sampling,
     get_linear_interpolation_steps,
     linear_interpolate_poses,
     normalize_vars,
@@ -15,7 +14,18 @@ from utils import (
     calculate_collision_cost,
     path_length,
     transform_keypoints,
+    batch_transform_keypoints,
+    get_num_samples_per_segment_jitted,
+    batch_collision_cost_grad,
+    batch_constraint_violation_grad,
+    rotation_angle_grad,
+    wrench_to_pose_euler_grad,
+    slerp_rotmats,
 )
+from constraint_compiler import batch_evaluate_constraints
+from multistart import multistart, select_best, stoppable
+from planning_context import PlanningContext
+from sdf_utils import PATH_COLLISION_THRESHOLD
 
 # ====================================
 # = objective function
@@ -53,7 +63,7 @@ def objective(opt_vars,
     cost = 0
     # collision cost
     if collision_points_centered is not None:
-        collision_cost = 0.5 * calculate_collision_cost(poses_homo[start_idx:end_idx], sdf_func, collision_points_centered, 0.20)
+        collision_cost = 0.5 * calculate_collision_cost(poses_homo[start_idx:end_idx], sdf_func, collision_points_centered, PATH_COLLISION_THRESHOLD)
         debug_dict['collision_cost'] = collision_cost
         cost += collision_cost
 
@@ -65,30 +75,19 @@ def objective(opt_vars,
     cost += path_length_cost
 
     # reachability cost
-    ik_cost = 0
-    reset_reg_cost = 0
-    debug_dict['ik_pos_error'] = []
-    debug_dict['ik_feasible'] = []
     max_iterations = 20
-    for control_point_homo in control_points_homo:
-        ik_result = ik_solver.solve(
-                        control_point_homo,
-                        max_iterations=max_iterations,
-                        initial_joint_pos=initial_joint_pos,
-                    )
-        debug_dict['ik_pos_error'].append(ik_result.position_error)
-        debug_dict['ik_feasible'].append(ik_result.success)
-        ik_cost += 20.0 * (ik_result.num_descents / max_iterations)
-        if ik_result.success:
-            # reset_reg = np.linalg.norm(ik_result.cspace_position[:-1] - reset_joint_pos[:-1].numpy())
-            ik_dim = len(ik_result.cspace_position)
-            reset_reg = np.linalg.norm(ik_result.cspace_position - reset_joint_pos[:ik_dim].numpy())
-            reset_reg = np.clip(reset_reg, 0.0, 3.0)
-        else:
-            reset_reg = 3.0
-        reset_reg_cost += 0.2 * reset_reg
-    debug_dict['ik_pos_error'] = np.array(debug_dict['ik_pos_error'])
-    debug_dict['ik_feasible'] = np.array(debug_dict['ik_feasible'])
+    ik_results = ik_solver.solve_batch(
+                    control_points_homo,
+                    max_iterations=max_iterations,
+                    initial_joint_pos=initial_joint_pos,
+                )
+    ik_cost = np.sum(20.0 * (ik_results.num_descents / max_iterations))
+    ik_dim = ik_results.cspace_position.shape[-1]
+    reset_reg = np.linalg.norm(ik_results.cspace_position - np.asarray(reset_joint_pos[:ik_dim]), axis=-1)
+    reset_reg = np.where(ik_results.success, np.clip(reset_reg, 0.0, 3.0), 3.0)
+    reset_reg_cost = np.sum(0.2 * reset_reg)
+    debug_dict['ik_pos_error'] = ik_results.position_error
+    debug_dict['ik_feasible'] = ik_results.success
     debug_dict['ik_cost'] = ik_cost
     debug_dict['reset_reg_cost'] = reset_reg_cost
     cost += ik_cost
@@ -96,14 +95,10 @@ def objective(opt_vars,
     # # path constraint violation cost
     debug_dict['path_violation'] = None
     if path_constraints is not None and len(path_constraints) > 0:
-        path_constraint_cost = 0
-        path_violation = []
-        for pose in poses_homo[start_idx:end_idx]:
-            transformed_keypoints = transform_keypoints(pose, keypoints_centered, keypoint_movable_mask)
-            for constraint in path_constraints:
-                violation = constraint(transformed_keypoints[0], transformed_keypoints[1:])
-                path_violation.append(violation)
-                path_constraint_cost += np.clip(violation, 0, np.inf)
+        # evaluate all dense samples at once, [num_samples, num_constraints]
+        transformed_keypoints = batch_transform_keypoints(poses_homo[start_idx:end_idx], keypoints_centered, keypoint_movable_mask)
+        path_violation = batch_evaluate_constraints(path_constraints, transformed_keypoints).flatten().tolist()
+        path_constraint_cost = np.sum(np.clip(path_violation, 0, np.inf))
         path_constraint_cost = 200.0*path_constraint_cost
         debug_dict['path_constraint_cost'] = path_constraint_cost
         debug_dict['path_violation'] = path_violation
@@ -116,6 +111,82 @@ def objective(opt_vars,
     breakpoint()
     return cost
 
+def objective_grad(opt_vars,
+                og_bounds,
+                start_pose,
+                end_pose,
+                keypoints_centered,
+                keypoint_movable_mask,
+                path_constraints,
+                sdf_func,
+                collision_points_centered,
+                opt_interpolate_pos_step_size,
+                opt_interpolate_rot_step_size,
+                ik_solver,
+                initial_joint_pos,
+                reset_joint_pos):
+    """
+    Gradient of objective w.r.t. opt_vars.
+    The collision and path constraint terms are differentiated at the dense samples (as world-frame wrenches) and
+    propagated to the two control points of each segment through the lerp/slerp interpolation (the slerp by central
+    differences of the interpolation only). The number of samples per segment is held fixed. The path length of linear/slerp segments equals the sum of distances between consecutive control
+    points and is differentiated exactly. The reachability terms are piecewise constant and contribute no gradient.
+    """
+    unnormalized_opt_vars = unnormalize_vars(opt_vars, og_bounds)
+    control_points_euler = np.concatenate([start_pose[None], unnormalized_opt_vars.reshape(-1, 6), end_pose[None]], axis=0)  # [num_control_points, 6]
+    control_points_homo = T.convert_pose_euler2mat(control_points_euler)  # [num_control_points, 4, 4]
+    control_points_quat = T.convert_pose_mat2quat(control_points_homo)  # [num_control_points, 7]
+    poses_quat, num_poses = get_samples_jitted(control_points_homo, control_points_quat, opt_interpolate_pos_step_size, opt_interpolate_rot_step_size)
+    poses_homo = T.convert_pose_quat2mat(poses_quat)
+    start_idx, end_idx = 1, num_poses - 1  # exclude start and goal
+    # segment index and interpolation weight of each dense sample
+    num_samples_per_segment = get_num_samples_per_segment_jitted(control_points_homo, opt_interpolate_pos_step_size, opt_interpolate_rot_step_size)
+    segment_idx = np.repeat(np.arange(len(num_samples_per_segment)), num_samples_per_segment)
+    alpha = np.concatenate([np.arange(n) / (n - 1) for n in num_samples_per_segment])
+
+    sample_wrench = np.zeros((num_poses, 6))
+    # collision cost
+    if collision_points_centered is not None:
+        _, collision_wrench = batch_collision_cost_grad(poses_homo[start_idx:end_idx], sdf_func, collision_points_centered, PATH_COLLISION_THRESHOLD)
+        sample_wrench[start_idx:end_idx] += 0.5 * collision_wrench
+    # path constraint violation cost
+    if path_constraints is not None and len(path_constraints) > 0:
+        violation, violation_wrench = batch_constraint_violation_grad(path_constraints, poses_homo[start_idx:end_idx], keypoints_centered, keypoint_movable_mask)
+        sample_wrench[start_idx:end_idx] += 200.0 * np.sum(violation_wrench * (violation > 0)[..., None], axis=1)
+    # positions are linearly interpolated
+    control_grad = np.zeros((len(control_points_homo), 6))
+    np.add.at(control_grad[:, :3], segment_idx, (1 - alpha)[:, None] * sample_wrench[:, :3])
+    np.add.at(control_grad[:, :3], segment_idx + 1, alpha[:, None] * sample_wrench[:, :3])
+    # rotations are slerped, differentiate the interpolation w.r.t. the euler angles of both ends of each segment
+    sample_rotmat = poses_homo[:, :3, :3]
+    eps = 1e-6
+    for k in range(3):
+        perturbed_rotmat = [T.euler2mat(control_points_euler[:, 3:] + sign * eps * np.eye(3)[k]) for sign in [1, -1]]
+        for end, weight_idx in [(0, segment_idx), (1, segment_idx + 1)]:
+            rotmats = []
+            for perturbed in perturbed_rotmat:
+                start_rotmat = perturbed[segment_idx] if end == 0 else control_points_homo[segment_idx, :3, :3]
+                end_rotmat = perturbed[segment_idx + 1] if end == 1 else control_points_homo[segment_idx + 1, :3, :3]
+                rotmats.append(slerp_rotmats(start_rotmat, end_rotmat, alpha))
+            # world-frame angular velocity of each sample
+            dR = (rotmats[0] - rotmats[1]) / (2 * eps) @ np.transpose(sample_rotmat, (0, 2, 1))
+            omega = np.stack([dR[:, 2, 1], dR[:, 0, 2], dR[:, 1, 0]], axis=-1)
+            np.add.at(control_grad[:, 3 + k], weight_idx, np.sum(sample_wrench[:, 3:] * omega, axis=-1))
+
+    # path length, sum of distances between consecutive control points
+    pos_diff = control_points_homo[1:, :3, 3] - control_points_homo[:-1, :3, 3]
+    pos_distance = np.linalg.norm(pos_diff, axis=-1, keepdims=True)
+    pos_grad = np.where(pos_distance > 0, pos_diff / np.maximum(pos_distance, 1e-12), 0.0)
+    _, rot_grad = rotation_angle_grad(control_points_homo[1:, :3, :3], control_points_homo[:-1, :3, :3])
+    length_wrench = np.zeros((len(control_points_homo), 6))
+    length_wrench[1:] += 4.0 * np.concatenate([pos_grad, rot_grad], axis=-1)
+    length_wrench[:-1] -= 4.0 * np.concatenate([pos_grad, rot_grad], axis=-1)
+    control_grad += wrench_to_pose_euler_grad(length_wrench, control_points_euler[:, 3:])
+
+    # chain rule through the normalization (start and end poses are fixed)
+    grad = control_grad[1:-1].flatten() * (og_bounds[:, 1] - og_bounds[:, 0]) / 2
+    breakpoint()
+    return grad
 
 class PathSolver:
     """
@@ -130,8 +201,13 @@ class PathSolver:
         self.ik_solver = ik_solver
         self.reset_joint_pos = reset_joint_pos
         self.last_opt_result = None
+        self.snapshot_recorder = None
         # warmup
         self._warmup()
+        # record the inputs of every solve (see benchmark.py)
+        if self.config['snapshot_dir'] is not None:
+            from benchmark import SnapshotRecorder
+            self.snapshot_recorder = SnapshotRecorder(self.config['snapshot_dir'], 'path_solver', ik_solver)
 
     def _warmup(self):
         start_pose = np.array([0.0, 0.0, 0.3, 0, 0, 0, 1])
@@ -145,15 +221,6 @@ class PathSolver:
         self.last_opt_result = None
         breakpoint()
 
-    def _setup_sdf(self, sdf_voxels):
-        # create callable sdf function with interpolation
-        x = np.linspace(self.config['bounds_min'][0], self.config['bounds_max'][0], sdf_voxels.shape[0])
-        y = np.linspace(self.config['bounds_min'][1], self.config['bounds_max'][1], sdf_voxels.shape[1])
-        z = np.linspace(self.config['bounds_min'][2], self.config['bounds_max'][2], sdf_voxels.shape[2])
-        sdf_func = RegularGridInterpolator((x, y, z), sdf_voxels, bounds_error=False, fill_value=0)
-        breakpoint()
-        return sdf_func
-
     def _check_opt_result(self, opt_result, path_quat, debug_dict, og_bounds):
         # accept the opt_result if it's only terminated due to iteration limit
         if (not opt_result.success and ('maximum' in opt_result.message.lower() or 'iteration' in opt_result.message.lower() or 'not necessarily' in opt_result.message.lower())):
@@ -171,13 +238,64 @@ class PathSolver:
         breakpoint()
         return opt_result
 
-    def _center_collision_points_and_keypoints(self, ee_pose, collision_points, keypoints, keypoint_movable_mask):
-        ee_pose_homo = T.pose2mat([ee_pose[:3], T.euler2quat(ee_pose[3:])])
-        centering_transform = np.linalg.inv(ee_pose_homo)
-        collision_points_centered = np.dot(collision_points, centering_transform[:3, :3].T) + centering_transform[:3, 3]
-        keypoints_centered = transform_keypoints(centering_transform, keypoints, keypoint_movable_mask)
+    def _global_search(self, bounds, aux_args, init_sol, seed=None, stop_event=None):
+        """
+        One dual annealing search. Stops early if @stop_event is set.
+        """
+        opt_result = dual_annealing(
+            func=stoppable(objective, stop_event),
+            bounds=bounds,
+            args=aux_args,
+            maxfun=self.config['sampling_maxfun'],
+            x0=init_sol,
+            seed=seed,
+            callback=None if stop_event is None else (lambda x, f, context: stop_event.is_set()),
+            no_local_search=True,
+            minimizer_kwargs={
+                'method': 'SLSQP',
+                'options': self.config['minimizer_options'],
+            },
+        )
+        if isinstance(opt_result.message, list):
+            opt_result.message = opt_result.message[0]
         breakpoint()
-        return collision_points_centered, keypoints_centered
+        return opt_result
+
+    def _local_search(self, bounds, aux_args, init_sol, stop_event=None):
+        opt_result = minimize(
+            fun=stoppable(objective, stop_event),
+            x0=init_sol,
+            args=aux_args,
+            jac=objective_grad if self.config['jac'] == 'analytic' else None,
+            bounds=bounds,
+            method='SLSQP',
+            options=self.config['minimizer_options'],
+        )
+        breakpoint()
+        return opt_result
+
+    def _is_satisfied(self, opt_result, aux_args):
+        _, debug_dict = objective(opt_result.x, *aux_args, return_debug_dict=True)
+        satisfied = self._check_opt_result(copy.deepcopy(opt_result), None, debug_dict, aux_args[0]).success
+        breakpoint()
+        return satisfied
+
+    def _multistart_search(self, bounds, aux_args, init_sol):
+        """
+        Several independently seeded global searches (the first one from @init_sol), plus a local refinement
+        from the last solution if it has the same number of control points, run in parallel worker processes.
+        """
+        seeds = np.random.randint(0, 2**31 - 1, size=self.config['multistart_num_starts'])
+        start_fns = [functools.partial(self._global_search, bounds, aux_args, init_sol if i == 0 else None, int(seed))
+                     for i, seed in enumerate(seeds)]
+        if self.last_opt_result is not None and len(self.last_opt_result.x) == len(bounds):
+            start_fns.append(functools.partial(self._local_search, bounds, aux_args, self.last_opt_result.x))
+        results, satisfied = multistart(start_fns,
+                                        functools.partial(self._is_satisfied, aux_args=aux_args),
+                                        self.config['multistart_workers'])
+        opt_result = select_best(results, satisfied)
+        breakpoint()
+        return opt_result
 
     def solve(self,
             start_pose,
@@ -188,7 +306,8 @@ class PathSolver:
             sdf_voxels,
             collision_points,
             initial_joint_pos,
-            from_scratch=False):
+            from_scratch=False,
+            planning_context=None):
         """
         Args:
             - start_pose (np.ndarray): [7], [x, y, z, qx, qy, qz, qw]
@@ -196,19 +315,33 @@ class PathSolver:
             - keypoints (np.ndarray): [num_keypoints, 3]
             - keypoint_movable_mask (bool): whether the keypoints are on the object being grasped
             - path_constraints (List[Callable]): path constraints
-            - sdf_voxels (np.ndarray): [H, W, D]
+            - sdf_voxels (np.ndarray or SparseSDF): [H, W, D]
             - collision_points (np.ndarray): [num_points, 3], point cloud of the object being grasped
             - initial_joint_pos (np.ndarray): [N] initial joint positions of the robot.
             - from_scratch (bool): whether to start from scratch
+            - planning_context (PlanningContext): if given, keypoints, keypoint_movable_mask, sdf_voxels and collision_points
+                are taken from it (and can be None), so that the setup is shared with the other solver (see planning_context.py)
 
         Returns:
             - opt_result (scipy.optimize.OptimizeResult): optimization opt_result
             - debug_dict (dict): debug information
         """
-        # downsample collision points
-        if collision_points is not None and collision_points.shape[0] > self.config['max_collision_points']:
-            collision_points = farthest_point_sampling(collision_points, self.config['max_collision_points'])
-        sdf_func = self._setup_sdf(sdf_voxels)
+        if planning_context is None:
+            planning_context = PlanningContext(keypoints, keypoint_movable_mask, sdf_voxels, collision_points)
+        keypoint_movable_mask = planning_context.keypoint_movable_mask
+        if self.snapshot_recorder is not None:
+            self.snapshot_recorder.record(self.last_opt_result,
+                                          start_pose=start_pose,
+                                          end_pose=end_pose,
+                                          keypoints=planning_context.keypoints,
+                                          keypoint_movable_mask=keypoint_movable_mask,
+                                          path_constraints=path_constraints,
+                                          sdf_voxels=planning_context.sdf_voxels,
+                                          collision_points=planning_context.collision_points,
+                                          initial_joint_pos=initial_joint_pos,
+                                          from_scratch=from_scratch)
+        sdf_func = planning_context.get_sdf_func(self.config['bounds_min'], self.config['bounds_max'], self.config['sdf_interpolator'])
+        start_pose_homo = T.pose2mat([start_pose[:3].astype(np.float64), start_pose[3:].astype(np.float64)])
 
         # ====================================
         # = setup bounds
@@ -258,7 +391,8 @@ class PathSolver:
         # ====================================
         # = other setup
         # ====================================
-        collision_points_centered, keypoints_centered = self._center_collision_points_and_keypoints(start_pose, collision_points, keypoints, keypoint_movable_mask)
+        # downsampled collision points and keypoints in the frame of the start pose
+        collision_points_centered, keypoints_centered = planning_context.get_centered(start_pose_homo, self.config['max_collision_points'])
         aux_args = (og_bounds,
                     start_pose,
                     end_pose,
@@ -278,29 +412,13 @@ class PathSolver:
         # ====================================
         start = time.time()
         # use global optimization for the first iteration
-        if from_scratch:
-            opt_result = dual_annealing(
-                func=objective,
-                bounds=bounds,
-                args=aux_args,
-                maxfun=self.config['sampling_maxfun'],
-                x0=init_sol,
-                no_local_search=True,
-                minimizer_kwargs={
-                    'method': 'SLSQP',
-                    'options': self.config['minimizer_options'],
-                },
-            )
+        if from_scratch and self.config['multistart_workers'] > 0:
+            opt_result = self._multistart_search(bounds, aux_args, init_sol)
+        elif from_scratch:
+            opt_result = self._global_search(bounds, aux_args, init_sol)
         # use gradient-based local optimization for the following iterations
         else:
-            opt_result = minimize(
-                fun=objective,
-                x0=init_sol,
-                args=aux_args,
-                bounds=bounds,
-                method='SLSQP',
-                options=self.config['minimizer_options'],
-            )
+            opt_result = self._local_search(bounds, aux_args, init_sol)
         solve_time = time.time() - start
         
         # ====================================
@@ -312,6 +430,7 @@ class PathSolver:
         _, debug_dict = objective(opt_result.x, *aux_args, return_debug_dict=True)
         debug_dict['sol'] = opt_result.x.reshape(-1, 6)
         debug_dict['msg'] = opt_result.message
+        debug_dict['nfev'] = opt_result.nfev
         debug_dict['solve_time'] = solve_time
         debug_dict['from_scratch'] = from_scratch
         debug_dict['type'] = 'path_solver'
@@ -321,6 +440,7 @@ class PathSolver:
         poses_euler = np.concatenate([sol.reshape(-1, 6), end_pose[None]], axis=0)
         poses_quat = T.convert_pose_euler2quat(poses_euler)  # [num_control_points, 7]
         opt_result = self._check_opt_result(opt_result, poses_quat, debug_dict, og_bounds)
+        debug_dict['success'] = opt_result.success
         # cache opt_result for future use if successful
         if opt_result.success:
             self.last_opt_result = copy.deepcopy(opt_result)
@@ -0,0 +1,126 @@
+"""
+Planning inputs shared by the subgoal and path solvers within one control iteration.
+
+Both solvers need a callable SDF, the downsampled collision points and the keypoints (and collision points) centered at
+the current end-effector pose. A PlanningContext builds each of these lazily and memoizes it per solver setting, so
+the solvers of one iteration share the work, and PlanningContextCache carries the memoized entries over to the next
+iteration as long as the corresponding inputs are unchanged.
+"""
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from sdf_utils import TrilinearSDF, SparseSDF
+from utils import farthest_point_sampling, transform_keypoints
+
+
+def build_sdf_func(sdf_voxels, bounds_min, bounds_max, interpolator='trilinear'):
+    """
+    Args:
+        sdf_voxels (np.ndarray or SparseSDF): [X, Y, Z] signed distance field, sampled as spanning
+            np.linspace(bounds_min, bounds_max, [X, Y, Z]) by all interpolators (SparseSDF uses the same convention).
+        interpolator (str): trilinear (numba kernel), or scipy (RegularGridInterpolator).
+    Returns:
+        callable sdf function with interpolation.
+    """
+    if isinstance(sdf_voxels, SparseSDF):
+        # already callable with the fused collision kernels
+        return sdf_voxels
+    if interpolator == 'trilinear':
+        return TrilinearSDF(sdf_voxels, bounds_min, bounds_max)
+    x = np.linspace(bounds_min[0], bounds_max[0], sdf_voxels.shape[0])
+    y = np.linspace(bounds_min[1], bounds_max[1], sdf_voxels.shape[1])
+    z = np.linspace(bounds_min[2], bounds_max[2], sdf_voxels.shape[2])
+    return RegularGridInterpolator((x, y, z), sdf_voxels, bounds_error=False, fill_value=0)
+
+
+class PlanningContext:
+    def __init__(self, keypoints, keypoint_movable_mask, sdf_voxels, collision_points):
+        """
+        Args:
+            keypoints (np.ndarray): [M, 3] keypoint positions (the first one is the end effector).
+            keypoint_movable_mask (np.ndarray): [M] whether the keypoint moves with the end effector.
+            sdf_voxels (np.ndarray or SparseSDF): [X, Y, Z] signed distance field of the environment.
+            collision_points (np.ndarray or None): [N, 3] points of the gripper and the grasped object.
+        The (small) arrays are copied, so the context stays valid if the caller modifies them in place.
+        """
+        self.keypoints = np.array(keypoints, dtype=np.float64)
+        self.keypoint_movable_mask = np.array(keypoint_movable_mask, dtype=bool)
+        self.sdf_voxels = sdf_voxels  # not copied; the environments hand out a new grid when the scene changes
+        self.collision_points = None if collision_points is None else np.array(collision_points, dtype=np.float64)
+        self._sdf_funcs = dict()
+        self._collision_points = dict()
+        self._centered = dict()
+
+    def get_sdf_func(self, bounds_min, bounds_max, interpolator='trilinear'):
+        key = (tuple(np.asarray(bounds_min, dtype=np.float64)), tuple(np.asarray(bounds_max, dtype=np.float64)), interpolator)
+        if key not in self._sdf_funcs:
+            self._sdf_funcs[key] = build_sdf_func(self.sdf_voxels, bounds_min, bounds_max, interpolator)
+        return self._sdf_funcs[key]
+
+    def get_collision_points(self, max_points):
+        """collision points farthest-point downsampled to at most max_points"""
+        if self.collision_points is None or self.collision_points.shape[0] <= max_points:
+            return self.collision_points
+        if max_points not in self._collision_points:
+            self._collision_points[max_points] = farthest_point_sampling(self.collision_points, max_points)
+        return self._collision_points[max_points]
+
+    def get_centered(self, ee_pose_homo, max_points):
+        """
+        Args:
+            ee_pose_homo (np.ndarray): [4, 4] end-effector pose to center at.
+            max_points (int): maximum number of collision points.
+        Returns:
+            collision_points_centered (np.ndarray or None): [N, 3] downsampled collision points in the end-effector frame.
+            keypoints_centered (np.ndarray): [M, 3] keypoints with the movable ones in the end-effector frame.
+        """
+        key = (np.asarray(ee_pose_homo, dtype=np.float64).tobytes(), max_points)
+        if key not in self._centered:
+            centering_transform = np.linalg.inv(ee_pose_homo)
+            collision_points = self.get_collision_points(max_points)
+            collision_points_centered = None
+            if collision_points is not None:
+                collision_points_centered = np.dot(collision_points, centering_transform[:3, :3].T) + centering_transform[:3, 3]
+            keypoints_centered = transform_keypoints(centering_transform, self.keypoints, self.keypoint_movable_mask)
+            self._centered[key] = (collision_points_centered, keypoints_centered)
+        return self._centered[key]
+
+
+class PlanningContextCache:
+    """
+    Builds the PlanningContext of each control iteration and reuses what does not depend on the changed inputs:
+        - everything, if none of the inputs changed (e.g., the simulation did not step)
+        - the SDF samplers, if the environment returned the same SDF object (it does so until an object moved)
+        - the downsampled collision points, if the collision points are equal
+    """
+    def __init__(self):
+        self.context = None
+        self.num_builds = 0
+        self.num_reuses = 0
+
+    def get(self, keypoints, keypoint_movable_mask, sdf_voxels, collision_points):
+        prev = self.context
+        if prev is not None:
+            same_sdf = sdf_voxels is prev.sdf_voxels
+            same_collision_points = _array_equal(collision_points, prev.collision_points)
+            same_keypoints = np.array_equal(keypoints, prev.keypoints) and np.array_equal(keypoint_movable_mask, prev.keypoint_movable_mask)
+            if same_sdf and same_collision_points and same_keypoints:
+                self.num_reuses += 1
+                return prev
+        context = PlanningContext(keypoints, keypoint_movable_mask, sdf_voxels, collision_points)
+        if prev is not None:
+            if same_sdf:
+                context._sdf_funcs = prev._sdf_funcs
+            if same_collision_points:
+                context._collision_points = prev._collision_points
+        self.context = context
+        self.num_builds += 1
+        return context
+
+    def get_stats(self):
+        return {'builds': self.num_builds, 'reuses': self.num_reuses}
+
+
+def _array_equal(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return np.array_equal(a, b)
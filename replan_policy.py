@@ -0,0 +1,100 @@
+"""
+Event-driven replanning: decide in each control iteration whether the current plan can be kept.
+
+A plan assumes that the keypoints that are not grasped stay where they were, that the grasped ones move rigidly with
+the end effector, that the end effector follows the planned path and that the grasp state does not change. The policy
+compares the current state with these assumptions and returns
+    - reuse: keep executing the remaining actions of the current plan
+    - warm_start: re-solve starting from the previous solution (small deviations)
+    - from_scratch: re-solve with global search (large deviations, e.g., disturbances, or a changed grasp state)
+"""
+import numpy as np
+import transform_utils as T
+from utils import transform_keypoints, angle_between_quats
+
+REUSE = 'reuse'
+WARM_START = 'warm_start'
+FROM_SCRATCH = 'from_scratch'
+
+
+class ReplanPolicy:
+    def __init__(self, config):
+        """
+        Args:
+            config (dict): keypoint_threshold, keypoint_scratch_threshold (m), ee_pos_threshold (m),
+                ee_rot_threshold (rad) and max_reuse_iters (iterations after which the plan is refreshed anyway, or None).
+        """
+        self.config = config
+        self.stats = {REUSE: 0, WARM_START: 0, FROM_SCRATCH: 0}
+        self.last_info = dict()
+        self.reset()
+
+    def reset(self):
+        """forget the current plan (e.g., on stage transitions), so that the next decision is from_scratch"""
+        self.plan_keypoints = None
+        self.plan_keypoint_movable_mask = None
+        self.plan_ee_pose_homo = None
+        self.plan_grasping_costs = None
+        self.plan_poses = None
+        self.num_reuses = 0
+
+    def record(self, keypoints, keypoint_movable_mask, ee_pose, grasping_costs, path):
+        """
+        Args:
+            keypoints (np.ndarray): [M, 3] keypoints the plan was solved from.
+            keypoint_movable_mask (np.ndarray): [M] whether the keypoint moves with the end effector.
+            ee_pose (np.ndarray): [7] end-effector pose the plan was solved from.
+            grasping_costs (list): grasping cost of each scene keypoint (see utils.get_grasping_costs).
+            path (np.ndarray): [N, 7+] planned end-effector poses (the actions).
+        """
+        self.plan_keypoints = np.array(keypoints, dtype=np.float64)
+        self.plan_keypoint_movable_mask = np.array(keypoint_movable_mask, dtype=bool)
+        self.plan_ee_pose_homo = T.convert_pose_quat2mat(np.asarray(ee_pose, dtype=np.float64))
+        self.plan_grasping_costs = list(grasping_costs)
+        self.plan_poses = np.concatenate([np.asarray(ee_pose, dtype=np.float64)[None, :7], np.asarray(path, dtype=np.float64)[:, :7]], axis=0)
+        self.num_reuses = 0
+
+    def decide(self, keypoints, ee_pose, grasping_costs):
+        """
+        Args:
+            keypoints (np.ndarray): [M, 3] current keypoints (the first one is the end effector).
+            ee_pose (np.ndarray): [7] current end-effector pose.
+            grasping_costs (list): current grasping cost of each scene keypoint.
+        Returns:
+            decision (str): reuse, warm_start or from_scratch (the reason is stored in last_info).
+        """
+        self.last_info = dict()
+        if self.plan_poses is None:
+            decision, reason = FROM_SCRATCH, 'no plan'
+        elif list(grasping_costs) != self.plan_grasping_costs:
+            decision, reason = FROM_SCRATCH, 'grasp state changed'
+        else:
+            ee_pose = np.asarray(ee_pose, dtype=np.float64)
+            # where the keypoints should be if the world behaved as the plan assumed
+            relative_transform = T.convert_pose_quat2mat(ee_pose) @ np.linalg.inv(self.plan_ee_pose_homo)
+            expected_keypoints = transform_keypoints(relative_transform, self.plan_keypoints, self.plan_keypoint_movable_mask)
+            keypoint_deviation = np.max(np.linalg.norm(keypoints - expected_keypoints, axis=1))
+            # how far the end effector is from the planned path
+            pos_errors = np.linalg.norm(self.plan_poses[:, :3] - ee_pose[:3], axis=1)
+            closest_idx = np.argmin(pos_errors)
+            ee_pos_error = pos_errors[closest_idx]
+            ee_rot_error = angle_between_quats(self.plan_poses[closest_idx, 3:7], ee_pose[3:7])
+            self.last_info = {'keypoint_deviation': keypoint_deviation, 'ee_pos_error': ee_pos_error, 'ee_rot_error': ee_rot_error}
+            if keypoint_deviation > self.config['keypoint_scratch_threshold']:
+                decision, reason = FROM_SCRATCH, 'keypoints moved'
+            elif keypoint_deviation > self.config['keypoint_threshold']:
+                decision, reason = WARM_START, 'keypoints moved'
+            elif ee_pos_error > self.config['ee_pos_threshold'] or ee_rot_error > self.config['ee_rot_threshold']:
+                decision, reason = WARM_START, 'end effector off the path'
+            elif self.config['max_reuse_iters'] is not None and self.num_reuses >= self.config['max_reuse_iters']:
+                decision, reason = WARM_START, 'refresh'
+            else:
+                decision, reason = REUSE, None
+        if decision == REUSE:
+            self.num_reuses += 1
+        self.last_info['reason'] = reason
+        self.stats[decision] += 1
+        return decision
+
+    def get_stats(self):
+        return dict(self.stats)
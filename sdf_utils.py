@@ -0,0 +1,493 @@
+import numpy as np
+import trimesh
+import open3d as o3d
+from numba import njit
+
+# hinge thresholds of the solvers' collision costs: SDF values below -threshold do not contribute
+SUBGOAL_COLLISION_THRESHOLD = 0.10
+PATH_COLLISION_THRESHOLD = 0.20
+MAX_COLLISION_THRESHOLD = max(SUBGOAL_COLLISION_THRESHOLD, PATH_COLLISION_THRESHOLD)
+
+
+def get_sdf_grid_axes(bounds_min, bounds_max, resolution):
+    """
+    Axes of the SDF voxel grid (same discretization as np.mgrid with the per-axis step).
+    Returns:
+        list of np.ndarray: x, y, z coordinates of the voxel centers.
+    """
+    shape = np.ceil((bounds_max - bounds_min) / resolution).astype(int)
+    steps = (bounds_max - bounds_min) / shape
+    return [bounds_min[i] + steps[i] * np.arange(shape[i]) for i in range(3)]
+
+def compute_sdf(scene_mesh, points):
+    """
+    Signed distance of points [N, 3] to a triangle mesh using open3d (positive inside, negative outside).
+    """
+    scene = o3d.t.geometry.RaycastingScene()
+    vertex_positions = o3d.core.Tensor(scene_mesh.vertices, dtype=o3d.core.Dtype.Float32)
+    triangle_indices = o3d.core.Tensor(scene_mesh.faces, dtype=o3d.core.Dtype.UInt32)
+    _ = scene.add_triangles(vertex_positions, triangle_indices)  # we do not need the geometry ID for mesh
+    sdf = scene.compute_signed_distance(points.astype(np.float32)).cpu().numpy()
+    # open3d has flipped sign from our convention
+    return -sdf
+
+def compute_closest_points(meshes, points):
+    """
+    Exact closest surface points of points [N, 3] on a list of triangle meshes (same frame), in one batched BVH query.
+    Returns:
+        closest_points (np.ndarray): [N, 3] closest points on the surfaces.
+        mesh_indices (np.ndarray): [N] index of the mesh each closest point lies on.
+        distances (np.ndarray): [N] distances to the closest points.
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    scene = o3d.t.geometry.RaycastingScene()
+    geometry_id_to_index = dict()
+    for i, mesh in enumerate(meshes):
+        vertex_positions = o3d.core.Tensor(np.asarray(mesh.vertices), dtype=o3d.core.Dtype.Float32)
+        triangle_indices = o3d.core.Tensor(np.asarray(mesh.faces), dtype=o3d.core.Dtype.UInt32)
+        geometry_id_to_index[scene.add_triangles(vertex_positions, triangle_indices)] = i
+    result = scene.compute_closest_points(o3d.core.Tensor(points))
+    closest_points = result['points'].numpy().astype(np.float64)
+    mesh_indices = np.array([geometry_id_to_index[int(g)] for g in result['geometry_ids'].numpy()], dtype=np.int64)
+    distances = np.linalg.norm(closest_points - points, axis=1)
+    return closest_points, mesh_indices, distances
+
+
+class SDFManager:
+    """
+    Incrementally maintained SDF voxel grid.
+
+    Collision meshes are cached in their local frame (keyed by e.g. the prim path) and only their world poses are
+    tracked across updates. If nothing moved, the cached grid is returned; otherwise only the voxels inside the
+    bounding box of the changed meshes (old and new poses), expanded by @margin, are recomputed.
+    Voxels outside of this box are at least @margin away from any changed mesh, so their values remain exact
+    wherever |sdf| < margin. The margin must exceed MAX_COLLISION_THRESHOLD so that every voxel feeding a collision
+    cost is exact; by default it is MAX_COLLISION_THRESHOLD plus one voxel.
+    If @sparse_band is set, a SparseSDF with this band is returned instead and rebuilt when a mesh moved.
+    """
+    def __init__(self, bounds_min, bounds_max, resolution, margin=None, pose_tolerance=1e-5, sparse_band=None):
+        self.bounds_min = np.array(bounds_min)
+        self.bounds_max = np.array(bounds_max)
+        self.resolution = resolution
+        if margin is None:
+            margin = MAX_COLLISION_THRESHOLD + resolution
+        assert margin > MAX_COLLISION_THRESHOLD, f'SDF update margin {margin} must exceed the collision threshold {MAX_COLLISION_THRESHOLD}'
+        self.margin = margin
+        self.sparse_band = sparse_band
+        self.pose_tolerance = pose_tolerance
+        self.axes = get_sdf_grid_axes(self.bounds_min, self.bounds_max, resolution)
+        self.shape = tuple(len(axis) for axis in self.axes)
+        self.local_meshes = dict()
+        self.poses = dict()
+        self.sdf_voxels = None
+
+    def _world_bounds(self, key, pose):
+        corners = trimesh.bounds.corners(self.local_meshes[key].bounds)
+        corners = corners @ pose[:3, :3].T + pose[:3, 3]
+        return corners.min(axis=0), corners.max(axis=0)
+
+    def _get_scene_mesh(self):
+        meshes = []
+        for key, pose in self.poses.items():
+            mesh = self.local_meshes[key].copy()
+            mesh.apply_transform(pose)
+            meshes.append(mesh)
+        return trimesh.util.concatenate(meshes)
+
+    def _get_sdf_fn(self):
+        if len(self.poses) == 0:
+            # empty scene: every point is far outside
+            return lambda points: np.full(len(points), -np.linalg.norm(self.bounds_max - self.bounds_min))
+        scene_mesh = self._get_scene_mesh()
+        return lambda points: compute_sdf(scene_mesh, points)
+
+    def update(self, mesh_entries):
+        """
+        Args:
+            mesh_entries (dict): key -> (world pose with scale [4, 4], callable returning the trimesh mesh in local frame).
+                The callable is only invoked for keys that are not cached yet.
+        Returns:
+            np.ndarray or SparseSDF: SDF voxel grid with shape self.shape.
+        """
+        changed_bounds = []
+        for key in list(self.poses.keys()):
+            if key not in mesh_entries:
+                changed_bounds.append(self._world_bounds(key, self.poses.pop(key)))
+        for key, (pose, mesh_fn) in mesh_entries.items():
+            pose = np.asarray(pose, dtype=np.float64)
+            if key not in self.local_meshes:
+                self.local_meshes[key] = mesh_fn()
+            if key in self.poses:
+                if np.allclose(self.poses[key], pose, atol=self.pose_tolerance):
+                    continue
+                changed_bounds.append(self._world_bounds(key, self.poses[key]))
+            self.poses[key] = pose
+            changed_bounds.append(self._world_bounds(key, pose))
+        if self.sdf_voxels is not None and len(changed_bounds) == 0:
+            return self.sdf_voxels
+        if self.sparse_band is not None:
+            self.sdf_voxels = SparseSDF.from_function(self._get_sdf_fn(), self.bounds_min, self.bounds_max, self.resolution, self.sparse_band)
+            return self.sdf_voxels
+        if self.sdf_voxels is None:
+            region = tuple(slice(0, n) for n in self.shape)
+        else:
+            # pad by one voxel so that voxels exactly at the margin are included
+            padding = self.margin + self.resolution
+            region_min = np.min([b[0] for b in changed_bounds], axis=0) - padding
+            region_max = np.max([b[1] for b in changed_bounds], axis=0) + padding
+            region = tuple(slice(np.searchsorted(axis, region_min[i], side='left'), np.searchsorted(axis, region_max[i], side='right'))
+                           for i, axis in enumerate(self.axes))
+            # copy so that grids handed out earlier are not modified
+            self.sdf_voxels = self.sdf_voxels.copy()
+        if any(s.stop <= s.start for s in region):
+            return self.sdf_voxels
+        grid = np.stack(np.meshgrid(*[axis[s] for axis, s in zip(self.axes, region)], indexing='ij'), axis=-1)
+        if len(self.poses) > 0:
+            region_sdf = compute_sdf(self._get_scene_mesh(), grid.reshape(-1, 3)).reshape(grid.shape[:3])
+        else:
+            # empty scene: every voxel is far outside
+            region_sdf = np.full(grid.shape[:3], -np.linalg.norm(self.bounds_max - self.bounds_min), dtype=np.float32)
+        if self.sdf_voxels is None:
+            self.sdf_voxels = region_sdf
+        else:
+            self.sdf_voxels[region] = region_sdf
+        return self.sdf_voxels
+
+
+@njit(cache=True, fastmath=True)
+def _trilinear_sample_point(sdf_voxels, origin, upper, inv_spacing, x, y, z):
+    # points outside of the grid have a value of 0 (same as RegularGridInterpolator with fill_value=0)
+    if not (x >= origin[0] and x <= upper[0] and y >= origin[1] and y <= upper[1] and z >= origin[2] and z <= upper[2]):
+        return 0.0
+    # continuous voxel coordinates
+    nx, ny, nz = sdf_voxels.shape
+    u = min((x - origin[0]) * inv_spacing[0], nx - 1)
+    v = min((y - origin[1]) * inv_spacing[1], ny - 1)
+    w = min((z - origin[2]) * inv_spacing[2], nz - 1)
+    i = min(int(u), nx - 2)
+    j = min(int(v), ny - 2)
+    k = min(int(w), nz - 2)
+    fu = u - i
+    fv = v - j
+    fw = w - k
+    c00 = sdf_voxels[i, j, k] * (1 - fu) + sdf_voxels[i + 1, j, k] * fu
+    c01 = sdf_voxels[i, j, k + 1] * (1 - fu) + sdf_voxels[i + 1, j, k + 1] * fu
+    c10 = sdf_voxels[i, j + 1, k] * (1 - fu) + sdf_voxels[i + 1, j + 1, k] * fu
+    c11 = sdf_voxels[i, j + 1, k + 1] * (1 - fu) + sdf_voxels[i + 1, j + 1, k + 1] * fu
+    c0 = c00 * (1 - fv) + c10 * fv
+    c1 = c01 * (1 - fv) + c11 * fv
+    return c0 * (1 - fw) + c1 * fw
+
+@njit(cache=True, fastmath=True)
+def trilinear_sample(sdf_voxels, origin, upper, inv_spacing, points):
+    """
+    Trilinear interpolation of a uniform SDF grid at points [N, 3].
+    """
+    values = np.empty(points.shape[0])
+    for n in range(points.shape[0]):
+        values[n] = _trilinear_sample_point(sdf_voxels, origin, upper, inv_spacing, points[n, 0], points[n, 1], points[n, 2])
+    return values
+
+@njit(cache=True, fastmath=True)
+def trilinear_collision_cost(sdf_voxels, origin, upper, inv_spacing, points, transforms, threshold):
+    """
+    Fused transform -> sample -> hinge-sum, i.e., sum(max(sdf(T @ p) + threshold, 0)) over points for each transform.
+    Args:
+        points: collision points (N, 3).
+        transforms: M 4x4 transformations (M, 4, 4).
+    Returns:
+        np.array: collision cost of each transformation (M,).
+    """
+    costs = np.zeros(transforms.shape[0])
+    for m in range(transforms.shape[0]):
+        T = transforms[m]
+        cost = 0.0
+        for n in range(points.shape[0]):
+            px, py, pz = points[n, 0], points[n, 1], points[n, 2]
+            x = T[0, 0] * px + T[0, 1] * py + T[0, 2] * pz + T[0, 3]
+            y = T[1, 0] * px + T[1, 1] * py + T[1, 2] * pz + T[1, 3]
+            z = T[2, 0] * px + T[2, 1] * py + T[2, 2] * pz + T[2, 3]
+            value = _trilinear_sample_point(sdf_voxels, origin, upper, inv_spacing, x, y, z) + threshold
+            if value > 0:
+                cost += value
+        costs[m] = cost
+    return costs
+
+@njit(cache=True, fastmath=True)
+def _trilinear_sample_point_grad(sdf_voxels, origin, upper, inv_spacing, x, y, z, grad):
+    # same as _trilinear_sample_point, also writes the spatial gradient into grad (zero outside of the grid)
+    grad[0] = 0.0
+    grad[1] = 0.0
+    grad[2] = 0.0
+    if not (x >= origin[0] and x <= upper[0] and y >= origin[1] and y <= upper[1] and z >= origin[2] and z <= upper[2]):
+        return 0.0
+    nx, ny, nz = sdf_voxels.shape
+    u = min((x - origin[0]) * inv_spacing[0], nx - 1)
+    v = min((y - origin[1]) * inv_spacing[1], ny - 1)
+    w = min((z - origin[2]) * inv_spacing[2], nz - 1)
+    i = min(int(u), nx - 2)
+    j = min(int(v), ny - 2)
+    k = min(int(w), nz - 2)
+    fu = u - i
+    fv = v - j
+    fw = w - k
+    c000 = sdf_voxels[i, j, k]
+    c100 = sdf_voxels[i + 1, j, k]
+    c010 = sdf_voxels[i, j + 1, k]
+    c110 = sdf_voxels[i + 1, j + 1, k]
+    c001 = sdf_voxels[i, j, k + 1]
+    c101 = sdf_voxels[i + 1, j, k + 1]
+    c011 = sdf_voxels[i, j + 1, k + 1]
+    c111 = sdf_voxels[i + 1, j + 1, k + 1]
+    c00 = c000 * (1 - fu) + c100 * fu
+    c01 = c001 * (1 - fu) + c101 * fu
+    c10 = c010 * (1 - fu) + c110 * fu
+    c11 = c011 * (1 - fu) + c111 * fu
+    c0 = c00 * (1 - fv) + c10 * fv
+    c1 = c01 * (1 - fv) + c11 * fv
+    du = ((c100 - c000) * (1 - fv) + (c110 - c010) * fv) * (1 - fw) + ((c101 - c001) * (1 - fv) + (c111 - c011) * fv) * fw
+    grad[0] = du * inv_spacing[0]
+    grad[1] = ((c10 - c00) * (1 - fw) + (c11 - c01) * fw) * inv_spacing[1]
+    grad[2] = (c1 - c0) * inv_spacing[2]
+    return c0 * (1 - fw) + c1 * fw
+
+@njit(cache=True, fastmath=True)
+def trilinear_collision_cost_grad(sdf_voxels, origin, upper, inv_spacing, points, transforms, threshold):
+    """
+    trilinear_collision_cost and its gradient as a world-frame wrench [force, torque] (torque about the translation of each transformation).
+    Returns:
+        np.array: collision cost of each transformation (M,).
+        np.array: wrench of each transformation (M, 6).
+    """
+    costs = np.zeros(transforms.shape[0])
+    wrenches = np.zeros((transforms.shape[0], 6))
+    grad = np.empty(3)
+    for m in range(transforms.shape[0]):
+        T = transforms[m]
+        for n in range(points.shape[0]):
+            px, py, pz = points[n, 0], points[n, 1], points[n, 2]
+            # offset from the translation (lever arm of the torque)
+            rx = T[0, 0] * px + T[0, 1] * py + T[0, 2] * pz
+            ry = T[1, 0] * px + T[1, 1] * py + T[1, 2] * pz
+            rz = T[2, 0] * px + T[2, 1] * py + T[2, 2] * pz
+            value = _trilinear_sample_point_grad(sdf_voxels, origin, upper, inv_spacing, rx + T[0, 3], ry + T[1, 3], rz + T[2, 3], grad) + threshold
+            if value > 0:
+                costs[m] += value
+                wrenches[m, 0] += grad[0]
+                wrenches[m, 1] += grad[1]
+                wrenches[m, 2] += grad[2]
+                wrenches[m, 3] += ry * grad[2] - rz * grad[1]
+                wrenches[m, 4] += rz * grad[0] - rx * grad[2]
+                wrenches[m, 5] += rx * grad[1] - ry * grad[0]
+    return costs, wrenches
+
+
+class TrilinearSDF:
+    """
+    Drop-in replacement for RegularGridInterpolator((x, y, z), sdf_voxels, bounds_error=False, fill_value=0)
+    on the uniform grid np.linspace(bounds_min, bounds_max, sdf_voxels.shape), backed by numba kernels.
+    """
+    def __init__(self, sdf_voxels, bounds_min, bounds_max):
+        self.sdf_voxels = np.ascontiguousarray(sdf_voxels, dtype=np.float64)
+        assert min(self.sdf_voxels.shape) >= 2, 'SDF grid needs at least two voxels along each axis'
+        self.origin = np.asarray(bounds_min, dtype=np.float64)
+        self.upper = np.asarray(bounds_max, dtype=np.float64)
+        spacing = (self.upper - self.origin) / (np.array(self.sdf_voxels.shape) - 1)
+        self.inv_spacing = 1.0 / spacing
+
+    def __call__(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        values = trilinear_sample(self.sdf_voxels, self.origin, self.upper, self.inv_spacing, np.ascontiguousarray(points.reshape(-1, 3)))
+        return values.reshape(points.shape[:-1])
+
+    def collision_cost(self, poses, collision_points, threshold):
+        """
+        Returns:
+            np.array: [N] collision cost of each of the [N, 4, 4] poses.
+        """
+        return trilinear_collision_cost(self.sdf_voxels, self.origin, self.upper, self.inv_spacing,
+                                        np.ascontiguousarray(collision_points, dtype=np.float64),
+                                        np.ascontiguousarray(poses, dtype=np.float64),
+                                        float(threshold))
+
+    def collision_cost_grad(self, poses, collision_points, threshold):
+        """
+        Returns:
+            np.array: [N] collision cost of each of the [N, 4, 4] poses.
+            np.array: [N, 6] world-frame wrench [force, torque] of each pose (see utils.batch_collision_cost_grad).
+        """
+        return trilinear_collision_cost_grad(self.sdf_voxels, self.origin, self.upper, self.inv_spacing,
+                                             np.ascontiguousarray(collision_points, dtype=np.float64),
+                                             np.ascontiguousarray(poses, dtype=np.float64),
+                                             float(threshold))
+
+
+@njit(cache=True)
+def _sparse_voxel(brick_ids, brick_fill, bricks, i, j, k):
+    B = bricks.shape[1]
+    bi, bj, bk = i // B, j // B, k // B
+    b = brick_ids[bi, bj, bk]
+    if b < 0:
+        return brick_fill[bi, bj, bk]
+    return bricks[b, i - bi * B, j - bj * B, k - bk * B]
+
+@njit(cache=True, fastmath=True)
+def _sparse_sample_point_grad(brick_ids, brick_fill, bricks, shape, origin, upper, inv_spacing, x, y, z, grad):
+    # same as _trilinear_sample_point_grad with voxels looked up in the brick table
+    grad[0] = 0.0
+    grad[1] = 0.0
+    grad[2] = 0.0
+    if not (x >= origin[0] and x <= upper[0] and y >= origin[1] and y <= upper[1] and z >= origin[2] and z <= upper[2]):
+        return 0.0
+    nx, ny, nz = shape[0], shape[1], shape[2]
+    u = min((x - origin[0]) * inv_spacing[0], nx - 1)
+    v = min((y - origin[1]) * inv_spacing[1], ny - 1)
+    w = min((z - origin[2]) * inv_spacing[2], nz - 1)
+    i = min(int(u), nx - 2)
+    j = min(int(v), ny - 2)
+    k = min(int(w), nz - 2)
+    fu = u - i
+    fv = v - j
+    fw = w - k
+    c000 = _sparse_voxel(brick_ids, brick_fill, bricks, i, j, k)
+    c100 = _sparse_voxel(brick_ids, brick_fill, bricks, i + 1, j, k)
+    c010 = _sparse_voxel(brick_ids, brick_fill, bricks, i, j + 1, k)
+    c110 = _sparse_voxel(brick_ids, brick_fill, bricks, i + 1, j + 1, k)
+    c001 = _sparse_voxel(brick_ids, brick_fill, bricks, i, j, k + 1)
+    c101 = _sparse_voxel(brick_ids, brick_fill, bricks, i + 1, j, k + 1)
+    c011 = _sparse_voxel(brick_ids, brick_fill, bricks, i, j + 1, k + 1)
+    c111 = _sparse_voxel(brick_ids, brick_fill, bricks, i + 1, j + 1, k + 1)
+    c00 = c000 * (1 - fu) + c100 * fu
+    c01 = c001 * (1 - fu) + c101 * fu
+    c10 = c010 * (1 - fu) + c110 * fu
+    c11 = c011 * (1 - fu) + c111 * fu
+    c0 = c00 * (1 - fv) + c10 * fv
+    c1 = c01 * (1 - fv) + c11 * fv
+    du = ((c100 - c000) * (1 - fv) + (c110 - c010) * fv) * (1 - fw) + ((c101 - c001) * (1 - fv) + (c111 - c011) * fv) * fw
+    grad[0] = du * inv_spacing[0]
+    grad[1] = ((c10 - c00) * (1 - fw) + (c11 - c01) * fw) * inv_spacing[1]
+    grad[2] = (c1 - c0) * inv_spacing[2]
+    return c0 * (1 - fw) + c1 * fw
+
+@njit(cache=True, fastmath=True)
+def sparse_sample(brick_ids, brick_fill, bricks, shape, origin, upper, inv_spacing, points):
+    values = np.empty(points.shape[0])
+    grad = np.empty(3)
+    for n in range(points.shape[0]):
+        values[n] = _sparse_sample_point_grad(brick_ids, brick_fill, bricks, shape, origin, upper, inv_spacing,
+                                              points[n, 0], points[n, 1], points[n, 2], grad)
+    return values
+
+@njit(cache=True, fastmath=True)
+def sparse_collision_cost_grad(brick_ids, brick_fill, bricks, shape, origin, upper, inv_spacing, points, transforms, threshold):
+    """
+    Same as trilinear_collision_cost_grad on a SparseSDF.
+    """
+    costs = np.zeros(transforms.shape[0])
+    wrenches = np.zeros((transforms.shape[0], 6))
+    grad = np.empty(3)
+    for m in range(transforms.shape[0]):
+        T = transforms[m]
+        for n in range(points.shape[0]):
+            px, py, pz = points[n, 0], points[n, 1], points[n, 2]
+            rx = T[0, 0] * px + T[0, 1] * py + T[0, 2] * pz
+            ry = T[1, 0] * px + T[1, 1] * py + T[1, 2] * pz
+            rz = T[2, 0] * px + T[2, 1] * py + T[2, 2] * pz
+            value = _sparse_sample_point_grad(brick_ids, brick_fill, bricks, shape, origin, upper, inv_spacing,
+                                              rx + T[0, 3], ry + T[1, 3], rz + T[2, 3], grad) + threshold
+            if value > 0:
+                costs[m] += value
+                wrenches[m, 0] += grad[0]
+                wrenches[m, 1] += grad[1]
+                wrenches[m, 2] += grad[2]
+                wrenches[m, 3] += ry * grad[2] - rz * grad[1]
+                wrenches[m, 4] += rz * grad[0] - rx * grad[2]
+                wrenches[m, 5] += rx * grad[1] - ry * grad[0]
+    return costs, wrenches
+
+
+class SparseSDF:
+    """
+    Narrow-band SDF on the voxel grid of get_sdf_grid_axes. The grid is split into bricks of brick_size^3 voxels;
+    only bricks within @band of a surface store their (float32) voxel values, all other bricks are represented by a
+    single value of +band (inside) or -band (outside). Values are clamped to [-band, band], so the band should be
+    larger than the collision thresholds of the solvers (0.10 / 0.20); deeper penetration saturates.
+    Sampling follows TrilinearSDF (0 outside of the grid), including its grid convention: the voxels are sampled as
+    if they spanned np.linspace(bounds_min, bounds_max, shape), like the dense grids built on the same axes, so the
+    object can be passed to the solvers in place of the dense sdf_voxels without shifting the field.
+    """
+    def __init__(self, brick_ids, brick_fill, bricks, shape, bounds_min, spacing, band):
+        self.brick_ids = brick_ids
+        self.brick_fill = brick_fill
+        self.bricks = bricks
+        self.shape = tuple(int(n) for n in shape)
+        self.band = band
+        self.origin = np.asarray(bounds_min, dtype=np.float64)
+        self.spacing = np.asarray(spacing, dtype=np.float64) * np.ones(3)
+        self.upper = self.origin + self.spacing * (np.array(self.shape) - 1)
+        self.inv_spacing = 1.0 / self.spacing
+        self._shape = np.array(self.shape, dtype=np.int64)
+
+    @classmethod
+    def from_function(cls, sdf_fn, bounds_min, bounds_max, resolution, band, brick_size=8):
+        """
+        Args:
+            sdf_fn (callable): signed distance (positive inside) of points [N, 3], must be a true distance (1-Lipschitz).
+        """
+        bounds_min = np.asarray(bounds_min, dtype=np.float64)
+        axes = get_sdf_grid_axes(bounds_min, np.asarray(bounds_max, dtype=np.float64), resolution)
+        steps = np.array([axis[1] - axis[0] if len(axis) > 1 else resolution for axis in axes])
+        shape = np.array([len(axis) for axis in axes])
+        num_bricks = -(-shape // brick_size)
+        # classify bricks by the distance at their centers
+        brick_coords = np.stack(np.meshgrid(*[np.arange(n) for n in num_bricks], indexing='ij'), axis=-1).reshape(-1, 3)
+        centers = bounds_min + steps * (brick_coords * brick_size + (brick_size - 1) / 2)
+        center_sdf = np.asarray(sdf_fn(centers), dtype=np.float64)
+        half_diagonal = np.linalg.norm(steps * (brick_size - 1) / 2)
+        in_band = np.abs(center_sdf) <= band + half_diagonal
+        brick_ids = np.full(len(brick_coords), -1, dtype=np.int64)
+        brick_ids[in_band] = np.arange(in_band.sum())
+        brick_fill = np.where(center_sdf > 0, band, -band)
+        # exact values of the voxels in band bricks (voxels beyond the grid are computed but never sampled)
+        local = np.stack(np.meshgrid(*[np.arange(brick_size)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+        voxel_coords = (brick_coords[in_band, None, :] * brick_size + local[None]).reshape(-1, 3)
+        if len(voxel_coords) > 0:
+            values = np.asarray(sdf_fn(bounds_min + steps * voxel_coords), dtype=np.float64)
+        else:
+            values = np.zeros(0)
+        bricks = np.clip(values, -band, band).astype(np.float32).reshape(-1, brick_size, brick_size, brick_size)
+        # sample with the convention of the dense interpolators (see build_sdf_func)
+        spacing = (np.asarray(bounds_max, dtype=np.float64) - bounds_min) / np.maximum(shape - 1, 1)
+        return cls(brick_ids.reshape(num_bricks), brick_fill.reshape(num_bricks).astype(np.float32), bricks,
+                   shape, bounds_min, spacing, band)
+
+    @property
+    def nbytes(self):
+        return self.brick_ids.nbytes + self.brick_fill.nbytes + self.bricks.nbytes
+
+    def to_dense(self):
+        """[X, Y, Z] dense voxel grid"""
+        B = self.bricks.shape[1]
+        nb = self.brick_ids.shape
+        dense = np.repeat(np.repeat(np.repeat(self.brick_fill, B, 0), B, 1), B, 2)
+        for coord in np.argwhere(self.brick_ids >= 0):
+            i, j, k = coord * B
+            dense[i:i + B, j:j + B, k:k + B] = self.bricks[self.brick_ids[tuple(coord)]]
+        return dense[:self.shape[0], :self.shape[1], :self.shape[2]]
+
+    def _args(self):
+        return (self.brick_ids, self.brick_fill, self.bricks, self._shape, self.origin, self.upper, self.inv_spacing)
+
+    def __call__(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        values = sparse_sample(*self._args(), np.ascontiguousarray(points.reshape(-1, 3)))
+        return values.reshape(points.shape[:-1])
+
+    def collision_cost(self, poses, collision_points, threshold):
+        return self.collision_cost_grad(poses, collision_points, threshold)[0]
+
+    def collision_cost_grad(self, poses, collision_points, threshold):
+        return sparse_collision_cost_grad(*self._args(),
+                                          np.ascontiguousarray(collision_points, dtype=np.float64),
+                                          np.ascontiguousarray(poses, dtype=np.float64),
+                                          float(threshold))
@@ -2,17 +2,28 @@ import pdb
 import numpy as np
 import time
 import copy
-from scipy.optimize import dual_annealing, minimize
-from scipy.interpolate import RegularGridInterpolator
+import functools
+from scipy.optimize import dual_annealing, differential_evolution, minimize
 import transform_utils as T
 from utils import (
     transform_keypoints,
+    batch_transform_keypoints,
     calculate_collision_cost,
+    batch_collision_cost,
     normalize_vars,
     unnormalize_vars,
-    farthest_point_sampling,
+    batch_unnormalize_vars,
     consistency,
+    batch_consistency,
+    batch_collision_cost_grad,
+    batch_constraint_violation_grad,
+    rotation_angle_grad,
+    wrench_to_pose_euler_grad,
 )
+from constraint_compiler import batch_evaluate_constraints
+from multistart import multistart, select_best, stoppable
+from planning_context import PlanningContext
+from sdf_utils import SUBGOAL_COLLISION_THRESHOLD
 def objective(opt_vars,
             og_bounds,
             keypoints_centered,
@@ -36,7 +47,7 @@ def objective(opt_vars,
     cost = 0
     # collision cost
     if collision_points_centered is not None:
-        collision_cost = 0.8 * calculate_collision_cost(opt_pose_homo[None], sdf_func, collision_points_centered, 0.10)
+        collision_cost = 0.8 * calculate_collision_cost(opt_pose_homo[None], sdf_func, collision_points_centered, SUBGOAL_COLLISION_THRESHOLD)
         debug_dict['collision_cost'] = collision_cost
         cost += collision_cost
 
@@ -60,7 +71,7 @@ def objective(opt_vars,
     if ik_result.success:
         # reset_reg = np.linalg.norm(ik_result.cspace_position[:-1] - reset_joint_pos[:-1].numpy())
         ik_dim = len(ik_result.cspace_position)
-        reset_reg = np.linalg.norm(ik_result.cspace_position - reset_joint_pos[:ik_dim].numpy())
+        reset_reg = np.linalg.norm(ik_result.cspace_position - np.asarray(reset_joint_pos[:ik_dim]))
 
         reset_reg = np.clip(reset_reg, 0.0, 3.0)
     else:
@@ -115,6 +126,164 @@ def objective(opt_vars,
     breakpoint()
     return cost
 
+def batch_objective(opt_vars_batch,
+            og_bounds,
+            keypoints_centered,
+            keypoint_movable_mask,
+            goal_constraints,
+            path_constraints,
+            sdf_func,
+            collision_points_centered,
+            init_pose_homo,
+            ik_solver,
+            initial_joint_pos,
+            reset_joint_pos,
+            is_grasp_stage,
+            return_debug_dict=False):
+    """
+    Vectorized version of objective that scores a population of [N, 6] normalized poses at once.
+    Returns an [N] array of costs (same value as calling objective on each row).
+    """
+    debug_dict = {}
+    opt_vars_batch = np.atleast_2d(opt_vars_batch)
+    num_poses = opt_vars_batch.shape[0]
+    # unnormalize variables and do conversion
+    opt_poses = batch_unnormalize_vars(opt_vars_batch, og_bounds)
+    opt_poses_homo = T.convert_pose_euler2mat(opt_poses)  # [N, 4, 4]
+
+    cost = np.zeros(num_poses)
+    # collision cost
+    if collision_points_centered is not None:
+        collision_cost = 0.8 * batch_collision_cost(opt_poses_homo, sdf_func, collision_points_centered, SUBGOAL_COLLISION_THRESHOLD)
+        debug_dict['collision_cost'] = collision_cost
+        cost += collision_cost
+
+    # stay close to initial pose
+    init_pose_cost = 1.0 * batch_consistency(opt_poses_homo, init_pose_homo, rot_weight=1.5)
+    debug_dict['init_pose_cost'] = init_pose_cost
+    cost += init_pose_cost
+
+    # reachability cost (approximated by number of IK iterations + regularization from reset joint pos)
+    max_iterations = 20
+    ik_results = ik_solver.solve_batch(
+                    opt_poses_homo,
+                    max_iterations=max_iterations,
+                    initial_joint_pos=initial_joint_pos,
+                )
+    ik_feasible = ik_results.success
+    ik_pos_error = ik_results.position_error
+    ik_cost = 20.0 * (ik_results.num_descents / max_iterations)
+    ik_dim = ik_results.cspace_position.shape[-1]
+    reset_reg = np.linalg.norm(ik_results.cspace_position - np.asarray(reset_joint_pos[:ik_dim]), axis=-1)
+    reset_reg = np.where(ik_feasible, reset_reg, 3.0)
+    reset_reg = np.clip(reset_reg, 0.0, 3.0)
+    reset_reg_cost = 0.2 * reset_reg
+    debug_dict['ik_feasible'] = ik_feasible
+    debug_dict['ik_pos_error'] = ik_pos_error
+    debug_dict['ik_cost'] = ik_cost
+    debug_dict['reset_reg_cost'] = reset_reg_cost
+    cost += ik_cost + reset_reg_cost
+
+    # grasp metric (better performance if using anygrasp or force-based grasp metrics)
+    if is_grasp_stage:
+        preferred_dir = np.array([0, 0, -1])
+        grasp_cost = -np.dot(opt_poses_homo[:, :3, 0], preferred_dir) + 1  # [0, 1]
+        grasp_cost = 10.0 * grasp_cost
+        debug_dict['grasp_cost'] = grasp_cost
+        cost += grasp_cost
+
+    # constraint violation costs, [N, num_constraints] violations
+    transformed_keypoints = None
+    if (goal_constraints is not None and len(goal_constraints) > 0) or (path_constraints is not None and len(path_constraints) > 0):
+        transformed_keypoints = batch_transform_keypoints(opt_poses_homo, keypoints_centered, keypoint_movable_mask)  # [N, K, 3]
+    debug_dict['subgoal_constraint_cost'] = None
+    debug_dict['subgoal_violation'] = None
+    if goal_constraints is not None and len(goal_constraints) > 0:
+        subgoal_violation = batch_evaluate_constraints(goal_constraints, transformed_keypoints)
+        subgoal_constraint_cost = 200.0 * np.clip(subgoal_violation, 0, np.inf).sum(axis=1)
+        debug_dict['subgoal_constraint_cost'] = subgoal_constraint_cost
+        debug_dict['subgoal_violation'] = subgoal_violation
+        cost += subgoal_constraint_cost
+    debug_dict['path_violation'] = None
+    if path_constraints is not None and len(path_constraints) > 0:
+        path_violation = batch_evaluate_constraints(path_constraints, transformed_keypoints)
+        path_constraint_cost = 200.0 * np.clip(path_violation, 0, np.inf).sum(axis=1)
+        debug_dict['path_constraint_cost'] = path_constraint_cost
+        debug_dict['path_violation'] = path_violation
+        cost += path_constraint_cost
+
+    debug_dict['total_cost'] = cost
+
+    if return_debug_dict:
+        return cost, debug_dict
+    breakpoint()
+    return cost
+
+def _population_objective(opt_vars_batch, *args):
+    # differential_evolution passes the population as [num_vars, S]
+    return batch_objective(opt_vars_batch.T, *args)
+
+def objective_grad(opt_vars,
+            og_bounds,
+            keypoints_centered,
+            keypoint_movable_mask,
+            goal_constraints,
+            path_constraints,
+            sdf_func,
+            collision_points_centered,
+            init_pose_homo,
+            ik_solver,
+            initial_joint_pos,
+            reset_joint_pos,
+            is_grasp_stage):
+    """
+    Gradient of objective w.r.t. opt_vars.
+    The gradients of the collision, consistency, grasp and constraint terms are accumulated as a world-frame wrench
+    on the end-effector pose; the constraint functions are differentiated by batched central differences.
+    The IK cost is piecewise constant in the pose (number of IK descents) and contributes no gradient. The reset
+    regularization is continuous wherever IK succeeds and is differentiated by batched central differences of the IK
+    result in the pose.
+    """
+    opt_pose = unnormalize_vars(opt_vars, og_bounds)
+    opt_pose_homo = T.pose2mat([opt_pose[:3], T.euler2quat(opt_pose[3:])])
+    wrench = np.zeros(6)
+    # collision cost
+    if collision_points_centered is not None:
+        _, collision_wrench = batch_collision_cost_grad(opt_pose_homo[None], sdf_func, collision_points_centered, SUBGOAL_COLLISION_THRESHOLD)
+        wrench += 0.8 * collision_wrench[0]
+    # stay close to initial pose
+    pos_diff = opt_pose_homo[:3, 3] - init_pose_homo[:3, 3]
+    pos_distance = np.linalg.norm(pos_diff)
+    if pos_distance > 0:
+        wrench[:3] += pos_diff / pos_distance
+    _, rot_grad = rotation_angle_grad(opt_pose_homo[None, :3, :3], init_pose_homo[None, :3, :3])
+    wrench[3:] += 1.5 * rot_grad[0]
+    # grasp metric, d(R[2, 0]) = (R[:, 0] x e_z) . d
+    if is_grasp_stage:
+        wrench[3:] += 10.0 * np.cross(opt_pose_homo[:3, 0], np.array([0, 0, 1]))
+    # constraint violation costs
+    for constraints in [goal_constraints, path_constraints]:
+        if constraints is not None and len(constraints) > 0:
+            violation, violation_wrench = batch_constraint_violation_grad(constraints, opt_pose_homo[None], keypoints_centered, keypoint_movable_mask)
+            wrench += 200.0 * np.sum(violation_wrench[0] * (violation[0] > 0)[:, None], axis=0)
+    # chain rule through the euler angles and the normalization
+    og_bounds = np.asarray(og_bounds, dtype=np.float64)
+    pose_grad = wrench_to_pose_euler_grad(wrench[None], opt_pose[None, 3:])[0]
+    # reset regularization, same as in objective
+    eps = 1e-3
+    perturbed_poses = opt_pose[None] + eps * np.concatenate([np.eye(6), -np.eye(6)], axis=0)  # [12, 6]
+    ik_results = ik_solver.solve_batch(
+                    T.convert_pose_euler2mat(perturbed_poses),
+                    max_iterations=20,
+                    initial_joint_pos=initial_joint_pos,
+                )
+    ik_dim = ik_results.cspace_position.shape[-1]
+    reset_reg = np.linalg.norm(ik_results.cspace_position - np.asarray(reset_joint_pos[:ik_dim]), axis=-1)
+    reset_reg = np.where(ik_results.success, np.clip(reset_reg, 0.0, 3.0), 3.0)
+    pose_grad += 0.2 * (reset_reg[:6] - reset_reg[6:]) / (2 * eps)
+    grad = pose_grad * (og_bounds[:, 1] - og_bounds[:, 0]) / 2
+    breakpoint()
+    return grad
 
 class SubgoalSolver:
     def __init__(self, config, ik_solver, reset_joint_pos):
@@ -122,8 +291,13 @@ class SubgoalSolver:
         self.ik_solver = ik_solver
         self.reset_joint_pos = reset_joint_pos
         self.last_opt_result = None
+        self.snapshot_recorder = None
         # warmup
         self._warmup()
+        # record the inputs of every solve (see benchmark.py)
+        if self.config['snapshot_dir'] is not None:
+            from benchmark import SnapshotRecorder
+            self.snapshot_recorder = SnapshotRecorder(self.config['snapshot_dir'], 'subgoal_solver', ik_solver)
         breakpoint()
 
     def _warmup(self):
@@ -138,15 +312,6 @@ class SubgoalSolver:
         self.last_opt_result = None
         breakpoint()
 
-    def _setup_sdf(self, sdf_voxels):
-        # create callable sdf function with interpolation
-        x = np.linspace(self.config['bounds_min'][0], self.config['bounds_max'][0], sdf_voxels.shape[0])
-        y = np.linspace(self.config['bounds_min'][1], self.config['bounds_max'][1], sdf_voxels.shape[1])
-        z = np.linspace(self.config['bounds_min'][2], self.config['bounds_max'][2], sdf_voxels.shape[2])
-        sdf_func = RegularGridInterpolator((x, y, z), sdf_voxels, bounds_error=False, fill_value=0)
-        breakpoint()
-        return sdf_func
-
     def _check_opt_result(self, opt_result, debug_dict):
         # accept the opt_result if it's only terminated due to iteration limit
         if (not opt_result.success and ('maximum' in opt_result.message.lower() or 'iteration' in opt_result.message.lower() or 'not necessarily' in opt_result.message.lower())):
@@ -176,12 +341,98 @@ class SubgoalSolver:
         breakpoint()
         return opt_result
     
-    def _center_collision_points_and_keypoints(self, ee_pose_homo, collision_points, keypoints, keypoint_movable_mask):
-        centering_transform = np.linalg.inv(ee_pose_homo)
-        collision_points_centered = np.dot(collision_points, centering_transform[:3, :3].T) + centering_transform[:3, 3]
-        keypoints_centered = transform_keypoints(centering_transform, keypoints, keypoint_movable_mask)
+    def _population_search(self, bounds, aux_args, init_sol, seed=None, callback=None, stop_event=None):
+        """
+        Population-based global search using the batched objective, followed by SLSQP refinement.
+        The whole population of each generation is scored with a single batch_objective call.
+        """
+        popsize = self.config['popsize']
+        maxiter = max(self.config['sampling_maxfun'] // (popsize * len(bounds)) - 1, 1)
+        global_result = differential_evolution(
+            func=stoppable(_population_objective, stop_event),
+            bounds=bounds,
+            args=aux_args,
+            x0=init_sol,
+            popsize=popsize,
+            maxiter=maxiter,
+            vectorized=True,
+            updating='deferred',
+            polish=False,
+            seed=seed,
+            callback=callback,
+        )
+        opt_result = self._local_search(bounds, aux_args, global_result.x, stop_event=stop_event)
+        # local refinement is not guaranteed to improve on the population best
+        if opt_result.fun > global_result.fun:
+            opt_result.x = global_result.x
+            opt_result.fun = global_result.fun
+        opt_result.nfev += global_result.nfev
         breakpoint()
-        return collision_points_centered, keypoints_centered
+        return opt_result
+
+    def _global_search(self, bounds, aux_args, init_sol, seed=None, stop_event=None):
+        """
+        One global search with the configured global optimizer. Stops early if @stop_event is set.
+        """
+        if self.config['global_optimizer'] == 'differential_evolution':
+            callback = None if stop_event is None else (lambda xk, convergence=None: stop_event.is_set())
+            opt_result = self._population_search(bounds, aux_args, init_sol, seed=seed, callback=callback, stop_event=stop_event)
+        else:
+            opt_result = dual_annealing(
+                func=stoppable(objective, stop_event),
+                bounds=bounds,
+                args=aux_args,
+                maxfun=self.config['sampling_maxfun'],
+                x0=init_sol,
+                seed=seed,
+                callback=None if stop_event is None else (lambda x, f, context: stop_event.is_set()),
+                no_local_search=False,
+                minimizer_kwargs={
+                    'method': 'SLSQP',
+                    'jac': objective_grad if self.config['jac'] == 'analytic' else None,
+                    'options': self.config['minimizer_options'],
+                },
+            )
+        if isinstance(opt_result.message, list):
+            opt_result.message = opt_result.message[0]
+        breakpoint()
+        return opt_result
+
+    def _local_search(self, bounds, aux_args, init_sol, stop_event=None):
+        opt_result = minimize(
+            fun=stoppable(objective, stop_event),
+            x0=init_sol,
+            args=aux_args,
+            jac=objective_grad if self.config['jac'] == 'analytic' else None,
+            bounds=bounds,
+            method='SLSQP',
+            options=self.config['minimizer_options'],
+        )
+        breakpoint()
+        return opt_result
+
+    def _is_satisfied(self, opt_result, aux_args):
+        _, debug_dict = objective(opt_result.x, *aux_args, return_debug_dict=True)
+        satisfied = self._check_opt_result(copy.deepcopy(opt_result), debug_dict).success
+        breakpoint()
+        return satisfied
+
+    def _multistart_search(self, bounds, aux_args, init_sol):
+        """
+        Several independently seeded global searches (the first one from @init_sol), plus a local refinement
+        from the last solution if available, run in parallel worker processes.
+        """
+        seeds = np.random.randint(0, 2**31 - 1, size=self.config['multistart_num_starts'])
+        start_fns = [functools.partial(self._global_search, bounds, aux_args, init_sol if i == 0 else None, int(seed))
+                     for i, seed in enumerate(seeds)]
+        if self.last_opt_result is not None:
+            start_fns.append(functools.partial(self._local_search, bounds, aux_args, self.last_opt_result.x))
+        results, satisfied = multistart(start_fns,
+                                        functools.partial(self._is_satisfied, aux_args=aux_args),
+                                        self.config['multistart_workers'])
+        opt_result = select_best(results, satisfied)
+        breakpoint()
+        return opt_result
 
     def solve(self,
             ee_pose,
@@ -194,6 +445,7 @@ class SubgoalSolver:
             is_grasp_stage,
             initial_joint_pos,
             from_scratch=False,
+            planning_context=None,
             ):
         """
         Args:
@@ -202,20 +454,34 @@ class SubgoalSolver:
             - keypoint_movable_mask (bool): [M] boolean array indicating whether the keypoint is on the grasped object.
             - goal_constraints (List[Callable]): subgoal constraint functions.
             - path_constraints (List[Callable]): path constraint functions.
-            - sdf_voxels (np.ndarray): [X, Y, Z] signed distance field of the environment.
+            - sdf_voxels (np.ndarray or SparseSDF): [X, Y, Z] signed distance field of the environment.
             - collision_points (np.ndarray): [N, 3] point cloud of the object.
             - is_grasp_stage (bool): whether the current stage is a grasp stage.
             - initial_joint_pos (np.ndarray): [N] initial joint positions of the robot.
             - from_scratch (bool): whether to start from scratch.
+            - planning_context (PlanningContext): if given, keypoints, keypoint_movable_mask, sdf_voxels and collision_points
+                are taken from it (and can be None), so that the setup is shared with the other solver (see planning_context.py).
         Returns:
             - result (scipy.optimize.OptimizeResult): optimization result.
             - debug_dict (dict): debug information.
         """
 
-        # downsample collision points
-        if collision_points is not None and collision_points.shape[0] > self.config['max_collision_points']:
-            collision_points = farthest_point_sampling(collision_points, self.config['max_collision_points'])
-        sdf_func = self._setup_sdf(sdf_voxels)
+        if planning_context is None:
+            planning_context = PlanningContext(keypoints, keypoint_movable_mask, sdf_voxels, collision_points)
+        keypoint_movable_mask = planning_context.keypoint_movable_mask
+        if self.snapshot_recorder is not None:
+            self.snapshot_recorder.record(self.last_opt_result,
+                                          ee_pose=ee_pose,
+                                          keypoints=planning_context.keypoints,
+                                          keypoint_movable_mask=keypoint_movable_mask,
+                                          goal_constraints=goal_constraints,
+                                          path_constraints=path_constraints,
+                                          sdf_voxels=planning_context.sdf_voxels,
+                                          collision_points=planning_context.collision_points,
+                                          is_grasp_stage=is_grasp_stage,
+                                          initial_joint_pos=initial_joint_pos,
+                                          from_scratch=from_scratch)
+        sdf_func = planning_context.get_sdf_func(self.config['bounds_min'], self.config['bounds_max'], self.config['sdf_interpolator'])
         # ====================================
         # = setup bounds and initial guess
         # ====================================
@@ -238,7 +504,8 @@ class SubgoalSolver:
         # ====================================
         # = other setup
         # ====================================
-        collision_points_centered, keypoints_centered = self._center_collision_points_and_keypoints(ee_pose_homo, collision_points, keypoints, keypoint_movable_mask)
+        # downsampled collision points and keypoints in the frame of the current pose
+        collision_points_centered, keypoints_centered = planning_context.get_centered(ee_pose_homo, self.config['max_collision_points'])
         aux_args = (og_bounds,
                     keypoints_centered,
                     keypoint_movable_mask,
@@ -257,29 +524,13 @@ class SubgoalSolver:
         # ====================================
         start = time.time()
         # use global optimization for the first iteration
-        if from_scratch:
-            opt_result = dual_annealing(
-                func=objective,
-                bounds=bounds,
-                args=aux_args,
-                maxfun=self.config['sampling_maxfun'],
-                x0=init_sol,
-                no_local_search=False,
-                minimizer_kwargs={
-                    'method': 'SLSQP',
-                    'options': self.config['minimizer_options'],
-                },
-            )
+        if from_scratch and self.config['multistart_workers'] > 0:
+            opt_result = self._multistart_search(bounds, aux_args, init_sol)
+        elif from_scratch:
+            opt_result = self._global_search(bounds, aux_args, init_sol)
         # use gradient-based local optimization for the following iterations
         else:
-            opt_result = minimize(
-                fun=objective,
-                x0=init_sol,
-                args=aux_args,
-                bounds=bounds,
-                method='SLSQP',
-                options=self.config['minimizer_options'],
-            )
+            opt_result = self._local_search(bounds, aux_args, init_sol)
         solve_time = time.time() - start
 
         # ====================================
@@ -291,6 +542,7 @@ class SubgoalSolver:
         _, debug_dict = objective(opt_result.x, *aux_args, return_debug_dict=True)
         debug_dict['sol'] = opt_result.x
         debug_dict['msg'] = opt_result.message
+        debug_dict['nfev'] = opt_result.nfev
         debug_dict['solve_time'] = solve_time
         debug_dict['from_scratch'] = from_scratch
         debug_dict['type'] = 'subgoal_solver'
@@ -298,6 +550,7 @@ class SubgoalSolver:
         sol = unnormalize_vars(opt_result.x, og_bounds)
         sol = np.concatenate([sol[:3], T.euler2quat(sol[3:])])
         opt_result = self._check_opt_result(opt_result, debug_dict)
+        debug_dict['success'] = opt_result.success
         # cache opt_result for future use if successful
         if opt_result.success:
             self.last_opt_result = copy.deepcopy(opt_result)
@@ -1177,8 +1177,7 @@ def convert_pose_euler2mat(poses_euler):
     poses_mat = np.eye(4)
     poses_mat = np.tile(poses_mat, (len(poses_euler), 1, 1))
     poses_mat[:, :3, 3] = poses_euler[:, :3]
-    for i in range(len(poses_euler)):
-        poses_mat[i, :3, :3] = euler2mat(poses_euler[i, 3:])
+    poses_mat[:, :3, :3] = euler2mat(poses_euler[:, 3:])  # scipy handles the batch dimension
     if not batched:
         poses_mat = poses_mat[0]
     return poses_mat
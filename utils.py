@@ -1,4 +1,7 @@
 import os
+import threading
+import contextlib
+from collections.abc import Mapping
 import numpy as np
 from numba import njit
 import open3d as o3d
@@ -31,8 +34,19 @@ def unnormalize_vars(normalized_vars, og_bounds):
         vars[i] = (normalized_vars[i] + 1) / 2 * (b_max - b_min) + b_min
     return vars
 
+def batch_unnormalize_vars(normalized_vars, og_bounds):
+    """
+    Batched version of unnormalize_vars. Given [N, D] variables in [-1, 1] and D original bounds, denormalize the variables to the original range.
+    """
+    og_bounds = np.asarray(og_bounds, dtype=np.float64)
+    b_min, b_max = og_bounds[:, 0], og_bounds[:, 1]
+    return (normalized_vars + 1) / 2 * (b_max - b_min) + b_min
+
 def calculate_collision_cost(poses, sdf_func, collision_points, threshold):
     assert poses.shape[1:] == (4, 4)
+    if hasattr(sdf_func, 'collision_cost'):
+        # fused kernel (e.g., sdf_utils.TrilinearSDF)
+        return np.sum(sdf_func.collision_cost(poses, collision_points, threshold))
     transformed_pcs = batch_transform_points(collision_points, poses)
     transformed_pcs_flatten = transformed_pcs.reshape(-1, 3)  # [num_poses * num_points, 3]
     signed_distance = sdf_func(transformed_pcs_flatten) + threshold  # [num_poses * num_points]
@@ -41,6 +55,36 @@ def calculate_collision_cost(poses, sdf_func, collision_points, threshold):
     collision_cost = np.sum(signed_distance[non_zero_mask])
     return collision_cost
 
+def batch_collision_cost(poses, sdf_func, collision_points, threshold):
+    """
+    Same as calculate_collision_cost, but returns the cost of each pose separately.
+    Args:
+        poses: [N, 4, 4] poses.
+    Returns:
+        np.array: [N] collision cost of each pose.
+    """
+    assert poses.shape[1:] == (4, 4)
+    if hasattr(sdf_func, 'collision_cost'):
+        return sdf_func.collision_cost(poses, collision_points, threshold)
+    transformed_pcs = batch_transform_points(collision_points, poses)
+    transformed_pcs_flatten = transformed_pcs.reshape(-1, 3)  # [num_poses * num_points, 3]
+    signed_distance = sdf_func(transformed_pcs_flatten) + threshold  # [num_poses * num_points]
+    signed_distance = signed_distance.reshape(-1, collision_points.shape[0])  # [num_poses, num_points]
+    return np.sum(np.clip(signed_distance, 0, None), axis=1)
+
+def batch_consistency(poses, target_pose, rot_weight=0.5):
+    """
+    Vectorized consistency between each of [N, 4, 4] poses and a single [4, 4] target pose.
+    Returns:
+        np.array: [N] weighted position + rotation distance of each pose.
+    """
+    assert poses.shape[1:] == (4, 4) and target_pose.shape == (4, 4)
+    pos_distance = np.linalg.norm(poses[:, :3, 3] - target_pose[:3, 3], axis=-1)
+    # trace(R_a @ R_b.T) without materializing the products
+    trace = np.einsum('nij,ij->n', poses[:, :3, :3], target_pose[:3, :3])
+    rot_distance = np.arccos(np.clip((trace - 1) / 2, -1, 1))
+    return pos_distance + rot_distance * rot_weight
+
 @njit(cache=True, fastmath=True)
 def consistency(poses_a, poses_b, rot_weight=0.5):
     assert poses_a.shape[1:] == (4, 4) and poses_b.shape[1:] == (4, 4), 'poses must be of shape (N, 4, 4)'
@@ -64,6 +108,116 @@ def transform_keypoints(transform, keypoints, movable_mask):
         transformed_keypoints[movable_mask] = np.dot(keypoints[movable_mask], transform[:3, :3].T) + transform[:3, 3]
     return transformed_keypoints
 
+def batch_transform_keypoints(transforms, keypoints, movable_mask):
+    """
+    Batched version of transform_keypoints.
+    Args:
+        transforms: [N, 4, 4] transformations.
+        keypoints: [K, 3] keypoints.
+        movable_mask: [K] boolean mask of keypoints that move with the transformation.
+    Returns:
+        np.array: [N, K, 3] transformed keypoints.
+    """
+    assert transforms.shape[1:] == (4, 4)
+    transformed_keypoints = np.repeat(keypoints[None], len(transforms), axis=0)
+    if movable_mask.sum() > 0:
+        movable_keypoints = keypoints[movable_mask]
+        transformed_keypoints[:, movable_mask] = np.einsum('nij,kj->nki', transforms[:, :3, :3], movable_keypoints) + transforms[:, None, :3, 3]
+    return transformed_keypoints
+
+# gradients are expressed as world-frame wrenches [force, torque] w.r.t. a pose (t, R): the change of a cost under
+# a translation dt and a rotation perturbation exp([d]x) R (rotating points about t) is force @ dt + torque @ d
+def euler_angular_jacobian(euler):
+    """
+    World-frame angular velocity of R = euler2mat(euler) ("xyz" extrinsic, R = Rz Ry Rx) per unit change of each angle.
+    Args:
+        euler: [N, 3] euler angles.
+    Returns:
+        np.array: [N, 3, 3] matrices E, dR/d(euler_k) = [E[:, k]]x R.
+    """
+    euler = np.atleast_2d(euler)
+    b, c = euler[:, 1], euler[:, 2]
+    E = np.zeros((len(euler), 3, 3))
+    E[:, :, 0] = np.stack([np.cos(b) * np.cos(c), np.cos(b) * np.sin(c), -np.sin(b)], axis=-1)
+    E[:, :, 1] = np.stack([-np.sin(c), np.cos(c), np.zeros_like(c)], axis=-1)
+    E[:, 2, 2] = 1
+    return E
+
+def wrench_to_pose_euler_grad(wrench, euler):
+    """
+    Convert [N, 6] world-frame wrenches to gradients w.r.t. [N, 6] (position, euler) pose variables.
+    """
+    grad = np.empty_like(wrench)
+    grad[:, :3] = wrench[:, :3]
+    grad[:, 3:] = np.einsum('nij,ni->nj', euler_angular_jacobian(euler), wrench[:, 3:])
+    return grad
+
+def rotation_angle_grad(Ra, Rb):
+    """
+    Angle between rotations [N, 3, 3] Ra and Rb, and its gradient w.r.t. a world-frame rotation perturbation of Ra
+    (the gradient w.r.t. a perturbation of Rb is the negative). The gradient is set to zero where the angle is 0 or pi.
+    """
+    M = Ra @ np.transpose(Rb, (0, 2, 1))
+    angle = np.arccos(np.clip((np.trace(M, axis1=1, axis2=2) - 1) / 2, -1, 1))
+    # M - M^T = 2 sin(angle) [axis]x
+    w = np.stack([M[:, 2, 1] - M[:, 1, 2], M[:, 0, 2] - M[:, 2, 0], M[:, 1, 0] - M[:, 0, 1]], axis=-1)
+    w_norm = np.linalg.norm(w, axis=-1, keepdims=True)
+    grad = np.where(w_norm > 1e-9, w / np.maximum(w_norm, 1e-9), 0.0)
+    return angle, grad
+
+def slerp_rotmats(start_rotmats, end_rotmats, alpha):
+    """
+    Spherical linear interpolation between [N, 3, 3] start and end rotation matrices with [N] weights.
+    """
+    start = R.from_matrix(start_rotmats)
+    relative = (start.inv() * R.from_matrix(end_rotmats)).as_rotvec()
+    return (start * R.from_rotvec(relative * alpha[:, None])).as_matrix()
+
+def batch_collision_cost_grad(poses, sdf_func, collision_points, threshold, eps=1e-3):
+    """
+    batch_collision_cost and its gradient.
+    Returns:
+        np.array: [N] collision cost of each pose.
+        np.array: [N, 6] world-frame wrench of each pose.
+    """
+    assert poses.shape[1:] == (4, 4)
+    if hasattr(sdf_func, 'collision_cost_grad'):
+        return sdf_func.collision_cost_grad(poses, collision_points, threshold)
+    transformed_pcs = batch_transform_points(collision_points, poses)  # [N, P, 3]
+    flatten = transformed_pcs.reshape(-1, 3)
+    signed_distance = sdf_func(flatten) + threshold
+    # central differences of the sdf, evaluated in a single call
+    offsets = np.concatenate([np.eye(3), -np.eye(3)]) * eps
+    perturbed = sdf_func((flatten[None] + offsets[:, None]).reshape(-1, 3)).reshape(6, -1)
+    sdf_grad = ((perturbed[:3] - perturbed[3:]) / (2 * eps)).T  # [N * P, 3]
+    sdf_grad = sdf_grad * (signed_distance > 0)[:, None]
+    sdf_grad = sdf_grad.reshape(transformed_pcs.shape)
+    cost = np.sum(np.clip(signed_distance, 0, None).reshape(len(poses), -1), axis=1)
+    wrench = np.concatenate([sdf_grad.sum(axis=1),
+                             np.cross(transformed_pcs - poses[:, None, :3, 3], sdf_grad).sum(axis=1)], axis=-1)
+    return cost, wrench
+
+def batch_constraint_violation_grad(constraints, poses, keypoints, movable_mask, eps=1e-4):
+    """
+    Violations of the constraints at each pose and their gradients, computed by central differences along the
+    6 twist directions of each pose (all perturbations are evaluated in a single batched call).
+    Returns:
+        np.array: [N, C] violations.
+        np.array: [N, C, 6] world-frame wrench of each violation.
+    """
+    from constraint_compiler import batch_evaluate_constraints
+    num_poses = len(poses)
+    perturbed = np.repeat(poses[None], 13, axis=0)  # [unperturbed, +6 twists, -6 twists]
+    rotations = R.from_rotvec(np.eye(3) * eps).as_matrix()  # rotations about the world axes, transposed for -eps
+    for sign, offset in [(1, 1), (-1, 7)]:
+        for k in range(3):
+            perturbed[offset + k, :, k, 3] += sign * eps
+            perturbed[offset + 3 + k, :, :3, :3] = (rotations[k] if sign > 0 else rotations[k].T) @ poses[:, :3, :3]
+    transformed_keypoints = batch_transform_keypoints(perturbed.reshape(-1, 4, 4), keypoints, movable_mask)
+    violations = batch_evaluate_constraints(constraints, transformed_keypoints).reshape(13, num_poses, -1)
+    wrench = (violations[1:7] - violations[7:]) / (2 * eps)  # [6, N, C]
+    return violations[0], np.transpose(wrench, (1, 2, 0))
+
 @njit(cache=True, fastmath=True)
 def batch_transform_points(points, transforms):
     """
@@ -82,9 +236,8 @@ def batch_transform_points(points, transforms):
     return transformed_points
 
 @njit(cache=True, fastmath=True)
-def get_samples_jitted(control_points_homo, control_points_quat, opt_interpolate_pos_step_size, opt_interpolate_rot_step_size):
+def get_num_samples_per_segment_jitted(control_points_homo, opt_interpolate_pos_step_size, opt_interpolate_rot_step_size):
     assert control_points_homo.shape[1:] == (4, 4)
-    # calculate number of samples per segment
     num_samples_per_segment = np.empty(len(control_points_homo) - 1, dtype=np.int64)
     for i in range(len(control_points_homo) - 1):
         start_pos = control_points_homo[i, :3, 3]
@@ -98,6 +251,13 @@ def get_samples_jitted(control_points_homo, control_points_quat, opt_interpolate
         num_path_poses = int(max(pos_num_steps, rot_num_steps))
         num_path_poses = max(num_path_poses, 2)  # at least 2 poses, start and end
         num_samples_per_segment[i] = num_path_poses
+    return num_samples_per_segment
+
+@njit(cache=True, fastmath=True)
+def get_samples_jitted(control_points_homo, control_points_quat, opt_interpolate_pos_step_size, opt_interpolate_rot_step_size):
+    assert control_points_homo.shape[1:] == (4, 4)
+    # calculate number of samples per segment
+    num_samples_per_segment = get_num_samples_per_segment_jitted(control_points_homo, opt_interpolate_pos_step_size, opt_interpolate_rot_step_size)
     # fill in samples
     num_samples = num_samples_per_segment.sum()
     samples_7 = np.empty((num_samples, 7))
@@ -133,12 +293,35 @@ def path_length(samples_homo):
 # ===============================================
 # = others
 # ===============================================
+_grasping_costs = threading.local()
+
 def get_callable_grasping_cost_fn(env):
     def get_grasping_cost(keypoint_idx):
+        # use the costs captured with the planning snapshot of this thread (see grasping_cost_snapshot)
+        costs = getattr(_grasping_costs, 'costs', None)
+        if costs is not None:
+            return costs[keypoint_idx]
         keypoint_object = env.get_object_by_keypoint(keypoint_idx)
         return -env.is_grasping(candidate_obj=keypoint_object) + 1  # return 0 if grasping an object, 1 if not grasping any object
     return get_grasping_cost
 
+def get_grasping_costs(env, num_keypoints):
+    """grasping costs of all keypoints (see get_callable_grasping_cost_fn)"""
+    return [-env.is_grasping(candidate_obj=env.get_object_by_keypoint(i)) + 1 for i in range(num_keypoints)]
+
+@contextlib.contextmanager
+def grasping_cost_snapshot(costs):
+    """
+    Within the context, the grasping cost functions called from the current thread return the given costs instead of
+    querying the environment, so that a background planner evaluates the constraints against the state it plans from.
+    """
+    prev_costs = getattr(_grasping_costs, 'costs', None)
+    _grasping_costs.costs = costs
+    try:
+        yield
+    finally:
+        _grasping_costs.costs = prev_costs
+
 def get_config(config_path=None):
     if config_path is None:
         this_file_dir = os.path.dirname(os.path.abspath(__file__))
@@ -210,7 +393,67 @@ def merge_dicts(dicts):
         for d in dicts
         for k, v in d.items()
     }
-    
+
+class LazyObservation(Mapping):
+    """
+    Read-only dict of observation modalities that are computed on first access and then memoized.
+    Each getter is called with the observation itself, so that derived modalities (e.g., points from depth) can
+    access the modalities they depend on.
+    """
+    def __init__(self, getters):
+        self._getters = getters
+        self._values = dict()
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self._getters[key](self)
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._getters)
+
+    def __len__(self):
+        return len(self._getters)
+
+    def is_computed(self, key):
+        return key in self._values
+
+def select_cam_obs(cam_obs, cam_ids=None, modalities=None):
+    """
+    Select cameras and modalities from {cam_id: LazyObservation}. Only the selected modalities are computed.
+    """
+    cam_ids = list(cam_obs.keys()) if cam_ids is None else cam_ids
+    if modalities is None:
+        return {cam_id: cam_obs[cam_id] for cam_id in cam_ids}
+    return {cam_id: {m: cam_obs[cam_id][m] for m in modalities} for cam_id in cam_ids}
+
+def get_camera_rays(intrinsics, extrinsics, height, width, dtype=np.float64):
+    """
+    Ray table of a fixed pinhole camera (OmniGibson convention: looks along -z with y up, linear depth).
+    The world-frame point of pixel (j, i) with depth d is ray_origin + d * ray_directions[j, i].
+    Returns:
+        ray_origin (np.ndarray): [3] camera position in the world frame.
+        ray_directions (np.ndarray): [H, W, 3] world-frame directions with unit length along the optical axis.
+    """
+    intrinsics = np.asarray(intrinsics, dtype=np.float64)
+    cam_pose = T.pose_inv(np.asarray(extrinsics, dtype=np.float64))
+    i, j = np.meshgrid(np.arange(width), np.arange(height), indexing='xy')
+    directions = np.stack([(i - intrinsics[0, 2]) / intrinsics[0, 0],
+                           -(j - intrinsics[1, 2]) / intrinsics[1, 1],
+                           -np.ones((height, width))], axis=-1)
+    ray_directions = directions @ cam_pose[:3, :3].T
+    return cam_pose[:3, 3].astype(dtype), np.ascontiguousarray(ray_directions, dtype=dtype)
+
+def deproject_depth(depth, ray_origin, ray_directions, out=None):
+    """
+    [H, W] linear depth to [H, W, 3] world-frame points with a ray table (see get_camera_rays), written to out if given.
+    """
+    if out is None:
+        out = np.empty(ray_directions.shape, dtype=ray_directions.dtype)
+    np.multiply(depth[..., None], ray_directions, out=out)
+    out += ray_origin
+    return out
+
 def exec_safe(code_str, gvars=None, lvars=None):
     banned_phrases = ['import', '__']
     for phrase in banned_phrases:
@@ -231,12 +474,24 @@ def exec_safe(code_str, gvars=None, lvars=None):
         print(f'Error executing code:\n{code_str}')
         raise e
 
-def load_functions_from_txt(txt_path, get_grasping_cost_fn):
+def load_functions_from_txt(txt_path, get_grasping_cost_fn, vectorized=False):
+    """
+    Load the constraint functions defined in txt_path.
+    If vectorized, each function is wrapped in a VectorizedConstraint, which is called the same way but additionally
+    supports evaluating stacked inputs via its batch() method (falling back to a per-sample loop if needed).
+    """
     if txt_path is None:
         return []
     # load txt file
     with open(txt_path, 'r') as f:
         functions_text = f.read()
+    return load_functions_from_text(functions_text, get_grasping_cost_fn, vectorized=vectorized)
+
+def load_functions_from_text(functions_text, get_grasping_cost_fn, vectorized=False):
+    """
+    Load the constraint functions defined in functions_text (see load_functions_from_txt).
+    The source text is kept in the source_text attribute of each function (e.g., for solver snapshots, see benchmark.py).
+    """
     # execute functions
     gvars_dict = {
         'np': np,
@@ -244,7 +499,13 @@ def load_functions_from_txt(txt_path, get_grasping_cost_fn):
     }  # external library APIs
     lvars_dict = dict()
     exec_safe(functions_text, gvars=gvars_dict, lvars=lvars_dict)
-    return list(lvars_dict.values())
+    functions = list(lvars_dict.values())
+    for fn in functions:
+        fn.source_text = functions_text
+    if vectorized:
+        from constraint_compiler import VectorizedConstraint
+        functions = [VectorizedConstraint(fn) for fn in functions]
+    return functions
 
 @njit(cache=True, fastmath=True)
 def angle_between_rotmat(P, Q):
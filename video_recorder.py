@@ -0,0 +1,184 @@
+"""
+Video recording that keeps the episode memory flat and encodes on a background thread.
+
+Two modes are supported:
+    - ring: the last max_frames frames are kept in a preallocated uint8 ring buffer and encoded when the video is saved.
+    - stream: every frame is handed to the encoder thread as it arrives, so the frames are never accumulated. The
+      frame queue is bounded, so the producer is throttled if encoding falls behind.
+In both modes only every decimation-th frame is recorded (see should_record), and save() returns immediately (wait() blocks until the
+pending videos are written). Pending videos are finished when the interpreter exits.
+"""
+import os
+import atexit
+import queue
+import threading
+import numpy as np
+import imageio
+
+_STOP = object()
+
+
+class VideoRecorder:
+    def __init__(self, mode='ring', max_frames=2000, decimation=1, fps=30, queue_size=64, stream_dir='.', stream_ext='.mp4'):
+        """
+        Args:
+            mode (str): ring or stream (see module docstring).
+            max_frames (int): size of the ring buffer.
+            decimation (int): record every decimation-th frame.
+            fps (int): frame rate of the saved videos.
+            queue_size (int): maximum number of jobs (frames) waiting for the encoder.
+            stream_dir, stream_ext: location and format of the file that is streamed to (renamed when saved).
+        """
+        assert mode in ['ring', 'stream'], f'unknown video recording mode: {mode}'
+        self.mode = mode
+        self.stream_dir = stream_dir
+        self.stream_ext = stream_ext
+        self.max_frames = max_frames
+        self.decimation = max(1, int(decimation))
+        self.fps = fps
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._frame_counter = 0
+        # ring mode
+        self._buffer = None
+        self._num_frames = 0
+        self._next_idx = 0
+        # stream mode
+        self._stream_path = None
+        self._stream_count = 0
+        self._errors = []
+
+    def should_record(self):
+        """whether the next frame is recorded; if not, callers can skip rendering it and call skip_frame instead"""
+        return self._frame_counter % self.decimation == 0
+
+    def skip_frame(self):
+        """count a frame that is dropped by the decimation without rendering it"""
+        self._frame_counter += 1
+
+    def add_frame(self, rgb):
+        """
+        Args:
+            rgb (np.ndarray or torch.Tensor): [H, W, 3] frame.
+        """
+        self._frame_counter += 1
+        if (self._frame_counter - 1) % self.decimation != 0:
+            return
+        if hasattr(rgb, 'cpu'):
+            rgb = rgb.cpu().numpy()  # torch tensor
+        if self.mode == 'ring':
+            if self._buffer is None or self._buffer.shape[1:] != rgb.shape:
+                self._buffer = np.empty((self.max_frames, *rgb.shape), dtype=np.uint8)
+                self._num_frames = 0
+                self._next_idx = 0
+            # casts to uint8 (0-255) while copying
+            self._buffer[self._next_idx] = rgb
+            self._next_idx = (self._next_idx + 1) % self.max_frames
+            self._num_frames = min(self._num_frames + 1, self.max_frames)
+        else:
+            if self._stream_path is None:
+                self._stream_count += 1
+                os.makedirs(self.stream_dir, exist_ok=True)
+                self._stream_path = os.path.join(self.stream_dir, f'.recording_{os.getpid()}_{id(self)}_{self._stream_count}{self.stream_ext}')
+                self._submit(('open', self._stream_path))
+            self._submit(('frame', np.array(rgb, dtype=np.uint8)))  # copy, the source buffer may be reused
+
+    def __len__(self):
+        """number of recorded frames of the current video"""
+        return self._num_frames
+
+    def save(self, save_path):
+        """
+        Write the current video to save_path in the background and start a new one. Returns immediately.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+        if self.mode == 'ring':
+            if self._buffer is not None and self._num_frames > 0:
+                # hand the buffer over to the encoder; a new one is allocated if recording continues
+                order = np.arange(self._next_idx - self._num_frames, self._next_idx) % self.max_frames
+                self._submit(('write', save_path, self._buffer, order))
+            else:
+                self._submit(('write', save_path, np.empty((0,), dtype=np.uint8), []))
+            self._buffer = None
+        else:
+            if self._stream_path is None:
+                self._submit(('open', save_path))
+            self._submit(('close', save_path))
+            self._stream_path = None
+        self._reset_counters()
+        return save_path
+
+    def reset(self):
+        """discard the current video"""
+        if self.mode == 'stream' and self._stream_path is not None:
+            self._submit(('close', None))
+            self._stream_path = None
+        self._reset_counters()
+
+    def wait(self):
+        """block until all pending videos are written"""
+        if self._thread is not None:
+            self._jobs.join()
+        if len(self._errors) > 0:
+            errors, self._errors = self._errors, []
+            raise RuntimeError(f'video encoding failed: {errors}')
+
+    def close(self):
+        """finish the pending videos and stop the encoder thread (the current video is discarded)"""
+        if self._thread is not None:
+            self._jobs.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            atexit.unregister(self.close)
+
+    # ======================================
+    # = internal functions
+    # ======================================
+    def _reset_counters(self):
+        self._frame_counter = 0
+        self._num_frames = 0
+        self._next_idx = 0
+
+    def _submit(self, job):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._encoder_loop, name='video_encoder', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        self._jobs.put(job)
+
+    def _encoder_loop(self):
+        writer, writer_path = None, None
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is _STOP:
+                    if writer is not None:
+                        writer.close()
+                        os.remove(writer_path)
+                    return
+                if job[0] == 'write':  # ring buffer
+                    _, save_path, frames, order = job
+                    video_writer = imageio.get_writer(save_path, fps=self.fps)
+                    for idx in order:
+                        video_writer.append_data(frames[idx])
+                    video_writer.close()
+                elif job[0] == 'open':
+                    writer_path = job[1]
+                    writer = imageio.get_writer(writer_path, fps=self.fps)
+                elif job[0] == 'frame':
+                    if writer is not None:  # None if opening failed (already reported)
+                        writer.append_data(job[1])
+                elif job[0] == 'close':
+                    # save path, or None to discard the video
+                    if writer is None:
+                        continue
+                    writer.close()
+                    if job[1] is None:
+                        os.remove(writer_path)
+                    elif job[1] != writer_path:
+                        os.replace(writer_path, job[1])
+                    writer, writer_path = None, None
+            except Exception as e:
+                self._errors.append(repr(e))
+            finally:
+                self._jobs.task_done()
@@ -72,7 +72,7 @@ class Visualizer:
 
     def _get_scene_points_and_colors(self):
         # scene
-        cam_obs = self.env.get_cam_obs()
+        cam_obs = self.env.get_cam_obs(modalities=['points', 'rgb'])
         scene_points = []
         scene_colors = []
         for cam_id in range(len(cam_obs)):